@@ -1,22 +1,45 @@
 import os
 import io
-import zipfile
-import fitz  # PyMuPDF
-
-from pdf_fill import save_pdf_temp, load_pdf_bytes, get_pdf_page_info, apply_text_overlays
-
-from flask import Flask, render_template, request, send_file, redirect, jsonify
-from PIL import Image, ImageDraw, ImageFont
-from PyPDF2 import PdfReader, PdfWriter, PdfMerger
+import threading
+import shutil
+import mimetypes
+from typing import BinaryIO
+
+from pdf_fill import save_pdf_temp, get_pdf_page_info, apply_text_overlays_stream, pdf_path
+from pdf_store import StoreFull
+from formfill_bulk import BulkInputError, parse_layout, read_rows, iter_bulk_zip, bulk_concatenated_pdf, DEFAULT_NAME_TEMPLATE
+from jobs import JobQueue, QueueFull, QUEUED, RUNNING, DONE, report_progress, share_stats
+from ocr_engine import (OUTPUT_MODES as OCR_OUTPUT_MODES, HOCR_HEAD, HOCR_TAIL, TSV_HEADER,
+                        iter_ocr_output, ocr_image, ocr_pdf_pages, ocr_searchable_pdf)
+from zipstream import iter_zip
+from result_cache import ResultCache, CACHE_DIR, cache_key
+from batch import iter_batch_zip
+from pdf_compress import compress_pdf_images, rasterize_pdf_pages, COMPRESSED_SAVE_OPTIONS
+from watermark import stamp_text_watermark, load_font
+from docx_render import docx_to_pdf_stream
+from pdf_docx import pdf_to_docx_stream
+from pdf_pages import (PAGE_OPS, PageSpecError, parse_merge_spec, merge_pdfs_stream,
+                       page_op_stream, split_pdf_zip_chunks)
+from pdf_pipeline import PipelineError, parse_pipeline, pipeline_ops, protect_save_options, run_pipeline
+from image_pdf import PAGE_SIZE_CHOICES, FIT_CHOICES, images_to_pdf_stream
+from image_pipeline import (FORMATS as IMAGE_FORMATS, EXTENSIONS as IMAGE_EXTENSIONS,
+                            convert_image, load_image)
+from spool import SpooledRequest, upload_path, open_pdf, as_file, new_output, save_pdf
+import metrics
+from metrics import stage, add_pages
+
+from flask import Flask, Response, render_template, request, send_file, redirect, jsonify, stream_with_context
+from PIL import Image, ImageDraw
 from docx import Document
 from fpdf import FPDF
 import pytesseract
-from pdf2image import convert_from_bytes
 
 # =========================
 # App & Config
 # =========================
 app = Flask(__name__)
+# Uploads go straight to temp files on disk (see spool.py)
+app.request_class = SpooledRequest
 
 # Tesseract path: prefer ENV, fallback to your Windows path
 TESS_PATH = os.getenv("TESSERACT_PATH", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
@@ -25,14 +48,57 @@ try:
 except Exception:
     pass
 
-# Optional upload size limit (50 MB)
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50 MB
+# OCR: read pages that already have a text layer instead of running tesseract on them
+# (pool size / DPI are configured in ocr_engine.py via OCR_WORKERS / OCR_DPI)
+OCR_SKIP_TEXT_PAGES = os.getenv("OCR_SKIP_TEXT_PAGES", "1").lower() in ("1", "true", "yes")
+
+# Upload size limit (default 50 MB). Uploads are spooled to disk, so raising
+# this does not raise memory per worker.
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+
+# Background job lanes (see jobs.py); "heavy" = OCR/compress/rasterize, "light" = the rest
+app.config['JOB_HEAVY_WORKERS'] = int(os.getenv("JOB_HEAVY_WORKERS", "2"))
+app.config['JOB_LIGHT_WORKERS'] = int(os.getenv("JOB_LIGHT_WORKERS", "4"))
+app.config['JOB_QUEUE_DEPTH'] = int(os.getenv("JOB_QUEUE_DEPTH", "32"))
+app.config['JOB_HEAVY_TIMEOUT'] = float(os.getenv("JOB_HEAVY_TIMEOUT", "900"))  # seconds
+app.config['JOB_LIGHT_TIMEOUT'] = float(os.getenv("JOB_LIGHT_TIMEOUT", "60"))  # seconds
+app.config['JOB_RESULT_TTL'] = float(os.getenv("JOB_RESULT_TTL", "3600"))  # seconds
+
+# Content-addressed result cache (see result_cache.py)
+app.config['RESULT_CACHE_ENABLED'] = os.getenv("RESULT_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+app.config['RESULT_CACHE_DIR'] = CACHE_DIR
+app.config['RESULT_CACHE_MAX_MB'] = int(os.getenv("RESULT_CACHE_MAX_MB", "1024"))
+# Never cached: the output embeds something sensitive (e.g. the password);
+# the same goes for pipelines with a protect step
+NO_CACHE_CONVERSIONS = {"protect_pdf"}
+
+# DOCX -> PDF: "fitz" (docx_render.py: tables, images, styles, Unicode) or
+# "fpdf" (the old plain-text renderer)
+app.config['DOCX_PDF_ENGINE'] = os.getenv("DOCX_PDF_ENGINE", "fitz").lower()
+
+# Instrumentation (see metrics.py): counters at GET /metrics; optionally a
+# Server-Timing header with per-stage durations on every /convert response
+app.config['SERVER_TIMING'] = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "yes")
+
+result_cache = ResultCache(
+    app.config['RESULT_CACHE_DIR'],
+    max_bytes=app.config['RESULT_CACHE_MAX_MB'] * 1024 * 1024,
+)
+# background jobs use the cache from their own processes; count their hits here too
+share_stats(result_cache.counters, result_cache.merge_counters)
 
 
 # =========================
 # Helpers: Conversions
 # =========================
-def word_to_pdf_stream(docx_stream) -> io.BytesIO:
+def word_to_pdf_stream(docx_stream) -> BinaryIO:
+    """DOCX -> PDF with the engine selected by DOCX_PDF_ENGINE."""
+    if app.config['DOCX_PDF_ENGINE'] == "fpdf":
+        return word_to_pdf_stream_fpdf(docx_stream)
+    return docx_to_pdf_stream(docx_stream)
+
+
+def word_to_pdf_stream_fpdf(docx_stream) -> BinaryIO:
     """Very basic DOCX -> PDF (text only) using python-docx + FPDF."""
     doc = Document(docx_stream)
     pdf = FPDF()
@@ -46,276 +112,241 @@ def word_to_pdf_stream(docx_stream) -> io.BytesIO:
             pdf.ln(6)
         else:
             pdf.multi_cell(0, 8, text)
+    add_pages(pdf.page_no())
 
-    out = io.BytesIO()
-    pdf.output(out)
+    out = new_output()
+    # FPDF 1.7 can only return the document as a latin-1 string
+    with stage("save"):
+        out.write(pdf.output(dest="S").encode("latin1"))
     out.seek(0)
     return out
 
 
-def pdf_to_word_stream(pdf_bytes: bytes) -> io.BytesIO:
-    """Extracts text from PDF and writes to a DOCX."""
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    doc = Document()
-    for page in reader.pages:
-        txt = page.extract_text() or ""
-        if txt.strip():
-            for line in txt.splitlines():
-                doc.add_paragraph(line)
-        else:
-            doc.add_paragraph("")  # keep spacing
+def pdf_to_word_stream(pdf_src) -> BinaryIO:
+    """PDF (path or bytes) -> DOCX with paragraphs, headings, tables and images (see pdf_docx.py)."""
+    return pdf_to_docx_stream(pdf_src, progress=report_progress)
 
-    out = io.BytesIO()
-    doc.save(out)
-    out.seek(0)
-    return out
+
+def jpg_to_pdf_stream(image_streams, max_dimension: int = 0, page_size: str = "image",
+                      fit: str = "contain", dpi: int = 72) -> BinaryIO:
+    """
+    Combine one or more images into a single PDF, one page each (see image_pdf.py).
+    image_streams: iterable of image paths or file-like streams.
+    """
+    return images_to_pdf_stream(image_streams, page_size=page_size, fit=fit, dpi=dpi,
+                                max_dimension=max_dimension)
 
 
-def jpg_to_pdf_stream(image_streams) -> io.BytesIO:
+def iter_pdf_pages_as_jpg(doc, jpeg_quality: int = 85, dpi: int = 200):
     """
-    Combine one or more images into a single PDF.
-    image_streams: iterable of file-like image streams.
+    Render one page at a time and yield ("page_N.jpg", jpeg_bytes).
+    Only the current page's pixmap is alive, so memory does not grow with page count.
     """
-    images = []
-    for s in image_streams:
-        img = Image.open(s).convert("RGB")
-        images.append(img)
+    total = doc.page_count
+    for page in doc:
+        with stage("rasterize"):
+            pix = page.get_pixmap(dpi=dpi, alpha=False)
+            img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            pix = None
+        img_buf = io.BytesIO()
+        with stage("encode"):
+            img.save(img_buf, format="JPEG", quality=jpeg_quality, optimize=True)
+        img = None
+        add_pages(1)
+        yield f"page_{page.number + 1}.jpg", img_buf.getvalue()
+        report_progress(page.number + 1, total)
 
-    if not images:
-        raise ValueError("No images provided")
 
-    out = io.BytesIO()
-    if len(images) == 1:
-        images[0].save(out, format="PDF")
-    else:
-        images[0].save(out, format="PDF", save_all=True, append_images=images[1:])
-    out.seek(0)
-    return out
+def pdf_to_jpg_zip_chunks(pdf_src, jpeg_quality: int = 85, dpi: int = 200):
+    """
+    Convert all pages of a PDF to JPG and return an iterator of ZIP chunks,
+    suitable for a chunked HTTP response.
+    The PDF is opened up front so a broken upload fails before streaming starts.
+    """
+    doc = open_pdf(pdf_src)
 
+    def _chunks():
+        try:
+            yield from iter_zip(iter_pdf_pages_as_jpg(doc, jpeg_quality, dpi))
+        finally:
+            doc.close()
 
-def pdf_to_jpg_zip_stream(pdf_bytes: bytes, jpeg_quality: int = 85) -> io.BytesIO:
+    return _chunks()
+
+
+def pdf_to_jpg_zip_stream(pdf_src, jpeg_quality: int = 85) -> BinaryIO:
     """
-    Convert all pages of a PDF to JPG and return an in-memory ZIP.
+    Convert all pages of a PDF to JPG and return the ZIP as one stream.
     """
-    pil_pages = convert_from_bytes(pdf_bytes)
-    zip_buf = io.BytesIO()
-    with zipfile.ZipFile(zip_buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for i, page in enumerate(pil_pages, start=1):
-            page_rgb = page.convert("RGB")
-            img_buf = io.BytesIO()
-            page_rgb.save(img_buf, format="JPEG", quality=jpeg_quality, optimize=True)
-            img_buf.seek(0)
-            zf.writestr(f"page_{i}.jpg", img_buf.read())
+    zip_buf = new_output()
+    for chunk in pdf_to_jpg_zip_chunks(pdf_src, jpeg_quality=jpeg_quality):
+        zip_buf.write(chunk)
     zip_buf.seek(0)
     return zip_buf
 
 
-def jpg_to_png_stream(img_stream) -> io.BytesIO:
-    img = Image.open(img_stream).convert("RGBA")
-    out = io.BytesIO()
-    img.save(out, format="PNG", optimize=True)
-    out.seek(0)
-    return out
+def jpg_to_png_stream(img_stream, max_dimension: int = 0) -> BinaryIO:
+    return convert_image(img_stream, "PNG", max_dimension=max_dimension, optimize=False)
 
 
-def png_to_jpg_stream(img_stream, quality=90) -> io.BytesIO:
-    img = Image.open(img_stream).convert("RGB")
-    out = io.BytesIO()
-    img.save(out, format="JPEG", quality=quality, optimize=True)
-    out.seek(0)
-    return out
-
+def png_to_jpg_stream(img_stream, quality=90, max_dimension: int = 0, target_kb: int = 0,
+                      progressive: bool = False) -> BinaryIO:
+    return convert_image(img_stream, "JPEG", quality=quality, max_dimension=max_dimension,
+                         target_kb=target_kb, progressive=progressive, optimize=False)
 
-def merge_pdfs_stream(pdf_streams) -> io.BytesIO:
-    merger = PdfMerger()
-    for s in pdf_streams:
-        s.seek(0)
-        merger.append(s)
-    out = io.BytesIO()
-    merger.write(out)
-    merger.close()
-    out.seek(0)
-    return out
 
-
-def protect_pdf_stream(pdf_bytes: bytes, password: str) -> io.BytesIO:
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    for page in reader.pages:
-        writer.add_page(page)
-    if password:
-        writer.encrypt(password)
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return out
+def protect_pdf_stream(pdf_src, password: str) -> BinaryIO:
+    """Save a copy of the PDF encrypted with AES-256 (see pdf_pipeline.py); a blank password leaves it open."""
+    doc = open_pdf(pdf_src)
+    try:
+        add_pages(doc.page_count)
+        return save_pdf(doc, **(protect_save_options(password) if password else {}))
+    finally:
+        doc.close()
 
 
-def remove_pdf_pages_stream(pdf_bytes: bytes, remove_pages_input: str) -> io.BytesIO:
+def remove_pdf_pages_stream(pdf_src, remove_pages_input: str) -> BinaryIO:
     """
-    remove_pages_input: e.g., "1,3,5-7"
+    remove_pages_input: e.g., "1,3,5-7"; raises PageSpecError for a bad spec.
     """
-    to_remove = set()
-    if remove_pages_input:
-        parts = [p.strip() for p in remove_pages_input.split(",") if p.strip()]
-        for p in parts:
-            if "-" in p:
-                a, b = p.split("-", 1)
-                try:
-                    a_i = int(a)
-                    b_i = int(b)
-                    for num in range(min(a_i, b_i), max(a_i, b_i) + 1):
-                        to_remove.add(num)
-                except Exception:
-                    pass
-            else:
-                try:
-                    to_remove.add(int(p))
-                except Exception:
-                    pass
-
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    writer = PdfWriter()
-    total = len(reader.pages)
-    # Convert to zero-based
-    remove_zero_based = {n - 1 for n in to_remove if 1 <= n <= total}
-
-    for i in range(total):
-        if i not in remove_zero_based:
-            writer.add_page(reader.pages[i])
-
-    out = io.BytesIO()
-    writer.write(out)
-    out.seek(0)
-    return out
+    return page_op_stream(pdf_src, "remove", remove_pages_input)
 
 
 # =========================
 # Helpers: OCR
 # =========================
 def ocr_from_image_stream(img_stream) -> str:
-    image = Image.open(img_stream)
-    return pytesseract.image_to_string(image)
+    """OCR an image (upright, in grayscale) on a warm OCR worker (see ocr_engine.py)."""
+    image = load_image(img_stream, mode="L")
+    add_pages(1)
+    with stage("ocr"):
+        return ocr_image(image)
 
 
-def ocr_from_pdf_bytes(pdf_bytes: bytes) -> str:
-    pages = convert_from_bytes(pdf_bytes)
-    text = []
-    for page in pages:
-        text.append(pytesseract.image_to_string(page))
-    return "\n".join(text)
+def ocr_from_pdf_bytes(pdf_src) -> str:
+    """
+    OCR every page (PDF path or bytes) across the OCR process pool (see ocr_engine.py).
+    Pages that already have a text layer are read directly instead of OCR'd.
+    """
+    with stage("ocr"):
+        pages = ocr_pdf_pages(pdf_src, skip_text_pages=OCR_SKIP_TEXT_PAGES, progress=report_progress)
+    add_pages(len(pages))
+    return "\n".join(pages)
+
+
+def ocr_pdf_output(pdf_src, mode: str = "txt"):
+    """
+    OCR a PDF into `mode` (see ocr_engine.OUTPUT_MODES) with one rasterization
+    pass: txt/hocr/tsv come back as chunks streamed page by page, "pdf" as
+    the original pages with an invisible text layer added.
+    """
+    if mode == "pdf":
+        with stage("ocr"):
+            doc = ocr_searchable_pdf(pdf_src, progress=report_progress)
+        try:
+            add_pages(doc.page_count)
+            return save_pdf(doc, garbage=1, deflate=True)
+        finally:
+            doc.close()
+
+    def _page_done(done: int, total: int):
+        add_pages(1)
+        report_progress(done, total)
+
+    return iter_ocr_output(pdf_src, mode, skip_text_pages=OCR_SKIP_TEXT_PAGES, progress=_page_done)
+
+
+def ocr_image_output(img_stream, mode: str = "txt"):
+    """OCR an image into `mode`; "pdf" is the image as a page with a text layer."""
+    if mode == "pdf":
+        return ocr_pdf_output(jpg_to_pdf_stream([img_stream]).read(), "pdf")
+    image = load_image(img_stream, mode="L")
+    add_pages(1)
+    with stage("ocr"):
+        result = ocr_image(image, mode=mode)
+    if mode == "hocr":
+        result = HOCR_HEAD + result + HOCR_TAIL
+    elif mode == "tsv":
+        result = TSV_HEADER + result
+    return io.BytesIO(result.encode("utf-8"))
 
 
 # =========================
 # Helpers: Compression
 # =========================
-def compress_image_stream(img_stream, quality: int) -> io.BytesIO:
+def compress_image_stream(img_stream, quality: int, max_dimension: int = 0, target_kb: int = 0,
+                          fmt: str = "JPEG", progressive: bool = False) -> BinaryIO:
     """
-    Compress any image to JPEG with the given quality.
+    Compress any image to JPEG (or WebP) with the given quality, optionally
+    capped at `max_dimension` pixels or fitted under `target_kb`. A JPEG
+    that is already small enough is returned unchanged (see image_pipeline.py).
     """
-    img = Image.open(img_stream).convert("RGB")
-    out = io.BytesIO()
-    img.save(out, format="JPEG", quality=quality, optimize=True)
-    out.seek(0)
-    return out
+    return convert_image(img_stream, fmt, quality=quality, max_dimension=max_dimension,
+                         target_kb=target_kb, progressive=progressive)
 
 
-def compress_pdf_bytes(pdf_bytes: bytes, dpi: int, jpeg_quality: int) -> io.BytesIO:
+def compress_pdf_bytes(pdf_src, dpi: int, jpeg_quality: int, mode: str = "images") -> BinaryIO:
     """
-    Rasterize each PDF page at `dpi` and re-embed as JPEG with `jpeg_quality`.
+    Compress a PDF (path or bytes); see pdf_compress.py.
+    mode="images": downsample embedded images above `dpi` to `dpi` and re-encode
+    them as JPEG, keeping text and vectors intact (default).
+    mode="rasterize": render each page at `dpi` as one JPEG (old behaviour).
+    If the result is not smaller than the input, the input is returned unchanged.
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    for page in doc:
-        pix = page.get_pixmap(dpi=dpi)
-        mode = "RGB" if pix.alpha == 0 else "RGBA"
-        pil = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
-        img_buf = io.BytesIO()
-        pil.convert("RGB").save(img_buf, format="JPEG", quality=jpeg_quality, optimize=True)
-        img_buf.seek(0)
-        rect = page.rect
-        page.clean_contents()
-        page.insert_image(rect, stream=img_buf.getvalue())
-    out = io.BytesIO()
-    doc.save(out)
-    out.seek(0)
+    doc = open_pdf(pdf_src)
+    add_pages(doc.page_count)
+    if mode == "rasterize":
+        with stage("rasterize"):
+            rasterize_pdf_pages(doc, dpi, jpeg_quality, progress=report_progress)
+    else:
+        with stage("recompress"):
+            compress_pdf_images(doc, target_dpi=dpi, jpeg_quality=jpeg_quality, progress=report_progress)
+    out = save_pdf(doc, **COMPRESSED_SAVE_OPTIONS)
     doc.close()
+
+    out.seek(0, os.SEEK_END)
+    out_size = out.tell()
+    out.seek(0)
+    in_size = len(pdf_src) if isinstance(pdf_src, (bytes, bytearray)) else os.path.getsize(pdf_src)
+    if out_size >= in_size:
+        out.close()
+        out = new_output()
+        if isinstance(pdf_src, (bytes, bytearray)):
+            out.write(pdf_src)
+        else:
+            with open(pdf_src, "rb") as f:
+                shutil.copyfileobj(f, out)
+        out.seek(0)
     return out
 
 
 # =========================
 # Helpers: Text Watermark
 # =========================
-def add_text_watermark_to_pdf(pdf_bytes: bytes, text: str,
-                              font_size=48, opacity=0.3, rotation=45) -> io.BytesIO:
+def add_text_watermark_to_pdf(pdf_src, text: str,
+                              font_size=48, opacity=0.3, rotation=45) -> BinaryIO:
     """
-    Cross-version safe: draw text with PIL -> rotate -> insert as image.
-    Works on old/new PyMuPDF (no matrix arg needed).
+    Draw text with PIL -> rotate -> insert as image (see watermark.py).
+    The stamp is rendered once and shared by all pages via one image xref.
+    pdf_src: PDF path or bytes.
     """
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-
-    for page in doc:
-        rect = page.rect
-        page_w, page_h = rect.width, rect.height
-
-        # Pick a font (fallback if TTF missing)
-        try:
-            font = ImageFont.truetype("arial.ttf", size=font_size)
-        except Exception:
-            font = ImageFont.load_default()
-
-        # Measure text
-        tmp_img = Image.new("RGBA", (10, 10), (0, 0, 0, 0))
-        tmp_draw = ImageDraw.Draw(tmp_img)
-        l, t, r, b = tmp_draw.textbbox((0, 0), text, font=font)
-        text_w, text_h = r - l, b - t
-
-        # Draw text onto a transparent image with small padding
-        pad = 20
-        txt_img = Image.new("RGBA", (text_w + 2 * pad, text_h + 2 * pad), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(txt_img)
-        alpha = max(0, min(255, int(opacity * 255)))
-        draw.text((pad, pad), text, font=font, fill=(128, 128, 128, alpha))
-
-        # Rotate to any angle
-        rotated = txt_img.rotate(rotation, expand=True, resample=Image.BICUBIC)
-
-        # Scale to ~60% of page width (keep aspect ratio)
-        target_w = page_w * 0.6
-        scale = target_w / rotated.width
-        target_w_pts = target_w
-        target_h_pts = rotated.height * scale
-
-        # Center on page
-        x0 = rect.x0 + (page_w - target_w_pts) / 2
-        y0 = rect.y0 + (page_h - target_h_pts) / 2
-        img_rect = fitz.Rect(x0, y0, x0 + target_w_pts, y0 + target_h_pts)
-
-        # Encode rotated image as PNG (preserves transparency)
-        buf = io.BytesIO()
-        rotated.save(buf, format="PNG")
-        buf.seek(0)
-
-        # Insert as image
-        page.insert_image(img_rect, stream=buf.getvalue(), keep_proportion=True, overlay=True)
-
-    out = io.BytesIO()
-    doc.save(out)
-    out.seek(0)
+    doc = open_pdf(pdf_src)
+    add_pages(doc.page_count)
+    with stage("watermark"):
+        stamp_text_watermark(doc, text, font_size, opacity, rotation, progress=report_progress)
+    out = save_pdf(doc)
     doc.close()
     return out
 
 
-def add_text_watermark_to_image(img_stream, text: str) -> io.BytesIO:
-    base = Image.open(img_stream).convert("RGBA")
+def add_text_watermark_to_image(img_stream, text: str) -> BinaryIO:
+    base = load_image(img_stream, mode="RGBA")
     W, H = base.size
     layer = Image.new("RGBA", base.size, (0, 0, 0, 0))
     draw = ImageDraw.Draw(layer)
 
     # Choose font
-    try:
-        font = ImageFont.truetype("arial.ttf", size=max(24, int(min(W, H) * 0.05)))
-    except Exception:
-        font = ImageFont.load_default()
+    font = load_font(max(24, int(min(W, H) * 0.05)))
 
     bbox = draw.textbbox((0, 0), text, font=font)
     text_w, text_h = bbox[2] - bbox[0], bbox[3] - bbox[1]
@@ -330,7 +361,7 @@ def add_text_watermark_to_image(img_stream, text: str) -> io.BytesIO:
     layer.alpha_composite(rotated, (rx, ry))
 
     out_img = Image.alpha_composite(base, layer)
-    out = io.BytesIO()
+    out = new_output()
     out_img.save(out, format="PNG")
     out.seek(0)
     return out
@@ -345,14 +376,30 @@ def index():
 
 
 # =========================
-# Routes: Convert (existing features)
+# Conversion dispatch (shared by /convert and background jobs)
 # =========================
-@app.route('/convert', methods=['POST'])
-def convert():
-    conversion_type = request.form.get('conversion_type', '').strip()
+class ConversionError(Exception):
+    """Bad input for a conversion; reported to the client as a 400."""
+
+
+# Conversions that can hold a worker for minutes go to the "heavy" job lane
+HEAVY_CONVERSIONS = {"ocr", "compress", "pdf_to_word", "word_to_pdf", "pdf_to_jpg", "watermark", "merge_pdfs",
+                     "pipeline"}
+CONVERSION_TYPES = HEAVY_CONVERSIONS | {"protect_pdf", "remove_pages", "page_ops", "jpg_to_pdf", "jpg_to_png",
+                                        "png_to_jpg"}
+
+
+def _int_field(form, name: str, default: int) -> int:
+    try:
+        return int((form.get(name) or "").strip() or default)
+    except ValueError:
+        raise ConversionError(f"'{name}' must be a whole number")
+
 
+def parse_conversion_options(form) -> dict:
+    """Read the optional /convert form fields into plain (picklable) values."""
     # Compression level mapping
-    compression_level = request.form.get('compression_level', '').strip().lower()
+    compression_level = (form.get('compression_level') or '').strip().lower()
     # defaults
     img_quality = 75
     pdf_dpi = 100
@@ -371,156 +418,447 @@ def convert():
             pdf_dpi = 150
             pdf_jpeg_q = 75
 
-    # Watermark (text only)
-    watermark_text_value = (request.form.get('watermark_text_value') or "").strip()
+    # PDF compression engine: "images" (recompress embedded images) or "rasterize"
+    compression_mode = (form.get('compression_mode') or "images").strip().lower()
+    if compression_mode not in ("images", "rasterize"):
+        compression_mode = "images"
+
+    # Compressed image output: JPEG or WebP
+    image_format = IMAGE_FORMATS.get((form.get('image_format') or "jpeg").strip().lower())
+    if image_format not in ("JPEG", "WEBP"):
+        raise ConversionError("image_format must be jpeg or webp")
+
+    ocr_output = (form.get('ocr_output') or "txt").strip().lower()
+    if ocr_output not in OCR_OUTPUT_MODES:
+        raise ConversionError(f"ocr_output must be one of: {', '.join(OCR_OUTPUT_MODES)}")
+    page_size = (form.get('page_size') or "image").strip().lower()
+    if page_size not in PAGE_SIZE_CHOICES:
+        raise ConversionError(f"page_size must be one of: {', '.join(PAGE_SIZE_CHOICES)}")
+    image_fit = (form.get('image_fit') or "contain").strip().lower()
+    if image_fit not in FIT_CHOICES:
+        raise ConversionError(f"image_fit must be one of: {', '.join(FIT_CHOICES)}")
+    image_dpi = _int_field(form, 'image_dpi', 72)
+    if not 1 <= image_dpi <= 2400:
+        raise ConversionError("image_dpi must be between 1 and 2400")
+
+    return {
+        "compression_mode": compression_mode,
+        "img_quality": img_quality,
+        "pdf_dpi": pdf_dpi,
+        "pdf_jpeg_q": pdf_jpeg_q,
+        # Watermark (text only)
+        "watermark_text_value": (form.get('watermark_text_value') or "").strip(),
+        # Other fields
+        "password": form.get('password') or "",
+        "remove_pages_input": form.get('remove_pages_input') or "",
+        # Page operations: remove/extract/reorder/rotate/split on a page spec
+        "page_op": (form.get('page_op') or "extract").strip().lower(),
+        "page_spec": form.get('page_spec') or "",
+        "page_rotate": _int_field(form, 'page_rotate', 90),
+        "split_every": _int_field(form, 'split_every', 0),
+        # Images: cap on the longer side (px), output size target, output format
+        "max_dimension": _int_field(form, 'max_dimension', 0),
+        "target_kb": _int_field(form, 'target_kb', 0),
+        "image_format": image_format,
+        "progressive": (form.get('progressive') or "").lower() in ("1", "true", "yes", "on"),
+        # OCR: txt, hocr, tsv or a searchable pdf
+        "ocr_output": ocr_output,
+        # Images -> PDF: page size, how the image fills it, resolution for "image"-sized pages
+        "page_size": page_size,
+        "image_fit": image_fit,
+        "image_dpi": image_dpi,
+        # Merge: page ranges per file (one line each) or a JSON spec; bookmark per file
+        "merge_spec": form.get('merge_spec') or "",
+        "merge_bookmarks": (form.get('merge_bookmarks') or "1").lower() in ("1", "true", "yes", "on"),
+        # Pipeline: JSON list of operations run on one document (see pdf_pipeline.py)
+        "pipeline_steps": form.get('steps') or "",
+    }
+
+
+def run_conversion(conversion_type: str, uploads, options: dict):
+    """
+    Run one conversion and return (output, download name).
+    output is a file-like stream, or an iterator of bytes chunks for
+    conversions that stream their result (see send_conversion_result).
+    uploads: list of (filename, source) pairs in upload order, where source is
+    a path on disk (spooled upload) or raw bytes.
+    Raises ConversionError for invalid input.
+    """
+    if not uploads:
+        raise ConversionError("No file uploaded")
+
+    # by default, use the first file for 1-file operations
+    first_name, first_src = uploads[0]
+    fname = (first_name or "").lower()
+
+    # =======================
+    # Multi-file operations
+    # =======================
+    if conversion_type == "merge_pdfs":
+        # accept multiple PDFs
+        for name, src in uploads:
+            if not (name or "").lower().endswith(".pdf"):
+                raise ConversionError("All files must be PDFs for merging.")
+        try:
+            parts = parse_merge_spec(options["merge_spec"], uploads)
+            return merge_pdfs_stream(parts, bookmarks=options["merge_bookmarks"]), "merged.pdf"
+        except PageSpecError as e:
+            raise ConversionError(str(e))
+
+    if conversion_type == "pipeline":
+        # the first PDF is worked on; the rest are only used by a merge step
+        for name, src in uploads:
+            if not (name or "").lower().endswith(".pdf"):
+                raise ConversionError("All files must be PDFs for a pipeline.")
+        try:
+            steps = parse_pipeline(options["pipeline_steps"], uploads)
+            return run_pipeline(first_src, steps), "pipeline.pdf"
+        except PipelineError as e:
+            raise ConversionError(str(e))
+
+    # =======================
+    # Single-file operations
+    # =======================
+    # ---- OCR ----
+    if conversion_type == "ocr":
+        mode = options["ocr_output"]
+        download_name = "searchable.pdf" if mode == "pdf" else f"ocr_output.{mode}"
+        if fname.endswith((".png", ".jpg", ".jpeg")):
+            return ocr_image_output(as_file(first_src), mode), download_name
+        elif fname.endswith(".pdf"):
+            return ocr_pdf_output(first_src, mode), download_name
+        else:
+            raise ConversionError("Unsupported file format for OCR")
+
+    # ---- Compress ----
+    if conversion_type == "compress":
+        if fname.endswith((".png", ".jpg", ".jpeg")):
+            out = compress_image_stream(as_file(first_src), quality=options["img_quality"],
+                                        max_dimension=options["max_dimension"], target_kb=options["target_kb"],
+                                        fmt=options["image_format"], progressive=options["progressive"])
+            return out, "compressed_image" + IMAGE_EXTENSIONS[options["image_format"]]
+        elif fname.endswith(".pdf"):
+            out = compress_pdf_bytes(first_src, dpi=options["pdf_dpi"], jpeg_quality=options["pdf_jpeg_q"],
+                                     mode=options["compression_mode"])
+            return out, "compressed_file.pdf"
+        else:
+            raise ConversionError("Unsupported file format for compression")
+
+    # ---- Watermark (text only) ----
+    if conversion_type == "watermark":
+        watermark_text_value = options["watermark_text_value"]
+        if not watermark_text_value:
+            raise ConversionError("Please provide watermark text.")
+
+        if fname.endswith(".pdf"):
+            out = add_text_watermark_to_pdf(first_src, watermark_text_value)
+            return out, "watermarked_text.pdf"
+        elif fname.endswith((".png", ".jpg", ".jpeg")):
+            out = add_text_watermark_to_image(as_file(first_src), watermark_text_value)
+            return out, "watermarked.png"
+        else:
+            raise ConversionError("Watermark option is only available for PDF or Image files")
+
+    # ---- Protect PDF ----
+    if conversion_type == "protect_pdf":
+        if not fname.endswith(".pdf"):
+            raise ConversionError("Please upload a PDF to protect.")
+        return protect_pdf_stream(first_src, password=options["password"]), "protected.pdf"
+
+    # ---- Remove PDF Pages ----
+    if conversion_type == "remove_pages":
+        if not fname.endswith(".pdf"):
+            raise ConversionError("Please upload a PDF to modify.")
+        try:
+            return remove_pdf_pages_stream(first_src, options["remove_pages_input"]), "modified.pdf"
+        except PageSpecError as e:
+            raise ConversionError(str(e))
+
+    # ---- Page operations ----
+    if conversion_type == "page_ops":
+        if not fname.endswith(".pdf"):
+            raise ConversionError("Please upload a PDF to modify.")
+        op = options["page_op"]
+        if op not in PAGE_OPS:
+            raise ConversionError(f"Unknown page operation '{op}'")
+        try:
+            if op == "split":
+                stem = os.path.splitext(os.path.basename(first_name or ""))[0] or "part"
+                return split_pdf_zip_chunks(first_src, options["page_spec"], options["split_every"],
+                                            stem=stem), "split_pages.zip"
+            return page_op_stream(first_src, op, options["page_spec"], options["page_rotate"]), f"{op}_pages.pdf"
+        except PageSpecError as e:
+            raise ConversionError(str(e))
+
+    # ---- Word -> PDF ----
+    if conversion_type == "word_to_pdf":
+        if not fname.endswith(".docx"):
+            raise ConversionError("Please upload a .docx file.")
+        return word_to_pdf_stream(as_file(first_src)), "output.pdf"
+
+    # ---- PDF -> Word ----
+    if conversion_type == "pdf_to_word":
+        if not fname.endswith(".pdf"):
+            raise ConversionError("Please upload a PDF file.")
+        return pdf_to_word_stream(first_src), "output.docx"
+
+    # ---- JPG -> PDF ----
+    if conversion_type == "jpg_to_pdf":
+        if not fname.endswith((".jpg", ".jpeg", ".png")):
+            raise ConversionError("Please upload an image (JPG/PNG).")
+        image_streams = [as_file(src) for name, src in uploads
+                         if (name or "").lower().endswith((".jpg", ".jpeg", ".png"))]
+        if not image_streams:
+            raise ConversionError("No valid images found.")
+        return jpg_to_pdf_stream(image_streams, max_dimension=options["max_dimension"],
+                                 page_size=options["page_size"], fit=options["image_fit"],
+                                 dpi=options["image_dpi"]), "output.pdf"
+
+    # ---- PDF -> JPG (ZIP) ----
+    if conversion_type == "pdf_to_jpg":
+        if not fname.endswith(".pdf"):
+            raise ConversionError("Please upload a PDF file.")
+        return pdf_to_jpg_zip_chunks(first_src, jpeg_quality=85), "pdf_pages.zip"
+
+    # ---- JPG -> PNG ----
+    if conversion_type == "jpg_to_png":
+        if not fname.endswith((".jpg", ".jpeg")):
+            raise ConversionError("Please upload a JPG/JPEG image.")
+        return jpg_to_png_stream(as_file(first_src), max_dimension=options["max_dimension"]), "output.png"
+
+    # ---- PNG -> JPG ----
+    if conversion_type == "png_to_jpg":
+        if not fname.endswith(".png"):
+            raise ConversionError("Please upload a PNG image.")
+        return png_to_jpg_stream(as_file(first_src), quality=90, max_dimension=options["max_dimension"],
+                                 target_kb=options["target_kb"], progressive=options["progressive"]), "output.jpg"
+
+    # Fallback
+    raise ConversionError("Invalid conversion type")
+
+
+def run_conversion_cached(conversion_type: str, uploads, options: dict):
+    """
+    run_conversion() behind the result cache. A hit returns the stored output
+    without converting again. Set options["no_cache"] to bypass for one request.
+    """
+    options = dict(options)
+    no_cache = options.pop("no_cache", False)
+    if (no_cache or not app.config['RESULT_CACHE_ENABLED']
+            or conversion_type in NO_CACHE_CONVERSIONS
+            or (conversion_type == "pipeline" and "protect" in pipeline_ops(options.get("pipeline_steps", "")))):
+        with stage("convert"):
+            return run_conversion(conversion_type, uploads, options)
+
+    key_options = options
+    if conversion_type == "word_to_pdf":
+        # the output depends on the engine; after a switch, don't serve the other engine's PDFs
+        key_options = dict(options, docx_pdf_engine=app.config['DOCX_PDF_ENGINE'])
+    with stage("cache"):
+        key = cache_key(conversion_type, uploads, key_options)
+        hit = result_cache.get(key)
+    metrics.record_cache(hit is not None)
+    if hit is not None:
+        return hit
+    with stage("convert"):
+        out, download_name = run_conversion(conversion_type, uploads, options)
+    return result_cache.put(key, out, download_name), download_name
+
+
+def convert_uploads(conversion_type: str, uploads, options: dict):
+    """
+    Entry point for /convert and background jobs.
+    With options["batch"] set, the conversion runs once per uploaded file on
+    the batch pool and the result is a ZIP (plus manifest.json) of all outputs.
+    """
+    options = dict(options)
+    if not options.pop("batch", False):
+        return run_conversion_cached(conversion_type, uploads, options)
+    if conversion_type not in CONVERSION_TYPES:
+        raise ConversionError("Invalid conversion type")
+    if not uploads:
+        raise ConversionError("No file uploaded")
+    return iter_batch_zip(run_conversion_cached, conversion_type, uploads, options), f"batch_{conversion_type}.zip"
+
+
+# =========================
+# Background jobs
+# =========================
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Create the job lanes on first use (keeps worker threads out of import time)."""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            cfg = app.config
+            _job_queue = JobQueue(
+                convert_uploads,
+                lanes={
+                    "heavy": {
+                        "workers": cfg['JOB_HEAVY_WORKERS'],
+                        "queue_depth": cfg['JOB_QUEUE_DEPTH'],
+                        "timeout": cfg['JOB_HEAVY_TIMEOUT'],
+                    },
+                    "light": {
+                        "workers": cfg['JOB_LIGHT_WORKERS'],
+                        "queue_depth": cfg['JOB_QUEUE_DEPTH'],
+                        "timeout": cfg['JOB_LIGHT_TIMEOUT'],
+                    },
+                },
+                result_ttl=cfg['JOB_RESULT_TTL'],
+            )
+        return _job_queue
+
+
+def send_conversion_result(out, download_name: str):
+    """send_file() for streams; a chunked response for chunk iterators."""
+    if hasattr(out, "read"):
+        return send_file(out, as_attachment=True, download_name=download_name)
+    mimetype = mimetypes.guess_type(download_name)[0] or "application/octet-stream"
+    return Response(
+        stream_with_context(out),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{download_name}"'},
+    )
+
+
+def _form_flag(req, name: str) -> bool:
+    value = (req.form.get(name) or req.args.get(name) or "").strip().lower()
+    return value in ("1", "true", "yes", "on")
+
+
+def _stream_size(stream) -> int:
+    try:
+        return os.fstat(stream.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def _finish_metrics(rm, rv):
+    """
+    Attach the Server-Timing header (stages up to now) and record the request.
+    Streamed results are recorded when the response is closed, so producing
+    the chunks is included; file results (send_file bypasses close callbacks)
+    are already complete and are recorded right away.
+    """
+    response = app.make_response(rv)
+    if app.config['SERVER_TIMING'] and rm.stages:
+        response.headers["Server-Timing"] = rm.server_timing()
+    if response.direct_passthrough:
+        metrics.finish(rm, response.status_code)
+    else:
+        response.call_on_close(lambda: metrics.finish(rm, response.status_code))
+    return response
+
+
+# =========================
+# Routes: Convert (existing features)
+# =========================
+@app.route('/convert', methods=['POST'])
+def convert():
+    rm = metrics.begin()
+    with stage("upload"):  # the form (and every file) is parsed and spooled on first access
+        conversion_type = request.form.get('conversion_type', '').strip()
+        files = request.files.getlist('file')
+    rm.conversion_type = conversion_type if conversion_type in CONVERSION_TYPES else "unknown"
+    response = _convert(conversion_type, files)
+    return _finish_metrics(rm, response)
 
-    # Other fields
-    password = request.form.get('password') or ""
-    remove_pages_input = request.form.get('remove_pages_input') or ""
 
-    files = request.files.getlist('file')
+@app.route('/pipeline', methods=['POST'])
+def pipeline():
+    """/convert with conversion_type=pipeline: the `steps` field lists the operations."""
+    rm = metrics.begin("pipeline")
+    with stage("upload"):
+        files = request.files.getlist('file')
+    return _finish_metrics(rm, _convert("pipeline", files))
+
+
+def _convert(conversion_type: str, files):
+    try:
+        options = parse_conversion_options(request.form)
+    except ConversionError as e:
+        return str(e), 400
+    options["no_cache"] = _form_flag(request, 'no_cache')
+    options["batch"] = _form_flag(request, 'batch')
+
     if not files:
         return "No file uploaded", 400
+    for f in files:
+        metrics.add_bytes_in(f.content_length or _stream_size(f.stream))
 
-    try:
-        # by default, use the first file for 1-file operations
-        first_file = files[0]
-        fname = (first_file.filename or "").lower()
-
-        # =======================
-        # Multi-file operations
-        # =======================
-        if conversion_type == "merge_pdfs":
-            # accept multiple PDFs
-            streams = []
-            for f in files:
-                if not f.filename.lower().endswith(".pdf"):
-                    return "All files must be PDFs for merging.", 400
-                pdf_bytes = f.read()
-                f.seek(0)
-                streams.append(io.BytesIO(pdf_bytes))
-            out = merge_pdfs_stream(streams)
-            return send_file(out, as_attachment=True, download_name="merged.pdf")
-
-        # =======================
-        # Single-file operations
-        # =======================
-        # ---- OCR ----
-        if conversion_type == "ocr":
-            if fname.endswith((".png", ".jpg", ".jpeg")):
-                text = ocr_from_image_stream(first_file.stream)
-            elif fname.endswith(".pdf"):
-                pdf_bytes = first_file.read()
-                first_file.seek(0)
-                text = ocr_from_pdf_bytes(pdf_bytes)
-            else:
-                return "Unsupported file format for OCR", 400
-            out = io.BytesIO(text.encode("utf-8"))
-            return send_file(out, as_attachment=True, download_name="ocr_output.txt")
-
-        # ---- Compress ----
-        if conversion_type == "compress":
-            if fname.endswith((".png", ".jpg", ".jpeg")):
-                out = compress_image_stream(first_file.stream, quality=img_quality)
-                return send_file(out, as_attachment=True, download_name="compressed_image.jpg")
-            elif fname.endswith(".pdf"):
-                pdf_bytes = first_file.read()
-                first_file.seek(0)
-                out = compress_pdf_bytes(pdf_bytes, dpi=pdf_dpi, jpeg_quality=pdf_jpeg_q)
-                return send_file(out, as_attachment=True, download_name="compressed_file.pdf")
-            else:
-                return "Unsupported file format for compression", 400
-
-        # ---- Watermark (text only) ----
-        if conversion_type == "watermark":
-            if not watermark_text_value:
-                return "Please provide watermark text.", 400
-
-            if fname.endswith(".pdf"):
-                pdf_bytes = first_file.read()
-                first_file.seek(0)
-                out = add_text_watermark_to_pdf(pdf_bytes, watermark_text_value)
-                return send_file(out, as_attachment=True, download_name="watermarked_text.pdf")
-            elif fname.endswith((".png", ".jpg", ".jpeg")):
-                out = add_text_watermark_to_image(first_file.stream, watermark_text_value)
-                return send_file(out, as_attachment=True, download_name="watermarked.png")
-            else:
-                return "Watermark option is only available for PDF or Image files", 400
-
-        # ---- Protect PDF ----
-        if conversion_type == "protect_pdf":
-            if not fname.endswith(".pdf"):
-                return "Please upload a PDF to protect.", 400
-            pdf_bytes = first_file.read()
-            first_file.seek(0)
-            out = protect_pdf_stream(pdf_bytes, password=password)
-            return send_file(out, as_attachment=True, download_name="protected.pdf")
-
-        # ---- Remove PDF Pages ----
-        if conversion_type == "remove_pages":
-            if not fname.endswith(".pdf"):
-                return "Please upload a PDF to modify.", 400
-            pdf_bytes = first_file.read()
-            first_file.seek(0)
-            out = remove_pdf_pages_stream(pdf_bytes, remove_pages_input)
-            return send_file(out, as_attachment=True, download_name="modified.pdf")
-
-        # ---- Word -> PDF ----
-        if conversion_type == "word_to_pdf":
-            if not fname.endswith(".docx"):
-                return "Please upload a .docx file.", 400
-            out = word_to_pdf_stream(first_file.stream)
-            return send_file(out, as_attachment=True, download_name="output.pdf")
-
-        # ---- PDF -> Word ----
-        if conversion_type == "pdf_to_word":
-            if not fname.endswith(".pdf"):
-                return "Please upload a PDF file.", 400
-            pdf_bytes = first_file.read()
-            first_file.seek(0)
-            out = pdf_to_word_stream(pdf_bytes)
-            return send_file(out, as_attachment=True, download_name="output.docx")
-
-        # ---- JPG -> PDF ----
-        if conversion_type == "jpg_to_pdf":
-            if not fname.endswith((".jpg", ".jpeg", ".png")):
-                return "Please upload an image (JPG/PNG).", 400
-            image_streams = [f.stream for f in files if f.filename.lower().endswith((".jpg", ".jpeg", ".png"))]
-            if not image_streams:
-                return "No valid images found.", 400
-            out = jpg_to_pdf_stream(image_streams)
-            return send_file(out, as_attachment=True, download_name="output.pdf")
-
-        # ---- PDF -> JPG (ZIP) ----
-        if conversion_type == "pdf_to_jpg":
-            if not fname.endswith(".pdf"):
-                return "Please upload a PDF file.", 400
-            pdf_bytes = first_file.read()
-            first_file.seek(0)
-            out = pdf_to_jpg_zip_stream(pdf_bytes, jpeg_quality=85)
-            return send_file(out, as_attachment=True, download_name="pdf_pages.zip")
-
-        # ---- JPG -> PNG ----
-        if conversion_type == "jpg_to_png":
-            if not fname.endswith((".jpg", ".jpeg")):
-                return "Please upload a JPG/JPEG image.", 400
-            out = jpg_to_png_stream(first_file.stream)
-            return send_file(out, as_attachment=True, download_name="output.png")
-
-        # ---- PNG -> JPG ----
-        if conversion_type == "png_to_jpg":
-            if not fname.endswith(".png"):
-                return "Please upload a PNG image.", 400
-            out = png_to_jpg_stream(first_file.stream, quality=90)
-            return send_file(out, as_attachment=True, download_name="output.jpg")
-
-        # Fallback
-        return "Invalid conversion type", 400
+    # ---- Job-submission mode: queue and return a job id right away ----
+    if _form_flag(request, 'async'):
+        lane = "heavy" if conversion_type in HEAVY_CONVERSIONS else "light"
+        try:
+            job = get_job_queue().submit(
+                lane, conversion_type, [(f.filename, upload_path(f)) for f in files], options
+            )
+        except QueueFull as e:
+            return jsonify({"error": str(e)}), 503
+        return jsonify({
+            "job_id": job.id,
+            "state": job.state,
+            "status_url": f"/jobs/{job.id}",
+            "result_url": f"/jobs/{job.id}/result",
+        }), 202
 
+    try:
+        uploads = [(f.filename, upload_path(f)) for f in files]
+        out, download_name = convert_uploads(conversion_type, uploads, options)
+        return send_conversion_result(metrics.count_output(metrics.current(), out), download_name)
+    except ConversionError as e:
+        return str(e), 400
     except Exception as e:
         return f"Error: {e}", 500
 
 
+# =========================
+# Routes: Result cache
+# =========================
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+# =========================
+# Routes: Metrics
+# =========================
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# =========================
+# Routes: Jobs
+# =========================
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(get_job_queue().status(job))
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.state in (QUEUED, RUNNING):
+        return jsonify(get_job_queue().status(job)), 202
+    if job.state != DONE:
+        return jsonify(get_job_queue().status(job)), 500
+    return send_file(
+        os.path.abspath(job.result_path),
+        as_attachment=True,
+        download_name=job.download_name,
+    )
+
+
 # =========================
 # Routes: PDF Form Fill (Click-anywhere UI)
 # =========================
@@ -534,24 +872,38 @@ def formfill_upload():
     file = request.files.get("pdf")
     if not file or not (file.filename or "").lower().endswith(".pdf"):
         return "No PDF uploaded", 400
-    pdf_id = save_pdf_temp(file.read())
+    try:
+        pdf_id = save_pdf_temp(file.stream)
+    except StoreFull as e:
+        return str(e), 413
     return redirect(f"/formfill/editor/{pdf_id}")
 
 
 @app.route("/formfill/editor/<pdf_id>")
 def formfill_editor(pdf_id):
     # Provide page sizes for UI (PDF.js will render visually)
-    info = get_pdf_page_info(pdf_id)
+    try:
+        info = get_pdf_page_info(pdf_id)
+    except (ValueError, FileNotFoundError):
+        return "Unknown PDF", 404
     return render_template("formfill_editor.html", pdf_id=pdf_id, pdf_info=info)
 
 
 @app.route("/formfill/file/<pdf_id>")
 def formfill_file(pdf_id):
-    pdf_bytes = load_pdf_bytes(pdf_id)
+    # Served from disk with ETag / conditional GET / Range support, so PDF.js
+    # can fetch large forms progressively and revalidate instead of re-downloading
+    try:
+        path = pdf_path(pdf_id)
+    except (ValueError, FileNotFoundError):
+        return "Unknown PDF", 404
     return send_file(
-        io.BytesIO(pdf_bytes),
+        path,
         download_name=f"{pdf_id}.pdf",
-        mimetype="application/pdf"
+        mimetype="application/pdf",
+        conditional=True,
+        etag=True,
+        max_age=0,
     )
 
 
@@ -562,16 +914,63 @@ def formfill_apply(pdf_id):
         overlays = data.get("overlays", [])
     except Exception:
         return jsonify({"error": "Invalid JSON"}), 400
+    if not isinstance(overlays, list):
+        return jsonify({"error": "overlays must be a list"}), 400
 
-    filled_pdf = apply_text_overlays(pdf_id, overlays)
+    try:
+        filled_pdf = apply_text_overlays_stream(pdf_id, overlays)
+    except (ValueError, FileNotFoundError):
+        return jsonify({"error": "Unknown PDF"}), 404
     return send_file(
-        io.BytesIO(filled_pdf),
+        filled_pdf,
         as_attachment=True,
         download_name=f"filled_{pdf_id}.pdf",
         mimetype="application/pdf"
     )
 
 
+@app.route("/formfill/bulk/<pdf_id>", methods=["POST"])
+def formfill_bulk(pdf_id):
+    """
+    Mail-merge: fill the template once per data row (see formfill_bulk.py).
+    Form fields: layout (JSON, or an uploaded .json file), rows (CSV/JSONL file),
+    output=zip|pdf, name_template (zip entry names, e.g. "{name}.pdf").
+    """
+    rm = metrics.begin("formfill_bulk")
+    try:
+        template = pdf_path(pdf_id)
+    except (ValueError, FileNotFoundError):
+        return _finish_metrics(rm, ("Unknown PDF", 404))
+
+    layout_file = request.files.get("layout")
+    rows_file = request.files.get("rows")
+    if rows_file is None:
+        return _finish_metrics(rm, ("No rows file uploaded", 400))
+    try:
+        layout_raw = layout_file.read().decode("utf-8") if layout_file else request.form.get("layout", "")
+        layout = parse_layout(layout_raw, page_count=len(get_pdf_page_info(pdf_id)["pages"]))
+        rows = read_rows(rows_file.stream, rows_file.filename)
+    except (BulkInputError, UnicodeDecodeError) as e:
+        return _finish_metrics(rm, (str(e), 400))
+    metrics.add_pages(len(rows))
+
+    if (request.form.get("output") or "zip").strip().lower() == "pdf":
+        try:
+            with stage("fill"):
+                out, stats = bulk_concatenated_pdf(template, layout, rows)
+        except BulkInputError as e:
+            return _finish_metrics(rm, (str(e), 400))
+        response = send_file(out, as_attachment=True, download_name=f"filled_{pdf_id}_all.pdf",
+                             mimetype="application/pdf")
+        response.headers["X-Docs-Per-Second"] = str(stats["docs_per_second"])
+        return _finish_metrics(rm, response)
+
+    name_template = request.form.get("name_template") or DEFAULT_NAME_TEMPLATE
+    chunks = iter_bulk_zip(template, layout, rows, name_template)
+    return _finish_metrics(rm, send_conversion_result(metrics.count_output(rm, chunks),
+                                                      f"filled_{pdf_id}.zip"))
+
+
 # =========================
 # Run
 # =========================
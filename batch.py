@@ -0,0 +1,133 @@
+# batch.py
+import os
+import json
+import time
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from pools import get_pool, worker_count
+from spool import SPOOL_DIR
+from zipstream import iter_zip
+
+
+# Files converted concurrently per batch (within WORKER_BUDGET, see pools.py)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _convert_one(runner: Callable, conversion_type: str, filename: str, src: str,
+                 options: Dict[str, Any], out_path: str) -> Tuple[str, str]:
+    """
+    Worker side: convert a single file and write the result to `out_path`.
+    Returns ("ok", download_name) or ("error", message); never raises, so one
+    bad file cannot fail the batch. The conversion runs in this worker
+    (its worker budget is 1), not on pools of its own.
+    """
+    try:
+        out, download_name = runner(conversion_type, [(filename, src)], options)
+        try:
+            with open(out_path, "wb") as f:
+                if hasattr(out, "read"):
+                    shutil.copyfileobj(out, f)
+                else:
+                    for chunk in out:
+                        f.write(chunk)
+        finally:
+            # pool workers live on: a cached file or spooled result left open would leak its fd
+            if hasattr(out, "close"):
+                out.close()
+        return "ok", download_name
+    except Exception as e:
+        return "error", str(e) or e.__class__.__name__
+
+
+def _entry_name(filename: str, download_name: str, used: set) -> str:
+    stem = os.path.splitext(os.path.basename(filename or "file"))[0] or "file"
+    name = f"{stem}_{download_name}"
+    n = 2
+    while name in used:
+        name = f"{stem}_{n}_{download_name}"
+        n += 1
+    used.add(name)
+    return name
+
+
+def iter_batch_zip(runner: Callable, conversion_type: str,
+                   uploads: List[Tuple[str, str]], options: Dict[str, Any]) -> Iterator[bytes]:
+    """
+    Run `runner` over every upload on the shared pool and stream one ZIP
+    back, with at most BATCH_WORKERS files converting at a time. Entries are
+    added as files finish (not in upload order), and a manifest.json with
+    per-file status/errors is written last.
+    uploads: list of (filename, path) pairs.
+    """
+    workdir = tempfile.mkdtemp(prefix="batch_", dir=SPOOL_DIR)
+    started = time.time()
+    queued = deque()
+    for i, (filename, src) in enumerate(uploads):
+        # Keep our own link to each input: the request's spooled files are
+        # closed (and deleted) before the workers get to them.
+        in_path = os.path.join(workdir, f"in_{i}")
+        try:
+            os.link(src, in_path)
+        except OSError:
+            shutil.copyfile(src, in_path)
+        queued.append((i, filename, in_path, os.path.join(workdir, f"out_{i}")))
+
+    pool = get_pool()
+    window = worker_count(BATCH_WORKERS)
+    futures = {}
+
+    def _submit():
+        while queued and len(futures) < window:
+            i, filename, in_path, out_path = queued.popleft()
+            future = pool.submit(_convert_one, runner, conversion_type, filename, in_path, options, out_path)
+            futures[future] = (i, filename, out_path)
+
+    _submit()  # start converting before the response starts streaming
+
+    def _entries():
+        manifest = [None] * len(uploads)
+        used = {"manifest.json"}
+        try:
+            while futures:
+                future = next(iter(wait(futures, return_when=FIRST_COMPLETED).done))
+                i, filename, out_path = futures.pop(future)
+                _submit()
+                try:
+                    status, detail = future.result()
+                except Exception as e:  # worker crashed
+                    status, detail = "error", str(e) or e.__class__.__name__
+                item = {"file": filename, "status": status}
+                try:
+                    os.remove(os.path.join(workdir, f"in_{i}"))
+                except OSError:
+                    pass
+                if status == "ok":
+                    item["output"] = _entry_name(filename, detail, used)
+                    with open(out_path, "rb") as f:
+                        data = f.read()
+                    os.remove(out_path)
+                    item["bytes"] = len(data)
+                    manifest[i] = item
+                    yield item["output"], data
+                else:
+                    item["error"] = detail
+                    manifest[i] = item
+            summary = {
+                "conversion_type": conversion_type,
+                "files": len(uploads),
+                "succeeded": sum(1 for m in manifest if m and m["status"] == "ok"),
+                "failed": sum(1 for m in manifest if m and m["status"] != "ok"),
+                "seconds": round(time.time() - started, 3),
+                "results": manifest,
+            }
+            yield "manifest.json", json.dumps(summary, indent=2).encode("utf-8")
+        finally:
+            for future in futures:
+                future.cancel()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return iter_zip(_entries())
@@ -0,0 +1,5 @@
+"""
+Benchmark suite for the conversion helpers in app.py and pdf_fill.py.
+
+    python -m benchmarks --help
+"""
@@ -0,0 +1,52 @@
+# benchmarks/__main__.py
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.harness import compare, run_cases, run_e2e, save_baseline
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Benchmark the conversion helpers.")
+    parser.add_argument("--quick", action="store_true", help="smallest size of each case only")
+    parser.add_argument("--filter", default=None, help="only cases whose id contains this text")
+    parser.add_argument("--repeats", type=int, default=3, help="timed runs per case (median is reported)")
+    parser.add_argument("--save", metavar="FILE", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare with a baseline; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed slowdown / memory growth for --compare (default 0.25 = 25%%)")
+    parser.add_argument("--e2e", action="store_true", help="also run concurrent /convert load")
+    parser.add_argument("--concurrency", type=int, default=4, help="threads for --e2e")
+    parser.add_argument("--requests", type=int, default=40, help="total requests for --e2e")
+    parser.add_argument("--workdir", help="keep fixtures/outputs here instead of a temp dir")
+    args = parser.parse_args(argv)
+
+    if args.workdir:
+        # absolute: the case processes chdir into it before building fixture paths
+        workdir = os.path.abspath(args.workdir)
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        results = run_cases(workdir, quick=args.quick, name_filter=args.filter, repeats=args.repeats)
+        e2e = run_e2e(workdir, args.concurrency, args.requests) if args.e2e else None
+        if args.save:
+            save_baseline(args.save, results, e2e)
+            print(f"baseline written to {args.save}")
+        if args.compare:
+            regressions = compare(args.compare, results, args.threshold)
+            if regressions:
+                print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+                return 1
+            print("no regressions")
+        return 1 if any("error" in r for r in results.values()) else 0
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,495 @@
+# benchmarks/cases.py
+"""
+Benchmark cases. Each case is registered with the sizes it runs at; the
+decorated function does the (untimed) setup for one size and returns a
+zero-argument callable that performs the timed work.
+"""
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class Case:
+    def __init__(self, name: str, fn: Callable, sizes: List, quick_sizes: List,
+                 unit: str, requires: Optional[Callable[[], bool]] = None,
+                 score: Optional[Callable] = None):
+        self.name = name
+        self.fn = fn
+        self.sizes = sizes
+        self.quick_sizes = quick_sizes
+        self.unit = unit
+        self.requires = requires
+        self.score = score  # score(fx, size, result) -> 0..1, for cases that trade accuracy for speed
+
+    def ids(self, quick: bool) -> List[Tuple[str, object]]:
+        return [(f"{self.name}[{s}{self.unit}]", s) for s in (self.quick_sizes if quick else self.sizes)]
+
+
+CASES: Dict[str, Case] = {}
+
+
+def case(name: str, sizes: List, quick_sizes: Optional[List] = None, unit: str = "",
+         requires: Optional[Callable[[], bool]] = None, score: Optional[Callable] = None):
+    def register(fn):
+        CASES[name] = Case(name, fn, sizes, quick_sizes or sizes[:1], unit, requires, score)
+        return fn
+    return register
+
+
+def output_size(result) -> int:
+    """Bytes produced by a helper, whatever shape it returned them in."""
+    if result is None:
+        return 0
+    if isinstance(result, (bytes, bytearray)):
+        return len(result)
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    if isinstance(result, dict):
+        return len(repr(result))
+    if hasattr(result, "read"):
+        result.seek(0, os.SEEK_END)
+        return result.tell()
+    return sum(len(chunk) for chunk in result)  # chunk iterator
+
+
+def text_similarity(expected: str, actual: str) -> float:
+    """0..1 similarity of two texts, ignoring whitespace differences."""
+    import difflib
+    return difflib.SequenceMatcher(None, " ".join(expected.split()), " ".join(actual.split()),
+                                   autojunk=False).ratio()
+
+
+def has_tesseract() -> bool:
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+# =========================
+# app.py helpers
+# =========================
+@case("word_to_pdf_stream", sizes=[100, 1000, 5000], unit="para")
+def _word_to_pdf(fx, n):
+    from app import word_to_pdf_stream
+    path = fx.docx(n)
+    return lambda: word_to_pdf_stream(path)
+
+
+@case("word_to_pdf_stream[fpdf]", sizes=[100, 1000, 5000], unit="para")
+def _word_to_pdf_fpdf(fx, n):
+    # the previous text-only renderer, kept as DOCX_PDF_ENGINE=fpdf
+    from app import word_to_pdf_stream_fpdf
+    path = fx.docx(n)
+    return lambda: word_to_pdf_stream_fpdf(path)
+
+
+@case("word_to_pdf_stream[rich]", sizes=[100, 1000, 5000], unit="para")
+def _word_to_pdf_rich(fx, n):
+    from app import word_to_pdf_stream
+    path = fx.docx(n, rich=True)
+    return lambda: word_to_pdf_stream(path)
+
+
+@case("pdf_to_word_stream", sizes=[10, 100, 500, 1000], unit="p")
+def _pdf_to_word(fx, n):
+    from app import pdf_to_word_stream
+    path = fx.text_pdf(n)
+    return lambda: pdf_to_word_stream(path)
+
+
+@case("pdf_to_word_stream[report]", sizes=[10, 100, 500], unit="p")
+def _pdf_to_word_report(fx, n):
+    from app import pdf_to_word_stream
+    path = fx.report_pdf(n)
+    return lambda: pdf_to_word_stream(path)
+
+
+@case("compress_pdf_bytes[images]", sizes=[5, 20, 60], unit="p")
+def _compress_pdf_images(fx, n):
+    from app import compress_pdf_bytes
+    path = fx.scanned_pdf(n)
+    return lambda: compress_pdf_bytes(path, dpi=100, jpeg_quality=55, mode="images")
+
+
+@case("compress_pdf_bytes[rasterize]", sizes=[5, 20, 60], unit="p")
+def _compress_pdf_rasterize(fx, n):
+    from app import compress_pdf_bytes
+    path = fx.scanned_pdf(n)
+    return lambda: compress_pdf_bytes(path, dpi=100, jpeg_quality=55, mode="rasterize")
+
+
+@case("pdf_to_jpg_zip_stream", sizes=[5, 20, 60], unit="p")
+def _pdf_to_jpg(fx, n):
+    from app import pdf_to_jpg_zip_stream
+    path = fx.text_pdf(n)
+    return lambda: pdf_to_jpg_zip_stream(path, jpeg_quality=85)
+
+
+@case("merge_pdfs_stream", sizes=[10, 100, 250], unit="files")
+def _merge(fx, n):
+    from pdf_pages import MergePart, merge_pdfs_stream
+    parts = [MergePart(path, title=f"Letter {i}") for i, path in enumerate(fx.letter_pdfs(n))]
+    return lambda: merge_pdfs_stream(parts)
+
+
+@case("merge_pdfs_stream[pypdf2]", sizes=[10, 100, 250], unit="files")
+def _merge_pypdf2(fx, n):
+    # the PdfMerger path merge_pdfs_stream replaced, kept here as the baseline
+    import io
+    from PyPDF2 import PdfMerger
+    paths = fx.letter_pdfs(n)
+
+    def run():
+        merger = PdfMerger()
+        for path in paths:
+            with open(path, "rb") as f:
+                merger.append(io.BytesIO(f.read()))
+        out = io.BytesIO()
+        merger.write(out)
+        merger.close()
+        return out
+    return run
+
+
+@case("protect_pdf_stream", sizes=[10, 100, 500], unit="p")
+def _protect(fx, n):
+    from app import protect_pdf_stream
+    path = fx.text_pdf(n)
+    return lambda: protect_pdf_stream(path, password="secret")
+
+
+@case("remove_pdf_pages_stream", sizes=[10, 100, 500, 2000], unit="p")
+def _remove_pages(fx, n):
+    from app import remove_pdf_pages_stream
+    path = fx.text_pdf(n)
+    return lambda: remove_pdf_pages_stream(path, "1,3,5-7")
+
+
+@case("remove_pdf_pages_stream[pypdf2]", sizes=[10, 100, 500, 2000], unit="p")
+def _remove_pages_pypdf2(fx, n):
+    # the PdfWriter page-by-page copy page_op_stream replaced, kept here as the baseline
+    import io
+    from PyPDF2 import PdfReader, PdfWriter
+    path = fx.text_pdf(n)
+
+    def run():
+        reader = PdfReader(path)
+        writer = PdfWriter()
+        for i, page in enumerate(reader.pages):
+            if i not in (0, 2, 4, 5, 6):
+                writer.add_page(page)
+        out = io.BytesIO()
+        writer.write(out)
+        return out
+    return run
+
+
+@case("page_op_stream[rotate]", sizes=[10, 100, 500, 2000], unit="p")
+def _rotate_pages(fx, n):
+    from pdf_pages import page_op_stream
+    path = fx.text_pdf(n)
+    return lambda: page_op_stream(path, "rotate", "2-end", 90)
+
+
+@case("split_pdf_zip_chunks", sizes=[10, 100, 500, 2000], unit="p")
+def _split_pages(fx, n):
+    from pdf_pages import split_pdf_zip_chunks
+    path = fx.text_pdf(n)
+    return lambda: b"".join(split_pdf_zip_chunks(path, every=10))
+
+
+@case("add_text_watermark_to_pdf", sizes=[10, 100, 500], unit="p")
+def _watermark_pdf(fx, n):
+    from app import add_text_watermark_to_pdf
+    path = fx.text_pdf(n)
+    return lambda: add_text_watermark_to_pdf(path, "CONFIDENTIAL")
+
+
+_PIPELINE_STEPS = ('[{"op": "compress", "level": "medium"}, {"op": "watermark", "text": "CONFIDENTIAL"},'
+                   ' {"op": "protect", "password": "secret"}]')
+
+
+@case("run_pipeline[compress,watermark,protect]", sizes=[5, 20, 60], unit="p")
+def _pipeline(fx, n):
+    from pdf_pipeline import parse_pipeline, run_pipeline
+    path = fx.scanned_pdf(n)
+    steps = parse_pipeline(_PIPELINE_STEPS, [("scan.pdf", path)])
+    return lambda: run_pipeline(path, steps)
+
+
+@case("run_pipeline[compress,watermark,protect][chained]", sizes=[5, 20, 60], unit="p")
+def _pipeline_chained(fx, n):
+    # the same work as three /convert round trips, each parsing the previous output
+    from app import add_text_watermark_to_pdf, compress_pdf_bytes, protect_pdf_stream
+    path = fx.scanned_pdf(n)
+
+    def run():
+        out = compress_pdf_bytes(path, dpi=100, jpeg_quality=55).read()
+        out = add_text_watermark_to_pdf(out, "CONFIDENTIAL").read()
+        return protect_pdf_stream(out, password="secret")
+    return run
+
+
+@case("run_pipeline[remove,merge]", sizes=[10, 100], unit="files")
+def _pipeline_merge(fx, n):
+    from pdf_pipeline import parse_pipeline, run_pipeline
+    uploads = [(f"letter_{i}.pdf", path) for i, path in enumerate(fx.letter_pdfs(n))]
+    steps = parse_pipeline('[{"op": "remove", "pages": "1"}, "merge"]', uploads)
+    return lambda: run_pipeline(uploads[0][1], steps)
+
+
+@case("run_pipeline[remove,merge][chained]", sizes=[10, 100], unit="files")
+def _pipeline_merge_chained(fx, n):
+    from app import remove_pdf_pages_stream
+    from pdf_pages import MergePart, merge_pdfs_stream
+    paths = fx.letter_pdfs(n)
+
+    def run():
+        first = remove_pdf_pages_stream(paths[0], "1").read()
+        return merge_pdfs_stream([MergePart(first, title="letter_0")] +
+                                 [MergePart(path, title=f"letter_{i}") for i, path in enumerate(paths[1:], 1)])
+    return run
+
+
+@case("ocr_from_pdf_bytes", sizes=[2, 10, 30], unit="p", requires=has_tesseract)
+def _ocr_pdf(fx, n):
+    from app import ocr_from_pdf_bytes
+    path = fx.scanned_pdf(n)
+    return lambda: ocr_from_pdf_bytes(path)
+
+
+@case("ocr_preprocess", sizes=[2, 10, 30], unit="p")
+def _ocr_preprocess(fx, n):
+    # adaptive resolution, render, binarize, deskew and crop, without tesseract
+    import fitz
+    from ocr_engine import iter_pages_for_ocr
+    path, _ = fx.skewed_scan(n)
+
+    def run():
+        # out_bytes = raster bytes that would go to tesseract
+        with fitz.open(path) as doc:
+            for _, _, raster in iter_pages_for_ocr(doc, preprocess=True, geometry=True):
+                if raster is not None:
+                    yield raster[2]
+    return run
+
+
+def _ocr_accuracy(fx, n, result) -> float:
+    return text_similarity(fx.skewed_scan(n)[1], "\n".join(result))
+
+
+@case("ocr_pdf_pages[raw]", sizes=[2, 10], unit="p", requires=has_tesseract, score=_ocr_accuracy)
+def _ocr_raw(fx, n):
+    # grayscale at OCR_DPI straight to tesseract: the throughput/accuracy baseline
+    from ocr_engine import ocr_pdf_pages
+    path, _ = fx.skewed_scan(n)
+    return lambda: ocr_pdf_pages(path, preprocess=False)
+
+
+@case("ocr_pdf_pages[preprocessed]", sizes=[2, 10], unit="p", requires=has_tesseract, score=_ocr_accuracy)
+def _ocr_preprocessed(fx, n):
+    from ocr_engine import ocr_pdf_pages
+    path, _ = fx.skewed_scan(n)
+    return lambda: ocr_pdf_pages(path, preprocess=True)
+
+
+@case("ocr_pdf_output[pdf]", sizes=[2, 10, 30], unit="p", requires=has_tesseract)
+def _ocr_searchable(fx, n):
+    from app import ocr_pdf_output
+    path = fx.scanned_pdf(n)
+    return lambda: ocr_pdf_output(path, "pdf")
+
+
+@case("ocr_pdf_output[hocr]", sizes=[2, 10, 30], unit="p", requires=has_tesseract)
+def _ocr_hocr(fx, n):
+    from app import ocr_pdf_output
+    path = fx.scanned_pdf(n)
+    return lambda: b"".join(ocr_pdf_output(path, "hocr"))
+
+
+@case("ocr_from_image_stream", sizes=[5, 40], unit="lines", requires=has_tesseract)
+def _ocr_image(fx, n):
+    # short inputs, where starting tesseract used to dominate; run warm (repeats reuse the pool)
+    from app import ocr_from_image_stream
+    path = fx.scanned_image(n)
+    return lambda: ocr_from_image_stream(path)
+
+
+@case("jpg_to_pdf_stream", sizes=[5, 20, 60], unit="img")
+def _jpg_to_pdf(fx, n):
+    from app import jpg_to_pdf_stream
+    paths = [fx.image(4, "JPEG", seed=i % 5) for i in range(n)]
+    return lambda: jpg_to_pdf_stream(list(paths))
+
+
+@case("jpg_to_pdf_stream[phone]", sizes=[20, 100, 500], unit="img")
+def _jpg_to_pdf_phone(fx, n):
+    from app import jpg_to_pdf_stream
+    paths = [fx.phone_photo(2, seed=i % 3) for i in range(n)]
+    return lambda: jpg_to_pdf_stream(list(paths), page_size="a4")
+
+
+@case("jpg_to_pdf_stream[phone,pil]", sizes=[20, 100], unit="img")
+def _jpg_to_pdf_phone_pil(fx, n):
+    # decode everything and let PIL write the PDF, the path image_pdf replaced, kept as the baseline
+    import io
+    from PIL import Image
+    paths = [fx.phone_photo(2, seed=i % 3) for i in range(n)]
+
+    def run():
+        images = [Image.open(path).convert("RGB") for path in paths]
+        out = io.BytesIO()
+        images[0].save(out, format="PDF", save_all=True, append_images=images[1:])
+        return out
+    return run
+
+
+@case("png_to_jpg_stream", sizes=[1, 8, 24], unit="MP")
+def _png_to_jpg(fx, mp):
+    from app import png_to_jpg_stream
+    path = fx.image(mp, "PNG")
+    return lambda: png_to_jpg_stream(path, quality=90)
+
+
+@case("jpg_to_png_stream", sizes=[1, 8, 24], unit="MP")
+def _jpg_to_png(fx, mp):
+    from app import jpg_to_png_stream
+    path = fx.image(mp, "JPEG")
+    return lambda: jpg_to_png_stream(path)
+
+
+@case("compress_image_stream", sizes=[1, 8, 24], unit="MP")
+def _compress_image(fx, mp):
+    from app import compress_image_stream
+    path = fx.image(mp, "JPEG")
+    return lambda: compress_image_stream(path, quality=55)
+
+
+@case("compress_image_stream[phone,max2048]", sizes=[12, 24, 40], unit="MP")
+def _compress_phone(fx, mp):
+    from app import compress_image_stream
+    path = fx.phone_photo(mp)
+    return lambda: compress_image_stream(path, quality=75, max_dimension=2048)
+
+
+@case("compress_image_stream[phone,max2048,webp]", sizes=[12, 24, 40], unit="MP")
+def _compress_phone_webp(fx, mp):
+    from app import compress_image_stream
+    path = fx.phone_photo(mp)
+    return lambda: compress_image_stream(path, quality=75, max_dimension=2048, fmt="WEBP")
+
+
+@case("compress_image_stream[phone,max2048,progressive]", sizes=[12, 24, 40], unit="MP")
+def _compress_phone_progressive(fx, mp):
+    from app import compress_image_stream
+    path = fx.phone_photo(mp)
+    return lambda: compress_image_stream(path, quality=75, max_dimension=2048, progressive=True)
+
+
+@case("compress_image_stream[phone,300kb]", sizes=[12, 24, 40], unit="MP")
+def _compress_phone_target(fx, mp):
+    from app import compress_image_stream
+    path = fx.phone_photo(mp)
+    return lambda: compress_image_stream(path, quality=75, target_kb=300)
+
+
+@case("compress_image_stream[phone,max2048,pil]", sizes=[12, 24, 40], unit="MP")
+def _compress_phone_pil(fx, mp):
+    # full decode + resize + optimize, the path image_pipeline replaced, kept as the baseline
+    import io
+    from PIL import Image, ImageOps
+    path = fx.phone_photo(mp)
+
+    def run():
+        img = ImageOps.exif_transpose(Image.open(path).convert("RGB"))
+        img.thumbnail((2048, 2048), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=75, optimize=True)
+        return out
+    return run
+
+
+@case("png_to_jpg_stream[max2048]", sizes=[8, 24], unit="MP")
+def _png_to_jpg_max(fx, mp):
+    from app import png_to_jpg_stream
+    path = fx.image(mp, "PNG")
+    return lambda: png_to_jpg_stream(path, quality=90, max_dimension=2048)
+
+
+@case("add_text_watermark_to_image", sizes=[1, 8, 24], unit="MP")
+def _watermark_image(fx, mp):
+    from app import add_text_watermark_to_image
+    path = fx.image(mp, "JPEG")
+    return lambda: add_text_watermark_to_image(path, "CONFIDENTIAL")
+
+
+# =========================
+# pdf_fill.py helpers
+# =========================
+def _formfill_id(fx, pages: int) -> str:
+    from pdf_fill import save_pdf_temp
+    with open(fx.text_pdf(pages), "rb") as f:
+        return save_pdf_temp(f.read())
+
+
+@case("get_pdf_page_info", sizes=[10, 100, 500], unit="p")
+def _page_info(fx, n):
+    from pdf_fill import get_pdf_page_info
+    pdf_id = _formfill_id(fx, n)
+    return lambda: get_pdf_page_info(pdf_id)
+
+
+def _overlay_list(n: int, pages: int, start: int = 0):
+    return [
+        {"page": i % pages, "x": (i % 7) / 8.0, "y": (i % 37) / 40.0,
+         "text": f"Field value {i}", "font_size": 10, "align": ("left", "center", "right")[i % 3]}
+        for i in range(start, start + n)
+    ]
+
+
+@case("apply_text_overlays[rebuild]", sizes=[10, 300, 3000], unit="fields")
+def _overlays(fx, n):
+    from pdf_fill import apply_text_overlays
+    pdf_id = _formfill_id(fx, 10)
+    variants = [_overlay_list(n, 10), _overlay_list(n, 10, start=1)]
+    calls = iter(range(1_000_000))
+    # alternate between two different lists so every call redraws everything
+    return lambda: apply_text_overlays(pdf_id, variants[next(calls) % 2])
+
+
+@case("apply_text_overlays[incremental]", sizes=[10, 100, 500], unit="p")
+def _overlays_incremental(fx, n):
+    from pdf_fill import apply_text_overlays
+    pdf_id = _formfill_id(fx, n)
+    applied = _overlay_list(200, n)
+    apply_text_overlays(pdf_id, applied)
+
+    def add_ten():
+        applied.extend(_overlay_list(10, n, start=len(applied)))
+        return apply_text_overlays(pdf_id, list(applied))
+    return add_ten
+
+
+def _bulk_inputs(fx, rows: int):
+    from pdf_fill import pdf_path
+    template = pdf_path(_formfill_id(fx, 2))
+    layout = [{"page": 0, "x": 0.2, "y": 0.2, "field": "name", "font_size": 14},
+              {"page": 1, "x": 0.5, "y": 0.5, "text": "Issued to {name} (#{n})", "align": "center"}]
+    data = [{"name": f"Person {i}"} for i in range(rows)]
+    return template, layout, data
+
+
+@case("formfill_bulk[zip]", sizes=[50, 500, 2000], unit="rows")
+def _bulk_zip(fx, n):
+    from formfill_bulk import iter_bulk_zip
+    template, layout, rows = _bulk_inputs(fx, n)
+    return lambda: iter_bulk_zip(template, layout, rows)
+
+
+@case("formfill_bulk[pdf]", sizes=[50, 500, 2000], unit="rows")
+def _bulk_pdf(fx, n):
+    from formfill_bulk import bulk_concatenated_pdf
+    template, layout, rows = _bulk_inputs(fx, n)
+    return lambda: bulk_concatenated_pdf(template, layout, rows)[0]
@@ -0,0 +1,257 @@
+# benchmarks/fixtures.py
+"""Synthetic inputs, generated locally so the suite needs no sample files."""
+import io
+import os
+import random
+from typing import List, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFont
+from docx import Document
+
+_WORDS = ("invoice total amount contract party agreement payment terms date "
+          "signature clause schedule annex delivery customer supplier order").split()
+
+
+def _sentence(rng: random.Random, words: int = 14) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def photo(width: int, height: int, seed: int = 0) -> Image.Image:
+    """Noisy gradient image: compresses like a real photo, unlike a flat fill."""
+    base = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 7)
+    return Image.merge("RGB", (base, noise, base.transpose(Image.FLIP_LEFT_RIGHT)))
+
+
+def write_image(path: str, width: int, height: int, fmt: str, seed: int = 0) -> str:
+    img = photo(width, height, seed)
+    if fmt.upper() == "JPEG":
+        img.save(path, format="JPEG", quality=92)
+    else:
+        img.save(path, format=fmt)
+    return path
+
+
+def write_phone_photo(path: str, width: int, height: int, seed: int = 0) -> str:
+    """A camera-style JPEG: stored landscape with EXIF orientation 6 (display rotated 90°)."""
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    photo(width, height, seed).save(path, format="JPEG", quality=92, exif=exif.tobytes())
+    return path
+
+
+def write_text_pdf(path: str, pages: int, seed: int = 0) -> str:
+    """Multi-page PDF with a real text layer (about 40 lines per page)."""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        y = 60
+        for _ in range(40):
+            page.insert_text((50, y), _sentence(rng), fontsize=10)
+            y += 18
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def write_report_pdf(path: str, pages: int, seed: int = 0) -> str:
+    """
+    Report-style pages: a heading, two columns of text and a ruled 5x4 table
+    (the layout pdf_to_word has to reconstruct).
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_text((50, 60), _sentence(rng, 5), fontsize=18, fontname="hebo")
+        for x in (50, 316):
+            text = " ".join(_sentence(rng) for _ in range(8))
+            page.insert_textbox(fitz.Rect(x, 80, x + 246, 420), text, fontsize=10)
+        shape = page.new_shape()
+        for r in range(6):
+            shape.draw_line((50, 440 + r * 24), (562, 440 + r * 24))
+        for c in range(5):
+            shape.draw_line((50 + c * 128, 440), (50 + c * 128, 560))
+        shape.finish(width=0.5)
+        shape.commit()
+        for r in range(5):
+            for c in range(4):
+                page.insert_text((55 + c * 128, 456 + r * 24), _sentence(rng, 2), fontsize=9)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def write_letter_pdf(path: str, pages: int, seed: int = 0) -> str:
+    """
+    Small PDF with an embedded font and a logo image, identical in every
+    letter, plus a one-entry outline: the kind of input merges repeat.
+    """
+    rng = random.Random(seed)
+    logo = io.BytesIO()
+    photo(160, 60, seed=1).save(logo, format="PNG")
+    font = fitz.Font("helv").buffer
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_font(fontname="body", fontbuffer=font)
+        page.insert_image(fitz.Rect(50, 40, 210, 100), stream=logo.getvalue())
+        y = 140
+        for _ in range(30):
+            page.insert_text((50, y), _sentence(rng), fontname="body", fontsize=10)
+            y += 18
+    doc.set_toc([[1, f"Letter {seed}", 1]])
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def write_scanned_pdf(path: str, pages: int, dpi: int = 200, seed: int = 0) -> str:
+    """PDF whose pages are full-page JPEG 'scans' of rendered text (no text layer)."""
+    rng = random.Random(seed)
+    w, h = int(8.27 * dpi), int(11.69 * dpi)
+    doc = fitz.open()
+    for p in range(pages):
+        img = Image.new("L", (w, h), 245)
+        draw = ImageDraw.Draw(img)
+        for line in range(45):
+            draw.text((dpi // 2, dpi // 2 + line * (h - dpi) // 45), _sentence(rng), fill=20)
+        img = Image.merge("RGB", (img, img, img))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=buf.getvalue())
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def write_skewed_scan_pdf(path: str, pages: int, dpi: int = 300, seed: int = 0) -> str:
+    """
+    Scans as a phone or a sheet feeder makes them: 11pt text at `dpi` on
+    tinted paper, tilted by up to 2 degrees, with wide margins. The text is
+    written next to the PDF as `path` + ".txt", for scoring OCR output.
+    """
+    rng = random.Random(seed)
+    font = ImageFont.load_default(size=dpi * 11 // 72)
+    w, h = int(8.27 * dpi), int(11.69 * dpi)
+    doc = fitz.open()
+    truth = []
+    for _ in range(pages):
+        img = Image.new("L", (w, h), 235)
+        draw = ImageDraw.Draw(img)
+        for line in range(30):
+            text = _sentence(rng, 8)
+            truth.append(text)
+            draw.text((dpi, int(1.5 * dpi) + line * dpi // 4), text, fill=30, font=font)
+        img = img.rotate(rng.uniform(-2.0, 2.0), resample=Image.BICUBIC, fillcolor=235)
+        buf = io.BytesIO()
+        img.convert("RGB").save(buf, format="JPEG", quality=75)
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=buf.getvalue())
+    doc.save(path)
+    doc.close()
+    with open(path + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(truth))
+    return path
+
+
+def write_scanned_image(path: str, lines: int, dpi: int = 200, seed: int = 0) -> str:
+    """A PNG 'scan' of `lines` lines of text, e.g. a receipt or a short letter."""
+    rng = random.Random(seed)
+    w = int(8.27 * dpi)
+    img = Image.new("L", (w, dpi + lines * dpi // 4), 245)
+    draw = ImageDraw.Draw(img)
+    for line in range(lines):
+        draw.text((dpi // 2, dpi // 2 + line * dpi // 4), _sentence(rng), fill=20)
+    img.save(path, format="PNG")
+    return path
+
+
+def write_docx(path: str, paragraphs: int, seed: int = 0, rich: bool = False) -> str:
+    """
+    Headings and plain paragraphs; `rich` adds bold/italic runs, a bullet
+    list and a 4x6 bordered table every 25 paragraphs.
+    """
+    rng = random.Random(seed)
+    doc = Document()
+    for i in range(paragraphs):
+        if i % 25 == 0:
+            doc.add_heading(_sentence(rng, 5), level=1)
+            if rich and i:
+                table = doc.add_table(rows=6, cols=4)
+                table.style = "Table Grid"
+                for row in table.rows:
+                    for cell in row.cells:
+                        cell.text = _sentence(rng, 3)
+        elif rich and i % 25 < 4:
+            doc.add_paragraph(_sentence(rng, 8), style="List Bullet")
+        elif rich:
+            p = doc.add_paragraph(_sentence(rng))
+            p.add_run(" " + _sentence(rng, 4)).bold = True
+            p.add_run(" " + _sentence(rng, 6)).italic = True
+            p.add_run(" " + _sentence(rng))
+        else:
+            doc.add_paragraph(" ".join(_sentence(rng) for _ in range(3)))
+    doc.save(path)
+    return path
+
+
+class Fixtures:
+    """Creates fixture files on demand under `root` and reuses them within a run."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def text_pdf(self, pages: int) -> str:
+        path = self._path(f"text_{pages}p.pdf")
+        return path if os.path.exists(path) else write_text_pdf(path, pages)
+
+    def letter_pdfs(self, count: int, pages: int = 3) -> List[str]:
+        """`count` different letters (same font and logo)."""
+        paths = []
+        for seed in range(count):
+            path = self._path(f"letter_{pages}p_{seed}.pdf")
+            paths.append(path if os.path.exists(path) else write_letter_pdf(path, pages, seed))
+        return paths
+
+    def report_pdf(self, pages: int) -> str:
+        path = self._path(f"report_{pages}p.pdf")
+        return path if os.path.exists(path) else write_report_pdf(path, pages)
+
+    def scanned_pdf(self, pages: int) -> str:
+        path = self._path(f"scan_{pages}p.pdf")
+        return path if os.path.exists(path) else write_scanned_pdf(path, pages)
+
+    def skewed_scan(self, pages: int) -> Tuple[str, str]:
+        """(PDF path, its text) for write_skewed_scan_pdf."""
+        path = self._path(f"skewed_scan_{pages}p.pdf")
+        if not os.path.exists(path):
+            write_skewed_scan_pdf(path, pages)
+        with open(path + ".txt", "r", encoding="utf-8") as f:
+            return path, f.read()
+
+    def scanned_image(self, lines: int) -> str:
+        path = self._path(f"scan_{lines}lines.png")
+        return path if os.path.exists(path) else write_scanned_image(path, lines)
+
+    def image(self, megapixels: float, fmt: str = "JPEG", seed: int = 0) -> str:
+        side = int((megapixels * 1_000_000) ** 0.5)
+        ext = "jpg" if fmt.upper() == "JPEG" else fmt.lower()
+        path = self._path(f"img_{megapixels}mp_{seed}.{ext}")
+        return path if os.path.exists(path) else write_image(path, side * 4 // 3, side * 3 // 4, fmt, seed)
+
+    def phone_photo(self, megapixels: float, seed: int = 0) -> str:
+        side = int((megapixels * 1_000_000) ** 0.5)
+        path = self._path(f"phone_{megapixels}mp_{seed}.jpg")
+        return path if os.path.exists(path) else write_phone_photo(path, side * 3 // 2, side * 2 // 3, seed)
+
+    def docx(self, paragraphs: int, rich: bool = False) -> str:
+        path = self._path(f"doc_{paragraphs}para{'_rich' if rich else ''}.docx")
+        return path if os.path.exists(path) else write_docx(path, paragraphs, rich=rich)
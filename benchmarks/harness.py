@@ -0,0 +1,260 @@
+# benchmarks/harness.py
+"""
+Runs benchmark cases, each in a fresh spawned process so peak memory is
+per case, and compares results against a saved JSON baseline.
+"""
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Repository root, so spawned children can import app.py / pdf_fill.py
+# even though they run with a scratch working directory.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Wall-time differences below this are treated as noise by --compare
+MIN_WALL_DELTA_S = 0.02
+# Drop in a case's score (e.g. OCR accuracy) that --compare reports
+MAX_SCORE_DROP = 0.01
+
+
+def _maxrss_mb(who=resource.RUSAGE_SELF) -> float:
+    rss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        ru = resource.getrusage(who)
+        total += ru.ru_utime + ru.ru_stime
+    return total
+
+
+def _child(case_name: str, size, workdir: str, repeats: int, prepare_only: bool, conn) -> None:
+    """Entry point of the per-case process: set up, time `repeats` runs, report."""
+    try:
+        sys.path.insert(0, REPO_ROOT)
+        os.chdir(workdir)  # app/pdf_fill write under ./instance
+        from benchmarks.cases import CASES, output_size
+        from benchmarks.fixtures import Fixtures
+
+        fx = Fixtures(os.path.join(workdir, "fixtures"))
+        run = CASES[case_name].fn(fx, size)
+        if prepare_only:
+            conn.send({})
+            return
+
+        rss_before = _maxrss_mb()
+        walls: List[float] = []
+        out_bytes = 0
+        result = None
+        cpu0 = _cpu_seconds()
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            result = run()
+            out_bytes = output_size(result)  # drain streams/iterators inside the timing
+            walls.append(time.perf_counter() - t0)
+        cpu = (_cpu_seconds() - cpu0) / repeats
+        peak = max(_maxrss_mb(), _maxrss_mb(resource.RUSAGE_CHILDREN))
+        score = CASES[case_name].score
+        extra = {"score": round(score(fx, size, result), 4)} if score else {}
+        conn.send({**extra,
+            "wall_s": round(statistics.median(walls), 4),
+            "wall_min_s": round(min(walls), 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_mb": round(peak, 1),
+            "rss_growth_mb": round(max(0.0, _maxrss_mb() - rss_before), 1),
+            "out_bytes": out_bytes,
+            "repeats": repeats,
+        })
+    except Exception:
+        conn.send({"error": traceback.format_exc(limit=5)})
+    finally:
+        conn.close()
+
+
+def _spawn(case_name: str, size, workdir: str, repeats: int, prepare_only: bool,
+           timeout: float) -> Dict[str, Any]:
+    ctx = mp.get_context("spawn")
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(case_name, size, workdir, repeats, prepare_only, child))
+    proc.start()
+    child.close()
+    result: Dict[str, Any] = {"error": f"timed out after {timeout:.0f}s"}
+    if parent.poll(timeout):
+        try:
+            result = parent.recv()
+        except EOFError:
+            result = {"error": f"worker exited with code {proc.exitcode}"}
+    proc.join(5)
+    if proc.is_alive():
+        proc.kill()
+        proc.join()
+    return result
+
+
+def run_cases(workdir: str, quick: bool = False, name_filter: Optional[str] = None,
+              repeats: int = 3, timeout: float = 600, log=print) -> Dict[str, Dict[str, Any]]:
+    """
+    Run every registered case (optionally only those whose id contains
+    `name_filter`) and return {case_id: metrics}.
+    Fixture generation runs in its own process first so it never shows up
+    in the measured process's CPU time or peak memory.
+    """
+    from benchmarks.cases import CASES
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for case in CASES.values():
+        ids = [(case_id, size) for case_id, size in case.ids(quick)
+               if not name_filter or name_filter in case_id]
+        if ids and case.requires and not case.requires():
+            log(f"skip  {case.name} (requirement not met)")
+            continue
+        for case_id, size in ids:
+            prep = _spawn(case.name, size, workdir, 0, True, timeout)
+            res = prep if "error" in prep else _spawn(case.name, size, workdir, repeats, False, timeout)
+            results[case_id] = res
+            if "error" in res:
+                log(f"FAIL  {case_id}\n{res['error']}")
+            else:
+                log(f"{case_id:<48} {res['wall_s']:>8.3f}s  cpu {res['cpu_s']:>7.3f}s  "
+                    f"rss {res['peak_rss_mb']:>7.1f}MB  out {res['out_bytes'] / 1024:>9.1f}KB"
+                    + (f"  score {res['score']:.3f}" if "score" in res else ""))
+    return results
+
+
+# =========================
+# End-to-end load
+# =========================
+E2E_MIX = [
+    ("compress", "scan", {"compression_level": "medium"}),
+    ("pdf_to_jpg", "text", {}),
+    ("watermark", "text", {"watermark_text_value": "CONFIDENTIAL"}),
+    ("remove_pages", "text", {"remove_pages_input": "1,3"}),
+    ("jpg_to_png", "jpg", {}),
+    ("compress", "jpg", {"compression_level": "high"}),
+]
+
+
+def run_e2e(workdir: str, concurrency: int = 4, requests: int = 40, log=print) -> Dict[str, Any]:
+    """
+    Fire `requests` POST /convert calls (cache disabled) at the Flask app from
+    `concurrency` threads and report throughput and latency percentiles.
+    Runs in-process through the test client, so it measures the app, not a WSGI server.
+    """
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+    from benchmarks.fixtures import Fixtures
+    from app import app
+
+    fx = Fixtures(os.path.join(workdir, "fixtures"))
+    sources = {"scan": fx.scanned_pdf(5), "text": fx.text_pdf(20), "jpg": fx.image(8, "JPEG")}
+    payloads = {}
+    for key, path in sources.items():
+        with open(path, "rb") as f:
+            payloads[key] = (f.read(), os.path.basename(path))
+
+    def one(i: int):
+        conversion_type, source, form = E2E_MIX[i % len(E2E_MIX)]
+        data, filename = payloads[source]
+        client = app.test_client()
+        t0 = time.perf_counter()
+        resp = client.post("/convert", data={
+            "conversion_type": conversion_type, "no_cache": "1", **form,
+            "file": (io.BytesIO(data), filename),
+        })
+        size = len(resp.get_data())
+        return conversion_type, resp.status_code, time.perf_counter() - t0, size
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - t0
+
+    latencies = sorted(r[2] for r in rows)
+    errors = sum(1 for r in rows if r[1] != 200)
+
+    def pct(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4)
+
+    by_type: Dict[str, List[float]] = {}
+    for conversion_type, _, latency, _ in rows:
+        by_type.setdefault(conversion_type, []).append(latency)
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2),
+        "p50_s": pct(0.50),
+        "p95_s": pct(0.95),
+        "max_s": round(latencies[-1], 4),
+        "peak_rss_mb": round(_maxrss_mb(), 1),
+        "per_type_median_s": {k: round(statistics.median(v), 4) for k, v in sorted(by_type.items())},
+    }
+    log(json.dumps(report, indent=2))
+    return report
+
+
+# =========================
+# Baselines
+# =========================
+def environment() -> Dict[str, Any]:
+    import fitz
+    import PIL
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pymupdf": getattr(fitz, "VersionBind", "?"),
+        "pillow": PIL.__version__,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_baseline(path: str, results: Dict[str, Any], e2e: Optional[Dict[str, Any]] = None) -> None:
+    payload = {"environment": environment(), "results": results}
+    if e2e:
+        payload["e2e"] = e2e
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+
+
+def compare(baseline_path: str, results: Dict[str, Any], threshold: float = 0.25,
+            log=print) -> List[str]:
+    """
+    Compare `results` with a saved baseline. A case regresses when its median
+    wall time or peak RSS grows by more than `threshold` (0.25 = 25%), or when
+    it fails now but passed before. Returns the list of regression messages.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+
+    regressions = []
+    for case_id, now in sorted(results.items()):
+        before = baseline.get(case_id)
+        if not before or "error" in before:
+            continue
+        if "error" in now:
+            regressions.append(f"{case_id}: now fails")
+            continue
+        wall_ratio = now["wall_s"] / max(before["wall_s"], 1e-6)
+        rss_ratio = now["peak_rss_mb"] / max(before["peak_rss_mb"], 1e-6)
+        log(f"{case_id:<48} wall x{wall_ratio:5.2f}  rss x{rss_ratio:5.2f}")
+        if wall_ratio > 1 + threshold and now["wall_s"] - before["wall_s"] > MIN_WALL_DELTA_S:
+            regressions.append(f"{case_id}: wall {before['wall_s']:.3f}s -> {now['wall_s']:.3f}s")
+        if rss_ratio > 1 + threshold:
+            regressions.append(f"{case_id}: peak RSS {before['peak_rss_mb']:.1f}MB -> {now['peak_rss_mb']:.1f}MB")
+        if "score" in before and now.get("score", 0.0) < before["score"] - MAX_SCORE_DROP:
+            regressions.append(f"{case_id}: score {before['score']:.3f} -> {now.get('score', 0.0):.3f}")
+    return regressions
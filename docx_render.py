@@ -0,0 +1,1030 @@
+# docx_render.py
+"""
+DOCX -> PDF with PyMuPDF.
+
+The document is read straight from python-docx's XML (styles, numbering,
+paragraphs, runs, tables, inline images, page and section breaks), laid out
+here with per-glyph widths cached across documents, and every page's content
+stream is written directly. Fonts and images are embedded once per output
+document and shared by all pages; fonts are subset on save.
+
+Text uses one TrueType family (regular/bold/italic/bold-italic), found via
+DOCX_FONT* or in the usual system font folders, else PyMuPDF's built-in
+Helvetica (Latin, Greek, Cyrillic). Characters the family lacks come from a
+fallback font (DOCX_FALLBACK_FONT, default: PyMuPDF's built-in CJK font).
+
+Not rendered: headers/footers, floating-object positioning (images are
+placed inline), text boxes and fields.
+"""
+import os
+import re
+import logging
+import itertools
+import threading
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from docx import Document
+
+from metrics import stage, add_pages
+from spool import save_pdf
+
+# Regular face (TTF/OTF path); bold/italic variants default to the regular one
+DOCX_FONT = os.getenv("DOCX_FONT", "")
+DOCX_FONT_BOLD = os.getenv("DOCX_FONT_BOLD", "")
+DOCX_FONT_ITALIC = os.getenv("DOCX_FONT_ITALIC", "")
+DOCX_FONT_BOLD_ITALIC = os.getenv("DOCX_FONT_BOLD_ITALIC", "")
+# Extra directory searched first for a known font family
+DOCX_FONT_DIR = os.getenv("DOCX_FONT_DIR", "")
+# Font for characters missing from the main family
+DOCX_FALLBACK_FONT = os.getenv("DOCX_FALLBACK_FONT", "")
+
+logger = logging.getLogger(__name__)
+
+# (regular, bold, italic, bold-italic) file names, in order of preference
+_FONT_FAMILIES = [
+    ("DejaVuSans.ttf", "DejaVuSans-Bold.ttf", "DejaVuSans-Oblique.ttf", "DejaVuSans-BoldOblique.ttf"),
+    ("LiberationSans-Regular.ttf", "LiberationSans-Bold.ttf", "LiberationSans-Italic.ttf",
+     "LiberationSans-BoldItalic.ttf"),
+    ("arial.ttf", "arialbd.ttf", "ariali.ttf", "arialbi.ttf"),
+    ("Arial.ttf", "Arial Bold.ttf", "Arial Italic.ttf", "Arial Bold Italic.ttf"),
+    ("NotoSans-Regular.ttf", "NotoSans-Bold.ttf", "NotoSans-Italic.ttf", "NotoSans-BoldItalic.ttf"),
+]
+_FONT_DIRS = [
+    "/usr/share/fonts", "/usr/local/share/fonts", "~/.fonts", "~/.local/share/fonts",
+    "/Library/Fonts", "/System/Library/Fonts/Supplemental", r"C:\Windows\Fonts",
+]
+_BUILTIN_FAMILY = ("helv", "hebo", "heit", "hebi")
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_WP = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}"
+_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+_EMU_PER_PT = 12700
+_TAB_STOP = 36.0  # default tab stops every half inch
+_ASCENT, _DESCENT = 0.9, 0.27  # of the font size; 1.17 = Word's single line height
+_CELL_PAD_X, _CELL_PAD_Y = 5.4, 2.0
+
+_TOKEN = re.compile(r"\S+\s*|\s+")
+
+
+# =========================
+# Fonts + cached metrics
+# =========================
+class _Face:
+    """A font plus glyph id / advance caches (per character, shared by all documents)."""
+
+    def __init__(self, font: fitz.Font):
+        self.font = font
+        self.buffer = font.buffer
+        self._gid: Dict[str, int] = {}
+        self._adv: Dict[str, float] = {}
+
+    def gid(self, ch: str) -> int:
+        g = self._gid.get(ch)
+        if g is None:
+            g = self._gid[ch] = self.font.has_glyph(ord(ch))
+        return g
+
+    def advance(self, ch: str) -> float:
+        a = self._adv.get(ch)
+        if a is None:
+            a = self._adv[ch] = self.font.glyph_advance(ord(ch))
+        return a
+
+
+@lru_cache(maxsize=1)
+def _system_fonts() -> Dict[str, str]:
+    """File name -> path for every font file under the usual font folders."""
+    found: Dict[str, str] = {}
+    for root in [DOCX_FONT_DIR] + _FONT_DIRS:
+        root = os.path.expanduser(root) if root else ""
+        if not root or not os.path.isdir(root):
+            continue
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if name.lower().endswith((".ttf", ".otf")):
+                    found.setdefault(name, os.path.join(dirpath, name))
+    return found
+
+
+def _find_family() -> Tuple[str, str, str, str]:
+    """Paths of the first installed family from _FONT_FAMILIES, or the built-in names."""
+    if DOCX_FONT:
+        regular = DOCX_FONT
+        return (regular, DOCX_FONT_BOLD or regular, DOCX_FONT_ITALIC or regular,
+                DOCX_FONT_BOLD_ITALIC or DOCX_FONT_BOLD or DOCX_FONT_ITALIC or regular)
+    installed = _system_fonts()
+    for family in _FONT_FAMILIES:
+        if family[0] in installed:
+            regular = installed[family[0]]
+            return tuple(installed.get(name, regular) for name in family)  # type: ignore
+    return _BUILTIN_FAMILY
+
+
+def _load_font(spec: str) -> fitz.Font:
+    if os.path.isfile(spec):
+        return fitz.Font(fontfile=spec)
+    return fitz.Font(spec)
+
+
+class _FontSet:
+    """
+    The four faces of the text family (0 regular, 1 bold, 2 italic,
+    3 bold-italic) + fallback (4). A variant the family doesn't have shares the
+    nearest face and is drawn synthetically (`synthetic[i]` = (bold, italic)).
+    """
+
+    FALLBACK = 4
+
+    def __init__(self):
+        specs = _find_family()
+        self.faces: List[Optional[_Face]] = []
+        self.canonical: List[int] = []  # face actually embedded for each variant
+        for i, spec in enumerate(specs):
+            j = specs.index(spec)
+            self.canonical.append(j)
+            self.faces.append(self.faces[j] if j < i else _Face(_load_font(spec)))
+        self.synthetic = [(bool(i & 1) and not self.canonical[i] & 1, bool(i & 2) and not self.canonical[i] & 2)
+                          for i in range(4)]
+        self.faces.append(None)  # fallback, loaded on first use (the CJK font is large)
+        self.canonical.append(self.FALLBACK)
+        self._shapes: Dict[Tuple[int, str], tuple] = {}
+        self._lock = threading.Lock()
+
+    def face(self, idx: int) -> _Face:
+        f = self.faces[idx]
+        if f is None:
+            f = self.faces[idx] = _Face(_load_font(DOCX_FALLBACK_FONT or "cjk"))
+        return f
+
+    def shape(self, idx: int, token: str) -> tuple:
+        """
+        (parts, width, trimmed_width) for `token` in face `idx`, widths in ems.
+        parts = ((face_idx, hex_glyph_ids, width), ...); characters the face
+        lacks go to the fallback face.
+        """
+        key = (idx, token)
+        hit = self._shapes.get(key)
+        if hit is not None:
+            return hit
+        with self._lock:
+            face = self.face(idx)
+            primary = self.canonical[idx]
+            parts, cur_idx, cur, cur_w, width = [], primary, [], 0.0, 0.0
+            for ch in token:
+                use, gid = primary, face.gid(ch)
+                if gid == 0 and not ch.isspace():
+                    fb = self.face(self.FALLBACK)
+                    if fb.gid(ch):
+                        use, gid = self.FALLBACK, fb.gid(ch)
+                adv = self.face(use).advance(ch)
+                if use != cur_idx and cur:
+                    parts.append((cur_idx, "".join(cur), cur_w))
+                    cur, cur_w = [], 0.0
+                cur_idx = use
+                cur.append("%04x" % gid)
+                cur_w += adv
+                width += adv
+            if cur:
+                parts.append((cur_idx, "".join(cur), cur_w))
+            trailing = len(token) - len(token.rstrip())
+            trimmed = width - sum(face.advance(ch) for ch in token[len(token) - trailing:]) if trailing else width
+            hit = (tuple(parts), width, trimmed)
+            if len(self._shapes) > 200_000:
+                self._shapes.clear()
+            self._shapes[key] = hit
+        return hit
+
+
+_fontset: Optional[_FontSet] = None
+_fontset_lock = threading.Lock()
+
+
+def _fonts() -> _FontSet:
+    global _fontset
+    with _fontset_lock:
+        if _fontset is None:
+            _fontset = _FontSet()
+        return _fontset
+
+
+# =========================
+# WordprocessingML properties
+# =========================
+def _on(el) -> bool:
+    v = el.get(_W + "val")
+    return v is None or v.lower() not in ("0", "false", "off", "none")
+
+
+def _twips(el, attr: str) -> Optional[float]:
+    v = el.get(_W + attr)
+    try:
+        return int(v) / 20.0 if v is not None else None
+    except ValueError:
+        return None
+
+
+def _color(v: Optional[str]):
+    if not v or v == "auto" or len(v) != 6:
+        return None
+    try:
+        return tuple(int(v[i:i + 2], 16) / 255.0 for i in (0, 2, 4))
+    except ValueError:
+        return None
+
+
+def _run_props(rpr) -> Dict[str, Any]:
+    props: Dict[str, Any] = {}
+    if rpr is None:
+        return props
+    for el in rpr:
+        tag = el.tag[len(_W):] if el.tag.startswith(_W) else ""
+        if tag in ("b", "i", "strike", "vanish", "caps"):
+            props[tag] = _on(el)
+        elif tag == "dstrike":
+            props["strike"] = _on(el)
+        elif tag == "sz":
+            try:
+                props["sz"] = int(el.get(_W + "val")) / 2.0
+            except (TypeError, ValueError):
+                pass
+        elif tag == "color":
+            props["color"] = _color(el.get(_W + "val"))
+        elif tag == "u":
+            props["u"] = (el.get(_W + "val") or "single") != "none"
+        elif tag == "vertAlign":
+            props["vert"] = el.get(_W + "val")
+        elif tag == "rStyle":
+            props["rStyle"] = el.get(_W + "val")
+    return props
+
+
+def _para_props(ppr) -> Dict[str, Any]:
+    props: Dict[str, Any] = {}
+    if ppr is None:
+        return props
+    for el in ppr:
+        tag = el.tag[len(_W):] if el.tag.startswith(_W) else ""
+        if tag == "pStyle":
+            props["pStyle"] = el.get(_W + "val")
+        elif tag == "jc":
+            props["jc"] = el.get(_W + "val")
+        elif tag == "spacing":
+            for attr in ("before", "after"):
+                v = _twips(el, attr)
+                if v is not None:
+                    props[attr] = v
+            line = el.get(_W + "line")
+            if line is not None:
+                try:
+                    rule = el.get(_W + "lineRule") or "auto"
+                    props["line"] = (rule, int(line) / (240.0 if rule == "auto" else 20.0))
+                except ValueError:
+                    pass
+        elif tag == "ind":
+            for attr, key in (("left", "left"), ("start", "left"), ("right", "right"), ("end", "right")):
+                v = _twips(el, attr)
+                if v is not None:
+                    props[key] = v
+            first, hanging = _twips(el, "firstLine"), _twips(el, "hanging")
+            if hanging is not None:
+                props["first"] = -hanging
+            elif first is not None:
+                props["first"] = first
+        elif tag == "numPr":
+            ilvl, num = el.find(_W + "ilvl"), el.find(_W + "numId")
+            if num is not None:
+                props["num"] = (num.get(_W + "val"), int(ilvl.get(_W + "val")) if ilvl is not None else 0)
+        elif tag == "pageBreakBefore":
+            props["pageBreakBefore"] = _on(el)
+        elif tag == "rPr":
+            props["mark"] = _run_props(el)
+    return props
+
+
+class _Styles:
+    """Style sheet with basedOn chains and document defaults resolved (memoized per style)."""
+
+    def __init__(self, docx_doc):
+        root = docx_doc.styles.element
+        self._by_id = {s.get(_W + "styleId"): s for s in root.iter(_W + "style")}
+        defaults = root.find(_W + "docDefaults")
+        self._default_r = _run_props(defaults.find(f"{_W}rPrDefault/{_W}rPr")) if defaults is not None else {}
+        self._default_p = _para_props(defaults.find(f"{_W}pPrDefault/{_W}pPr")) if defaults is not None else {}
+        self.default_paragraph = next(
+            (sid for sid, s in self._by_id.items()
+             if s.get(_W + "type") == "paragraph" and _on_attr(s.get(_W + "default"))), None)
+        self._cache: Dict[Tuple[str, Optional[str]], tuple] = {}
+
+    def _chain(self, style_id: Optional[str]) -> List[Any]:
+        chain, seen = [], set()
+        while style_id and style_id in self._by_id and style_id not in seen:
+            seen.add(style_id)
+            el = self._by_id[style_id]
+            chain.append(el)
+            based = el.find(_W + "basedOn")
+            style_id = based.get(_W + "val") if based is not None else None
+        return chain[::-1]  # base first
+
+    def paragraph(self, style_id: Optional[str]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """(paragraph props, run props) of a paragraph style, defaults included."""
+        key = ("p", style_id or self.default_paragraph)
+        hit = self._cache.get(key)
+        if hit is None:
+            ppr, rpr = dict(self._default_p), dict(self._default_r)
+            for el in self._chain(key[1]):
+                ppr.update(_para_props(el.find(_W + "pPr")))
+                rpr.update(_run_props(el.find(_W + "rPr")))
+            ppr.pop("pStyle", None)
+            hit = self._cache[key] = (ppr, rpr)
+        return hit
+
+    def character(self, style_id: str) -> Dict[str, Any]:
+        key = ("r", style_id)
+        hit = self._cache.get(key)
+        if hit is None:
+            rpr: Dict[str, Any] = {}
+            for el in self._chain(style_id):
+                rpr.update(_run_props(el.find(_W + "rPr")))
+            hit = self._cache[key] = rpr
+        return hit
+
+    def table_has_borders(self, style_id: Optional[str]) -> bool:
+        key = ("t", style_id)
+        hit = self._cache.get(key)
+        if hit is None:
+            hit = any(el.find(f"{_W}tblPr/{_W}tblBorders") is not None for el in self._chain(style_id))
+            self._cache[key] = hit
+        return hit
+
+
+def _on_attr(v: Optional[str]) -> bool:
+    return v is not None and v.lower() in ("1", "true", "on")
+
+
+def _roman(n: int) -> str:
+    out = ""
+    for value, letters in ((1000, "m"), (900, "cm"), (500, "d"), (400, "cd"), (100, "c"), (90, "xc"),
+                           (50, "l"), (40, "xl"), (10, "x"), (9, "ix"), (5, "v"), (4, "iv"), (1, "i")):
+        while n >= value:
+            out += letters
+            n -= value
+    return out
+
+
+def _letters(n: int) -> str:
+    return chr(ord("a") + (n - 1) % 26) * ((n - 1) // 26 + 1)
+
+
+_NUM_FORMATS = {
+    "decimal": str,
+    "lowerLetter": _letters,
+    "upperLetter": lambda n: _letters(n).upper(),
+    "lowerRoman": _roman,
+    "upperRoman": lambda n: _roman(n).upper(),
+}
+
+
+class _Numbering:
+    """List labels ("1.", "a)", "•") from the numbering part, with running counters."""
+
+    def __init__(self, docx_doc):
+        self._levels: Dict[str, Dict[int, tuple]] = {}
+        self._counters: Dict[str, List[int]] = {}
+        try:
+            root = docx_doc.part.numbering_part.element
+        except (NotImplementedError, KeyError, AttributeError):
+            return
+        abstract = {}
+        for an in root.iter(_W + "abstractNum"):
+            lvls = {}
+            for lvl in an.iter(_W + "lvl"):
+                fmt, text, start = lvl.find(_W + "numFmt"), lvl.find(_W + "lvlText"), lvl.find(_W + "start")
+                ind = lvl.find(f"{_W}pPr/{_W}ind")
+                lvls[int(lvl.get(_W + "ilvl", "0"))] = (
+                    fmt.get(_W + "val") if fmt is not None else "decimal",
+                    text.get(_W + "val") if text is not None else "",
+                    int(start.get(_W + "val")) if start is not None else 1,
+                    _para_props(lvl.find(_W + "pPr")),
+                )
+            abstract[an.get(_W + "abstractNumId")] = lvls
+        for num in root.iter(_W + "num"):
+            ref = num.find(_W + "abstractNumId")
+            if ref is not None:
+                self._levels[num.get(_W + "numId")] = abstract.get(ref.get(_W + "val"), {})
+
+    def indent(self, num_id: str, ilvl: int) -> Dict[str, Any]:
+        level = self._levels.get(num_id, {}).get(ilvl)
+        return level[3] if level else {"left": 18.0 * (ilvl + 1), "first": -18.0}
+
+    def label(self, num_id: str, ilvl: int) -> str:
+        levels = self._levels.get(num_id)
+        if not levels or num_id == "0":
+            return ""
+        counters = self._counters.setdefault(num_id, [0] * 9)
+        ilvl = max(0, min(8, ilvl))
+        counters[ilvl] += 1
+        for deeper in range(ilvl + 1, 9):
+            counters[deeper] = 0
+        fmt, text, _, _ = levels.get(ilvl, ("decimal", "%1.", 1, {}))
+        if fmt == "none":
+            return ""
+        if fmt == "bullet":
+            if not text or any(0xE000 <= ord(c) <= 0xF8FF for c in text):
+                return "\u2022"  # symbol-font bullets live in the private use area
+            return "\u25e6" if text == "o" else text
+
+        def value(k: int) -> str:
+            lvl = levels.get(k, ("decimal", "", 1, {}))
+            n = max(counters[k], 1) + lvl[2] - 1
+            return _NUM_FORMATS.get(lvl[0], str)(n)
+
+        return re.sub(r"%([1-9])", lambda m: value(int(m.group(1)) - 1), text or f"%{ilvl + 1}.")
+
+
+def _section_geometry(sect) -> Dict[str, Any]:
+    geo = {"w": 612.0, "h": 792.0, "top": 72.0, "bottom": 72.0, "left": 72.0, "right": 72.0, "type": "nextPage"}
+    if sect is None:
+        return geo
+    size, mar, kind = sect.find(_W + "pgSz"), sect.find(_W + "pgMar"), sect.find(_W + "type")
+    if size is not None:
+        geo["w"] = _twips(size, "w") or geo["w"]
+        geo["h"] = _twips(size, "h") or geo["h"]
+        if size.get(_W + "orient") == "landscape" and geo["w"] < geo["h"]:
+            geo["w"], geo["h"] = geo["h"], geo["w"]
+    if mar is not None:
+        for side in ("top", "bottom", "left", "right"):
+            v = _twips(mar, side)
+            if v is not None:
+                geo[side] = abs(v)
+    if kind is not None:
+        geo["type"] = kind.get(_W + "val") or "nextPage"
+    return geo
+
+
+# =========================
+# Layout
+# =========================
+# Style of a text item: (face, size, color, underline, strike, rise)
+_Style = Tuple[int, float, Optional[tuple], bool, bool, float]
+
+
+_RUN_CONTAINERS = {_W + "hyperlink", _W + "ins", _W + "smartTag", _W + "sdtContent", _W + "fldSimple"}
+
+
+def _runs(p):
+    """Runs of a paragraph in order, including those inside hyperlinks, insertions and content controls."""
+    for el in p:
+        tag = el.tag
+        if tag == _W + "r":
+            yield el
+        elif tag in _RUN_CONTAINERS:
+            yield from _runs(el)
+        elif tag == _W + "sdt":
+            content = el.find(_W + "sdtContent")
+            if content is not None:
+                yield from _runs(content)
+
+
+class _Line:
+    __slots__ = ("items", "ascent", "descent", "height", "justified")
+
+    def __init__(self, items, ascent, descent, height, justified=False):
+        self.items = items          # ("t", x, width, style, parts) | ("i", x, w, h, xref)
+        self.ascent = ascent
+        self.descent = descent
+        self.height = height
+        self.justified = justified
+
+
+_PAGE_BREAK = object()
+
+
+class _Renderer:
+    def __init__(self, docx_doc):
+        self.docx = docx_doc
+        self.fonts = _fonts()
+        self.styles = _Styles(docx_doc)
+        self.numbering = _Numbering(docx_doc)
+        self.pdf = fitz.open()
+        # fonts and images are inserted on page 0 once, then referenced from every page
+        self.pdf.new_page()
+        self._font_xrefs: Dict[int, int] = {}
+        self._image_xrefs: Dict[str, int] = {}
+        self.page: Optional[int] = None  # xref of the page being written
+        self._parent: Optional[str] = None
+        self._page_size = (0.0, 0.0)
+        self.ops: List[str] = []
+        self._page_fonts: set = set()
+        self._page_images: set = set()
+        self.geo = _section_geometry(None)
+        self._text_state: List[Any] = [None, None, None]
+        self.y = 0.0
+
+    # ---------- pages ----------
+    @property
+    def top(self) -> float:
+        return self.geo["top"]
+
+    @property
+    def bottom(self) -> float:
+        return self.geo["h"] - self.geo["bottom"]
+
+    @property
+    def width(self) -> float:
+        return self.geo["w"] - self.geo["left"] - self.geo["right"]
+
+    def new_page(self) -> None:
+        self.flush_page()
+        self.page = self.pdf.new_page(width=self.geo["w"], height=self.geo["h"]).xref
+        self._page_size = (self.geo["w"], self.geo["h"])
+        self._text_state = [None, None, None]  # font, paint, rise
+        self.y = self.top
+
+    def flush_page(self) -> None:
+        if self.page is None:
+            return
+        pdf = self.pdf
+        xref = pdf.get_new_xref()
+        pdf.update_object(xref, "<<>>")
+        # left uncompressed here: save(deflate=True) compresses every stream once
+        pdf.update_stream(xref, "\n".join(self.ops).encode("latin-1"), compress=False)
+        fonts = "".join(f"/F{i} {self._font_xrefs[i]} 0 R" for i in sorted(self._page_fonts))
+        images = "".join(f"/Im{x} {x} 0 R" for x in sorted(self._page_images))
+        if self._parent is None:
+            self._parent = pdf.xref_get_key(self.page, "Parent")[1]
+        # one write of the whole page dictionary is much cheaper than a
+        # xref_set_key per entry; the Resources object new_page made is dropped on save
+        pdf.update_object(self.page, (
+            f"<</Type/Page/Parent {self._parent}/MediaBox[0 0 {self._page_size[0]:g} {self._page_size[1]:g}]"
+            f"/Contents {xref} 0 R/Resources<</Font<<{fonts}>>/XObject<<{images}>>>>>>"))
+        self.page = None
+        self.ops = []
+        self._page_fonts = set()
+        self._page_images = set()
+
+    def finish(self) -> fitz.Document:
+        if self.page is None:
+            self.new_page()
+        self.flush_page()
+        self.pdf.delete_page(0)  # the scratch page
+        return self.pdf
+
+    def _font_ref(self, idx: int) -> str:
+        if idx not in self._font_xrefs:
+            self._font_xrefs[idx] = self.pdf[0].insert_font(
+                fontname=f"F{idx}", fontbuffer=self.fonts.face(idx).buffer)
+        self._page_fonts.add(idx)
+        return f"/F{idx}"
+
+    def _image_xref(self, rid: str) -> int:
+        """xref of the embedded image for relationship `rid` (0 if it can't be embedded)."""
+        try:
+            part = self.docx.part.related_parts[rid]
+        except KeyError:
+            return 0
+        key = str(part.partname)
+        if key not in self._image_xrefs:
+            try:
+                self._image_xrefs[key] = self.pdf[0].insert_image(fitz.Rect(0, 0, 1, 1), stream=part.blob)
+            except Exception:  # e.g. EMF/WMF, which MuPDF can't decode
+                self._image_xrefs[key] = 0
+        return self._image_xrefs[key]
+
+    # ---------- paragraph layout ----------
+    def _run_style(self, base: Dict[str, Any], rpr_el) -> Tuple[Optional[_Style], Dict[str, Any]]:
+        props = dict(base)
+        own = _run_props(rpr_el)
+        if "rStyle" in own:
+            props.update(self.styles.character(own["rStyle"]))
+        props.update(own)
+        if props.get("vanish"):
+            return None, props
+        size = props.get("sz", 11.0)
+        rise = 0.0
+        if props.get("vert") in ("superscript", "subscript"):
+            rise = size * (0.33 if props["vert"] == "superscript" else -0.14)
+            size *= 0.65
+        face = (1 if props.get("b") else 0) + (2 if props.get("i") else 0)
+        return (face, size, props.get("color"), bool(props.get("u")), bool(props.get("strike")), rise), props
+
+    def _paragraph_tokens(self, p, base_r: Dict[str, Any]):
+        """Yield ("t", style, text) / ("tab",) / ("br",) / ("page",) / ("i", w, h, xref)."""
+        for r in _runs(p):
+            style, props = self._run_style(base_r, r.find(_W + "rPr"))
+            if style is None:
+                continue
+            for el in r:
+                tag = el.tag
+                if tag == _W + "t":
+                    text = el.text or ""
+                    if props.get("caps"):
+                        text = text.upper()
+                    yield ("t", style, text)
+                elif tag == _W + "tab":
+                    yield ("tab",)
+                elif tag in (_W + "br", _W + "cr"):
+                    yield ("page",) if el.get(_W + "type") == "page" else ("br",)
+                elif tag == _W + "drawing":
+                    blip, extent = el.find(f".//{_A}blip"), el.find(f".//{_WP}extent")
+                    if blip is None or extent is None:
+                        continue
+                    xref = self._image_xref(blip.get(_R + "embed"))
+                    if xref:
+                        yield ("i", int(extent.get("cx", 0)) / _EMU_PER_PT,
+                               int(extent.get("cy", 0)) / _EMU_PER_PT, xref)
+                elif tag == _W + "noBreakHyphen":
+                    yield ("t", style, "-")
+
+    def layout_paragraph(self, p, width: float, max_height: float):
+        """
+        Lay out one paragraph into `width`. Returns (fmt, lines); lines may
+        contain _PAGE_BREAK markers. Item positions are relative to the left indent.
+        """
+        own = _para_props(p.find(_W + "pPr"))
+        style_p, style_r = self.styles.paragraph(own.get("pStyle"))
+        fmt = dict(style_p)
+        num = own.get("num", style_p.get("num"))
+        if num:
+            fmt.update(self.numbering.indent(*num))
+        fmt.update({k: v for k, v in own.items() if k != "pStyle"})
+        mark = dict(style_r)
+        mark.update(fmt.get("mark", {}))
+        mark_style, _ = self._run_style(mark, None)
+
+        left, right = fmt.get("left", 0.0), fmt.get("right", 0.0)
+        first = fmt.get("first", 0.0)
+        avail = max(width - left - right, 24.0)
+        align = fmt.get("jc", "left")
+        justify = align in ("both", "distribute")
+        line_rule = fmt.get("line", ("auto", 1.0))
+
+        tokens = self._paragraph_tokens(p, style_r)
+        if num:
+            label = self.numbering.label(*num)
+            if label:
+                label_style = (mark_style or (0, 11.0, None, False, False, 0.0))[:3] + (False, False, 0.0)
+                tokens = itertools.chain((("t", label_style, label), ("tab",)), tokens)
+
+        lines: List[Any] = []
+        items: List[list] = []  # ["t", x, width, style, parts, ends_with_space] | ["i", x, w, h, xref, False]
+        x = trim = first
+        asc = desc = 0.0
+        shapes, shape = self.fonts._shapes, self.fonts.shape
+
+        def finish(last: bool) -> None:
+            nonlocal items, x, trim, asc, desc
+            if not items and mark_style:
+                asc, desc = mark_style[1] * _ASCENT, mark_style[1] * _DESCENT
+            natural = asc + desc
+            rule, value = line_rule
+            if rule == "exact":
+                height = value
+            elif rule == "atLeast":
+                height = max(value, natural)
+            else:
+                height = natural * value
+            room = avail - trim
+            justified = False
+            if items and room > 0.5:
+                if justify and not last:
+                    gaps = sum(1 for it in items[:-1] if it[5])
+                    if gaps:
+                        per_gap, shift = room / gaps, 0.0
+                        for it in items:
+                            it[1] += shift
+                            if it[5]:
+                                shift += per_gap
+                        justified = True
+                elif align in ("center", "right", "end"):
+                    shift = room / 2 if align == "center" else room
+                    for it in items:
+                        it[1] += shift
+            lines.append(_Line(items, asc, desc, height, justified))
+            items = []
+            x = trim = asc = desc = 0.0
+
+        for tok in tokens:
+            kind = tok[0]
+            if kind == "t":
+                style = tok[1]
+                face, size, rise = style[0], style[1], style[5]
+                t_asc, t_desc = size * _ASCENT + max(rise, 0.0), size * _DESCENT
+                asc, desc = max(asc, t_asc), max(desc, t_desc)
+                prev = None  # item the next word may be appended to (same style, contiguous)
+                for text in _TOKEN.findall(tok[2]):
+                    parts, w, trimmed = shapes.get((face, text)) or shape(face, text)
+                    w, trimmed = w * size, trimmed * size
+                    if items and x + trimmed > avail:
+                        finish(False)
+                        asc, desc, prev = t_asc, t_desc, None
+                    if not items and lines and w != trimmed and not trimmed:
+                        continue  # no leading blanks on wrapped lines
+                    if trimmed > avail - x and len(text) > 1:
+                        for piece_parts, piece_w in self._split_word(style, text, avail - x, avail):
+                            if items and x + piece_w > avail:
+                                finish(False)
+                                asc, desc = t_asc, t_desc
+                            items.append(["t", x, piece_w, style, list(piece_parts), False])
+                            x = trim = x + piece_w
+                        prev = None
+                        continue
+                    if prev is not None:
+                        # words in the same style become one item (one Tj)
+                        prev[2] += w
+                        prev_parts = prev[4]
+                        for part in parts:
+                            last = prev_parts[-1]
+                            if last[0] == part[0]:
+                                prev_parts[-1] = (last[0], last[1] + part[1], last[2] + part[2])
+                            else:
+                                prev_parts.append(part)
+                        prev[5] = w != trimmed
+                    else:
+                        item = ["t", x, w, style, list(parts), w != trimmed]
+                        items.append(item)
+                        if not justify:
+                            prev = item
+                    trim = x + trimmed
+                    x += w
+            elif kind == "tab":
+                x = 0.0 if x < 0 else (int(x / _TAB_STOP) + 1) * _TAB_STOP
+                if x > avail and items:
+                    finish(False)
+                trim = x
+            elif kind == "br":
+                finish(True)
+            elif kind == "page":
+                finish(True)
+                lines.append(_PAGE_BREAK)
+            elif kind == "i":
+                w, h = tok[1], tok[2]
+                scale = min(1.0, avail / w if w else 1.0, max_height / h if h else 1.0)
+                w, h = w * scale, h * scale
+                if items and x + w > avail:
+                    finish(False)
+                items.append(["i", x, w, h, tok[3], False])
+                x = trim = x + w
+                asc = max(asc, h)
+        if items or not lines or lines[-1] is _PAGE_BREAK:
+            finish(True)
+        if len(lines) > 1 and lines[-1] is not _PAGE_BREAK and not lines[-1].items and lines[-2] is _PAGE_BREAK:
+            lines.pop()  # a page break at the end of a paragraph doesn't add an empty line
+        return fmt, lines
+
+    def _split_word(self, style: _Style, text: str, first_room: float, avail: float):
+        """Break a word wider than the line into pieces: [(parts, width), ...]."""
+        pieces, start, room = [], 0, first_room
+        size = style[1]
+        while start < len(text):
+            end = start + 1
+            while end < len(text) and self.fonts.shape(style[0], text[start:end + 1])[1] * size <= room:
+                end += 1
+            parts, w, _ = self.fonts.shape(style[0], text[start:end])
+            pieces.append((parts, w * size))
+            start, room = end, avail
+        return pieces
+
+    # ---------- drawing ----------
+    def draw_line(self, line: _Line, x0: float, y_top: float) -> None:
+        ops = self.ops
+        h = self.geo["h"]
+        baseline = h - (y_top + line.ascent)
+        text_ops: List[str] = []
+        extra: List[str] = []
+        # text state carries over between lines of a page; see _reset_colors()
+        cur_font, cur_paint, cur_rise = self._text_state
+        synthetic = self.fonts.synthetic
+        pending: Optional[list] = None  # [x, y, hex parts, end_x, skew]
+
+        def flush():
+            if pending:
+                text_ops.append(f"1 0 {pending[4]} 1 {pending[0]:.2f} {pending[1]:.2f} Tm "
+                                f"<{''.join(pending[2])}> Tj")
+
+        for it in line.items:
+            if it[0] == "i":
+                _, x, w, ih, xref, _ = it
+                self._page_images.add(xref)
+                extra.append(f"q {w:.2f} 0 0 {ih:.2f} {x0 + x:.2f} {baseline:.2f} cm /Im{xref} Do Q")
+                continue
+            _, x, w, style, parts, _ = it
+            face, size, color, underline, strike, rise = style
+            x = x0 + x
+            synth = synthetic[face]
+            paint = (color, synth, size if synth[0] else 0)
+            if paint != cur_paint:
+                flush()
+                pending = None
+                c = color or (0, 0, 0)
+                # synthetic bold: fill + stroke the outlines in the text color
+                text_ops.append(f"{c[0]:.3f} {c[1]:.3f} {c[2]:.3f} rg {c[0]:.3f} {c[1]:.3f} {c[2]:.3f} RG "
+                                + (f"2 Tr {size * 0.03:.2f} w" if synth[0] else "0 Tr"))
+                cur_paint = paint
+            if rise != cur_rise:
+                flush()
+                pending = None
+                text_ops.append(f"{rise:.2f} Ts")
+                cur_rise = rise
+            px = x
+            for idx, hexstr, pw in parts:
+                if cur_font != (idx, size):
+                    flush()
+                    pending = None
+                    text_ops.append(f"{self._font_ref(idx)} {size:.2f} Tf")
+                    cur_font = (idx, size)
+                # consecutive glyphs in one font/style become a single Tj
+                if pending is not None and not line.justified and abs(pending[3] - px) < 0.01:
+                    pending[2].append(hexstr)
+                else:
+                    flush()
+                    pending = [px, baseline, [hexstr], px, "0.2" if synth[1] else "0"]
+                px += pw * size
+                pending[3] = px
+            if underline or strike:
+                c = color or (0, 0, 0)
+                lw = max(size / 18.0, 0.5)
+                for on, dy in ((underline, -size * 0.12), (strike, size * 0.28)):
+                    if on:
+                        extra.append(f"{c[0]:.3f} {c[1]:.3f} {c[2]:.3f} RG {lw:.2f} w "
+                                     f"{x:.2f} {baseline + rise + dy:.2f} m {x + w:.2f} {baseline + rise + dy:.2f} l S")
+        flush()
+        if text_ops:
+            ops.append("BT")
+            ops.extend(text_ops)
+            ops.append("ET")
+        self._text_state = [cur_font, cur_paint, cur_rise]
+        if extra:
+            ops.extend(extra)
+            self._reset_colors()
+
+    def _reset_colors(self) -> None:
+        """Called after drawing that changes fill/stroke color or line width."""
+        self._text_state[1] = None
+
+    # ---------- flow ----------
+    def paragraph(self, p) -> None:
+        fmt, lines = self.layout_paragraph(p, self.width, self.bottom - self.top)
+        if fmt.get("pageBreakBefore") and self.y > self.top:
+            self.new_page()
+        if self.y > self.top:
+            self.y += fmt.get("before", 0.0)
+        x0 = self.geo["left"] + fmt.get("left", 0.0)
+        for line in lines:
+            if line is _PAGE_BREAK:
+                self.new_page()
+                continue
+            if self.y + line.height > self.bottom and self.y > self.top:
+                self.new_page()
+            self.draw_line(line, x0, self.y)
+            self.y += line.height
+        self.y += fmt.get("after", 0.0)
+
+    def _layout_blocks(self, container, width: float) -> Tuple[List[tuple], float]:
+        """Lines of a table cell as (dy, dx, line), plus its height. Nested tables are flattened."""
+        placed, y = [], 0.0
+        max_height = self.bottom - self.top
+        for p in container.iter(_W + "p"):
+            fmt, lines = self.layout_paragraph(p, width, max_height)
+            if y > 0:
+                y += fmt.get("before", 0.0)
+            for line in lines:
+                if line is not _PAGE_BREAK:
+                    placed.append((y, fmt.get("left", 0.0), line))
+                    y += line.height
+            y += fmt.get("after", 0.0)
+        return placed, y
+
+    def _layout_row(self, tr, grid: List[float]) -> Tuple[List[tuple], float]:
+        cells, col, height = [], 0, 0.0
+        for tc in tr.findall(_W + "tc"):
+            tcpr = tc.find(_W + "tcPr")
+            span, merged, fill = 1, False, None
+            if tcpr is not None:
+                gs, vm, shd = tcpr.find(_W + "gridSpan"), tcpr.find(_W + "vMerge"), tcpr.find(_W + "shd")
+                if gs is not None:
+                    span = max(1, int(gs.get(_W + "val", "1")))
+                if vm is not None:
+                    merged = vm.get(_W + "val", "continue") == "continue"
+                if shd is not None:
+                    fill = _color(shd.get(_W + "fill"))
+            w = sum(grid[col:col + span]) or (grid[-1] if grid else self.width)
+            content, h = ([], 0.0) if merged else self._layout_blocks(tc, max(w - 2 * _CELL_PAD_X, 12.0))
+            cells.append((sum(grid[:col]), w, content, fill, merged))
+            height = max(height, h + 2 * _CELL_PAD_Y)
+            col += span
+        tr_h = tr.find(f"{_W}trPr/{_W}trHeight")
+        if tr_h is not None:
+            value = _twips(tr_h, "val") or 0.0
+            height = value if tr_h.get(_W + "hRule") == "exact" else max(height, value)
+        return cells, height
+
+    def _draw_row(self, row: Tuple[List[tuple], float], x_start: float, borders: bool,
+                  merged_below: frozenset = frozenset()) -> None:
+        """`merged_below`: offsets of cells the next row continues (no bottom border)."""
+        cells, height = row
+        h = self.geo["h"]
+        bottom = h - (self.y + height)
+        for x_off, w, content, fill, merged in cells:
+            x = x_start + x_off
+            if fill:
+                self.ops.append(f"{fill[0]:.3f} {fill[1]:.3f} {fill[2]:.3f} rg "
+                                f"{x:.2f} {bottom:.2f} {w:.2f} {height:.2f} re f")
+                self._reset_colors()
+            for dy, dx, line in content:
+                self.draw_line(line, x + _CELL_PAD_X + dx, self.y + _CELL_PAD_Y + dy)
+            if borders:
+                top = bottom + height
+                path = [f"{x:.2f} {top:.2f} m {x:.2f} {bottom:.2f} l",
+                        f"{x + w:.2f} {top:.2f} m {x + w:.2f} {bottom:.2f} l"]
+                if not merged:
+                    path.append(f"{x:.2f} {top:.2f} m {x + w:.2f} {top:.2f} l")
+                if x_off not in merged_below:
+                    path.append(f"{x:.2f} {bottom:.2f} m {x + w:.2f} {bottom:.2f} l")
+                self.ops.append(f"0 0 0 RG 0.5 w {' '.join(path)} S")
+        self._reset_colors()
+        self.y += height
+
+    def table(self, tbl) -> None:
+        tblpr = tbl.find(_W + "tblPr")
+        style = tblpr.find(_W + "tblStyle") if tblpr is not None else None
+        borders = ((tblpr is not None and tblpr.find(_W + "tblBorders") is not None)
+                   or self.styles.table_has_borders(style.get(_W + "val") if style is not None else None))
+        grid = [_twips(g, "w") or 0.0 for g in tbl.findall(f"{_W}tblGrid/{_W}gridCol")]
+        rows = tbl.findall(_W + "tr")
+        if not grid or sum(grid) <= 0:
+            cols = max((len(tr.findall(_W + "tc")) for tr in rows), default=1) or 1
+            grid = [self.width / cols] * cols
+        elif sum(grid) > self.width:
+            scale = self.width / sum(grid)
+            grid = [g * scale for g in grid]
+        x_start = self.geo["left"]
+
+        header: List[tuple] = []
+        in_header = True
+        laid = [self._layout_row(tr, grid) for tr in rows]
+        for i, (tr, row) in enumerate(zip(rows, laid)):
+            is_header = in_header and tr.find(f"{_W}trPr/{_W}tblHeader") is not None
+            in_header = is_header
+            if self.y + row[1] > self.bottom and self.y > self.top:
+                self.new_page()
+                if not is_header:
+                    for header_row in header:  # repeat header rows on each page
+                        self._draw_row(header_row, x_start, borders)
+            below = frozenset(c[0] for c in laid[i + 1][0] if c[4]) if i + 1 < len(laid) else frozenset()
+            self._draw_row(row, x_start, borders, below)
+            if is_header:
+                header.append(row)
+
+    def _blocks(self, container):
+        for el in container:
+            if el.tag == _W + "sdt":
+                content = el.find(_W + "sdtContent")
+                if content is not None:
+                    yield from self._blocks(content)
+            elif el.tag in (_W + "p", _W + "tbl"):
+                yield el
+
+    def render(self) -> None:
+        body = self.docx.element.body
+        # a section's geometry comes from the sectPr that ends it
+        sections = [el for el in body.iter(_W + "sectPr")]
+        section = 0
+        self.geo = _section_geometry(sections[0] if sections else None)
+        self.new_page()
+        for el in self._blocks(body):
+            if el.tag == _W + "tbl":
+                self.table(el)
+                continue
+            self.paragraph(el)
+            if el.find(f"{_W}pPr/{_W}sectPr") is not None and section + 1 < len(sections):
+                section += 1
+                self.geo = _section_geometry(sections[section])
+                if self.geo["type"] != "continuous":
+                    self.new_page()
+
+
+def docx_to_pdf(docx_src) -> fitz.Document:
+    """Render a .docx (path or binary stream) into a new PyMuPDF document."""
+    docx_doc = Document(docx_src)
+    with stage("layout"):
+        renderer = _Renderer(docx_doc)
+        renderer.render()
+        return renderer.finish()
+
+
+def docx_to_pdf_stream(docx_src) -> BinaryIO:
+    """DOCX -> PDF as a rewound binary stream (fonts subset, objects deduplicated)."""
+    pdf = docx_to_pdf(docx_src)
+    add_pages(pdf.page_count)
+    try:
+        with stage("subset"):
+            pdf.subset_fonts()
+    except (RuntimeError, fitz.mupdf.FzErrorBase) as e:  # the full fonts are still embedded, just bigger
+        logger.warning("Font subsetting failed: %s", e)
+    out = save_pdf(pdf, garbage=3, deflate=True)
+    pdf.close()
+    return out
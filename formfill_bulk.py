@@ -0,0 +1,341 @@
+# formfill_bulk.py
+"""
+Mail-merge for the formfill editor: one template PDF x N data rows.
+
+Chunks of rows are filled on the shared worker pool (see pools.py). A
+worker keeps the template it last filled from open, so it parses each
+template once however many chunks it fills; the parent streams the results
+back in row order while later chunks are still being filled.
+"""
+import io
+import os
+import csv
+import json
+import re
+import time
+from collections import deque
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from pdf_fill import draw_overlays, overlay_page
+from pools import get_pool, worker_count
+from spool import save_pdf
+from zipstream import iter_zip
+
+
+# Pool workers per bulk request (within WORKER_BUDGET, see pools.py); 1 = in-process
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", str(os.cpu_count() or 1)))
+# Rows filled per task: amortizes pickling/IPC without delaying the first output too long
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "25"))
+# Upper bound on rows per request
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "10000"))
+
+DEFAULT_NAME_TEMPLATE = "row_{n}.pdf"
+
+
+class BulkInputError(ValueError):
+    """Bad layout or rows; reported to the client as a 400."""
+
+
+# =========================
+# Input parsing
+# =========================
+def parse_layout(raw: str, page_count: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Field layout as JSON: a list of overlays (same keys as apply_text_overlays)
+    where "text" may contain {column} placeholders, or "field" names a column
+    whose value is used as the text. With `page_count` (the template's),
+    every field's page is checked (and resolved) against it, so a layout
+    that could never be drawn is rejected before any row is filled.
+    """
+    try:
+        layout = json.loads(raw or "")
+    except ValueError:
+        raise BulkInputError("layout must be JSON")
+    if isinstance(layout, dict):
+        layout = layout.get("overlays", layout.get("fields"))
+    if not isinstance(layout, list) or not all(isinstance(f, dict) for f in layout):
+        raise BulkInputError("layout must be a list of field objects")
+    if not layout:
+        raise BulkInputError("layout has no fields")
+    if page_count is not None:
+        for n, field in enumerate(layout, start=1):
+            try:
+                # resolved, so a negative page stays on its own row's copy once shifted
+                field["page"] = overlay_page(field, page_count)
+            except (ValueError, IndexError) as e:
+                raise BulkInputError(f"field {n}: {e}")
+    return layout
+
+
+def read_rows(stream: BinaryIO, filename: str = "") -> List[Dict[str, str]]:
+    """
+    Rows from a CSV (header line = column names) or JSONL (one object per
+    line) upload. The format comes from the file extension, else from the
+    first non-blank character.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        jsonl = True
+    elif name.endswith(".csv"):
+        jsonl = False
+    else:
+        head = text.read(64)
+        jsonl = head.lstrip().startswith("{")
+        text = io.StringIO(head + text.read())
+
+    rows: List[Dict[str, str]] = []
+    try:
+        if jsonl:
+            for line_no, line in enumerate(text, start=1):
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    raise BulkInputError(f"line {line_no}: expected a JSON object")
+                rows.append(row)
+                if len(rows) > BULK_MAX_ROWS:
+                    break
+        else:
+            for row in csv.DictReader(text):
+                rows.append(row)
+                if len(rows) > BULK_MAX_ROWS:
+                    break
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        if isinstance(e, BulkInputError):
+            raise
+        raise BulkInputError(f"could not read rows: {e}")
+    if len(rows) > BULK_MAX_ROWS:
+        raise BulkInputError(f"too many rows (max {BULK_MAX_ROWS})")
+    if not rows:
+        raise BulkInputError("no rows")
+    return rows
+
+
+# Only plain {column} placeholders: no attribute/index lookups or format specs on row values
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def _fill(template: str, row: Dict[str, Any], n: int) -> str:
+    """`template` with each {column} replaced by the row's value ("" if missing) and {n} by the row number."""
+    def _value(match) -> str:
+        key = match.group(1)
+        value = row.get(key, n if key == "n" else None)
+        return "" if value is None else str(value)
+    return _PLACEHOLDER.sub(_value, template)
+
+
+def row_overlays(layout: List[Dict[str, Any]], row: Dict[str, Any], n: int,
+                 page_offset: int = 0) -> List[Dict[str, Any]]:
+    """Overlays for one row: placeholders filled, pages shifted by `page_offset`."""
+    overlays = []
+    for field in layout:
+        item = dict(field)
+        if "field" in field:
+            value = row.get(field["field"])
+            item["text"] = "" if value is None else str(value)
+        else:
+            item["text"] = _fill(str(field.get("text", "")), row, n)
+        item["page"] = int(field.get("page", 0)) + page_offset
+        overlays.append(item)
+    return overlays
+
+
+def _output_name(name_template: str, row: Dict[str, Any], n: int, used: set) -> str:
+    name = os.path.basename(_fill(name_template, row, n)).strip() or f"row_{n}.pdf"
+    name = "".join(c if c.isalnum() or c in " ._-" else "_" for c in name)
+    if not name.lower().endswith(".pdf"):
+        name += ".pdf"
+    stem, k = name[:-4], 2
+    while name in used:
+        name = f"{stem}_{k}.pdf"
+        k += 1
+    used.add(name)
+    return name
+
+
+# =========================
+# Worker side
+# =========================
+# The template last filled from, and the (path, mtime, size) it was opened as
+_template = None
+_template_key = None
+
+
+def _open_template(path: str) -> fitz.Document:
+    """The parsed template at `path`, reused until a different (or changed) file is asked for."""
+    global _template, _template_key
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    if key != _template_key:
+        if _template is not None:
+            _template.close()
+        _template, _template_key = fitz.open(path), key
+    return _template
+
+
+def _fill_rows_separately(template_path: str, start: int, rows: List[Dict[str, Any]],
+                          layout: List[Dict[str, Any]]) -> List[Tuple[bytes, str]]:
+    """
+    One PDF per row: [(pdf_bytes, error), ...] in row order. A row with
+    fields that couldn't be drawn gets no PDF, only the errors.
+    """
+    template = _open_template(template_path)
+    results = []
+    for i, row in enumerate(rows):
+        doc = fitz.open()
+        try:
+            doc.insert_pdf(template)
+            errors = draw_overlays(doc, row_overlays(layout, row, start + i + 1))
+            if errors:
+                results.append((b"", "; ".join(errors)))
+            else:
+                results.append((doc.tobytes(deflate=True), ""))
+        except Exception as e:
+            results.append((b"", str(e) or e.__class__.__name__))
+        finally:
+            doc.close()
+    return results
+
+
+def _fill_rows_concatenated(template_path: str, start: int, rows: List[Dict[str, Any]],
+                            layout: List[Dict[str, Any]]) -> Tuple[bytes, List[str]]:
+    """
+    All rows of the chunk as consecutive pages of one PDF, with one error
+    string per row ("" when every field was drawn). A row with fields that
+    couldn't be drawn gets no pages, as in ZIP output. Template pages are
+    placed with show_pdf_page, so the chunk holds each template page's content
+    once (as a form XObject) however many rows it has.
+    """
+    template = _open_template(template_path)
+    doc = fitz.open()
+    pages = template.page_count
+    errors = []
+    for i, row in enumerate(rows):
+        offset = doc.page_count
+        for pno in range(pages):
+            rect = template[pno].rect
+            page = doc.new_page(width=rect.width, height=rect.height)
+            page.show_pdf_page(page.rect, template, pno)
+        try:
+            error = "; ".join(draw_overlays(doc, row_overlays(layout, row, start + i + 1, page_offset=offset)))
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+        if error:
+            doc.delete_pages(offset, doc.page_count - 1)
+        errors.append(error)
+    data = doc.tobytes(garbage=1, deflate=True) if doc.page_count else b""
+    doc.close()
+    return data, errors
+
+
+def _iter_chunks(template_path: str, rows: List[Dict[str, Any]], task, args: tuple,
+                 workers: int) -> Iterator[Tuple[int, List[Dict[str, Any]], Any]]:
+    """
+    Run `task(template_path, start, rows_chunk, *args)` over chunks of `rows`
+    on the shared pool, yielding (start, chunk, result) in row order as soon
+    as a chunk and every chunk before it are done. At most ~2x `workers`
+    chunks are in flight.
+    """
+    size = max(1, BULK_CHUNK_ROWS)
+    chunks = [(start, rows[start:start + size]) for start in range(0, len(rows), size)]
+    workers = min(worker_count(workers), len(chunks))
+    if workers <= 1:
+        for start, chunk in chunks:
+            yield start, chunk, task(template_path, start, chunk, *args)
+        return
+
+    pool = get_pool()
+    window = 2 * workers
+    in_flight = deque()
+    try:
+        for start, chunk in chunks:
+            in_flight.append((start, chunk, pool.submit(task, template_path, start, chunk, *args)))
+            # hand back whatever is finished at the head, and block once the window is full
+            while in_flight and (len(in_flight) >= window or in_flight[0][2].done()):
+                first_start, first_chunk, future = in_flight.popleft()
+                yield first_start, first_chunk, future.result()
+        while in_flight:
+            first_start, first_chunk, future = in_flight.popleft()
+            yield first_start, first_chunk, future.result()
+    finally:
+        for _, _, future in in_flight:
+            future.cancel()
+
+
+# =========================
+# Outputs
+# =========================
+def iter_bulk_zip(template_path: str, layout: List[Dict[str, Any]], rows: List[Dict[str, Any]],
+                  name_template: str = DEFAULT_NAME_TEMPLATE,
+                  workers: int = BULK_WORKERS) -> Iterator[bytes]:
+    """
+    Stream a ZIP with one filled PDF per row, in row order, followed by
+    manifest.json (per-row status, totals and documents per second).
+    """
+    def _entries() -> Iterable[Tuple[str, bytes]]:
+        started = time.time()
+        used = {"manifest.json"}
+        results = []
+        for start, chunk, filled in _iter_chunks(template_path, rows, _fill_rows_separately,
+                                                 (layout,), workers):
+            for i, (row, (data, error)) in enumerate(zip(chunk, filled)):
+                n = start + i + 1
+                if error:
+                    results.append({"row": n, "status": "error", "error": error})
+                    continue
+                name = _output_name(name_template, row, n, used)
+                results.append({"row": n, "status": "ok", "output": name, "bytes": len(data)})
+                yield name, data
+        seconds = time.time() - started
+        succeeded = sum(1 for r in results if r["status"] == "ok")
+        summary = {
+            "rows": len(rows),
+            "succeeded": succeeded,
+            "failed": len(rows) - succeeded,
+            "seconds": round(seconds, 3),
+            "docs_per_second": round(succeeded / seconds, 2) if seconds > 0 else None,
+            "results": results,
+        }
+        yield "manifest.json", json.dumps(summary, indent=2).encode("utf-8")
+
+    # the PDFs are written with deflate=True already; deflating them again only costs CPU
+    return iter_zip(_entries(), stored_suffixes=(".pdf",))
+
+
+def bulk_concatenated_pdf(template_path: str, layout: List[Dict[str, Any]],
+                          rows: List[Dict[str, Any]],
+                          workers: int = BULK_WORKERS) -> Tuple[BinaryIO, Dict[str, Any]]:
+    """
+    One PDF with the filled template pages for every row, in row order.
+    Chunks are appended as they finish; the file can only be written once
+    complete (the cross-reference table comes last). garbage=4 on save
+    merges the per-chunk copies of the template content into one.
+    Returns (stream, stats); BulkInputError if no row could be filled.
+    """
+    started = time.time()
+    out_doc = fitz.open()
+    failed = 0
+    first_error = ""
+    for _, _, (data, errors) in _iter_chunks(template_path, rows, _fill_rows_concatenated,
+                                             (layout,), workers):
+        if data:
+            with fitz.open("pdf", data) as chunk_doc:
+                out_doc.insert_pdf(chunk_doc)
+        failed += sum(1 for e in errors if e)
+        first_error = first_error or next((e for e in errors if e), "")
+    if not out_doc.page_count:
+        out_doc.close()
+        raise BulkInputError(f"no row could be filled: {first_error}")
+    out = save_pdf(out_doc, garbage=4, deflate=True)
+    out_doc.close()
+    seconds = time.time() - started
+    stats = {
+        "rows": len(rows),
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "docs_per_second": round((len(rows) - failed) / seconds, 2) if seconds > 0 else None,
+    }
+    return out, stats
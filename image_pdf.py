@@ -0,0 +1,221 @@
+# image_pdf.py
+"""
+Images -> PDF, one page per image, written straight to the output.
+
+The PDF is written object by object as each image is read, so memory stays
+flat however many photos are uploaded: only the current image is ever held,
+and JPEGs aren't even decoded. Their bytes are copied into the page as a
+DCTDecode XObject, and an EXIF rotation becomes the page's /Rotate. Other
+images, and JPEGs that must be resized or mirrored, are decoded through
+image_pipeline. Photos are re-encoded as JPEG, everything else is stored
+losslessly with Flate.
+"""
+import io
+import os
+import shutil
+import zlib
+from typing import BinaryIO, Iterable, List, Tuple
+
+from PIL import Image
+
+from image_pipeline import encode_image, fit_size, flatten_image, load_image
+from jobs import report_progress
+from metrics import stage, add_pages
+from spool import new_output
+
+# Portrait page sizes in points
+PAGE_SIZES = {
+    "a3": (842.0, 1191.0),
+    "a4": (595.0, 842.0),
+    "a5": (420.0, 595.0),
+    "letter": (612.0, 792.0),
+    "legal": (612.0, 1008.0),
+}
+# "image": page is the image's size at `dpi`
+PAGE_SIZE_CHOICES = ("image",) + tuple(PAGE_SIZES)
+# contain: whole image, centred; cover: fill the page, cropping the overflow;
+# stretch: fill the page, ignoring aspect ratio; actual: size at `dpi`, shrunk only if it doesn't fit
+FIT_CHOICES = ("contain", "cover", "stretch", "actual")
+
+# Quality for JPEGs that had to be decoded (resized or mirrored) before embedding
+RESAMPLED_JPEG_QUALITY = int(os.environ.get("IMAGE_PDF_JPEG_QUALITY", "90"))
+
+# EXIF orientation -> clockwise page rotation; mirrored orientations (2, 4, 5, 7) are decoded instead
+_EXIF_ROTATION = {1: 0, 3: 180, 6: 90, 8: 270}
+_COLORSPACES = {"L": "/DeviceGray", "RGB": "/DeviceRGB", "CMYK": "/DeviceCMYK"}
+
+
+class _PdfWriter:
+    """Append-only PDF writer: objects go to `out` as soon as they're made."""
+
+    def __init__(self, out: BinaryIO):
+        self.out = out
+        self.offsets = {}
+        self.next_num = 3  # 1 = catalog, 2 = page tree, both written last
+        self.out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self) -> int:
+        num = self.next_num
+        self.next_num += 1
+        return num
+
+    def write_object(self, num: int, body: str) -> None:
+        self.offsets[num] = self.out.tell()
+        self.out.write(f"{num} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+
+    def write_stream(self, num: int, entries: str, data_or_file, length: int) -> None:
+        """A stream object; `data_or_file` is bytes or a readable file copied in pieces."""
+        self.offsets[num] = self.out.tell()
+        self.out.write(f"{num} 0 obj\n<<{entries}/Length {length}>>\nstream\n".encode("latin-1"))
+        if isinstance(data_or_file, (bytes, bytearray)):
+            self.out.write(data_or_file)
+        else:
+            shutil.copyfileobj(data_or_file, self.out)
+        self.out.write(b"\nendstream\nendobj\n")
+
+    def finish(self, kids: List[int]) -> None:
+        self.write_object(2, f"<</Type/Pages/Count {len(kids)}/Kids[{' '.join(f'{k} 0 R' for k in kids)}]>>")
+        self.write_object(1, "<</Type/Catalog/Pages 2 0 R>>")
+        xref = self.out.tell()
+        size = self.next_num
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[n]:010d} 00000 n \n" for n in range(1, size)]
+        lines.append(f"trailer\n<</Size {size}/Root 1 0 R>>\nstartxref\n{xref}\n%%EOF\n")
+        self.out.write("".join(lines).encode("latin-1"))
+
+
+def _source_length(src) -> int:
+    if isinstance(src, str):
+        return os.path.getsize(src)
+    src.seek(0, io.SEEK_END)
+    size = src.tell()
+    src.seek(0)
+    return size
+
+
+def _open_source(src):
+    if isinstance(src, str):
+        return open(src, "rb")
+    src.seek(0)
+    return src
+
+
+def _placement(size_pt: Tuple[float, float], page_size: str,
+               fit: str) -> Tuple[Tuple[float, float], Tuple[float, float, float, float]]:
+    """
+    Page size and image rectangle (x, y, w, h), both in the image's own
+    (unrotated) orientation, which /Rotate then turns for display.
+    """
+    iw, ih = size_pt
+    if page_size not in PAGE_SIZES:
+        return (iw, ih), (0.0, 0.0, iw, ih)
+    pw, ph = PAGE_SIZES[page_size]
+    # pick the page orientation that matches the image as displayed; in the
+    # unrotated frame a quarter turn swaps both, so compare unrotated sizes
+    if (iw > ih) != (pw > ph):
+        pw, ph = ph, pw
+    if fit == "stretch":
+        return (pw, ph), (0.0, 0.0, pw, ph)
+    if fit == "cover":
+        scale = max(pw / iw, ph / ih)
+    else:
+        scale = min(pw / iw, ph / ih)
+        if fit == "actual":
+            scale = min(1.0, scale)
+    w, h = iw * scale, ih * scale
+    return (pw, ph), ((pw - w) / 2, (ph - h) / 2, w, h)
+
+
+def _jpeg_passthrough(img: Image.Image, max_dimension: int):
+    """(colorspace entries, rotation) if this JPEG can be embedded as-is, else None."""
+    if img.format != "JPEG" or img.mode not in _COLORSPACES:
+        return None
+    if fit_size(img.size, max_dimension) != img.size:
+        return None
+    orientation = int(img.getexif().get(0x0112, 1) or 1)
+    if orientation not in _EXIF_ROTATION:
+        return None
+    entries = f"/ColorSpace{_COLORSPACES[img.mode]}"
+    if img.mode == "CMYK" and "adobe" in img.info:
+        # Photoshop writes CMYK JPEGs inverted
+        entries += "/Decode[1 0 1 0 1 0 1 0]"
+    return entries, _EXIF_ROTATION[orientation]
+
+
+def _write_image(writer: _PdfWriter, src, max_dimension: int) -> Tuple[int, Tuple[int, int], int]:
+    """Write one image XObject; returns (object number, pixel size, page rotation)."""
+    num = writer.reserve()
+    with Image.open(src) as probe:
+        passthrough = _jpeg_passthrough(probe, max_dimension)
+        size = probe.size
+        was_jpeg = probe.format == "JPEG"
+    if passthrough is not None:
+        entries, rotation = passthrough
+        fh = _open_source(src)
+        try:
+            with stage("embed"):
+                writer.write_stream(num, f"/Type/XObject/Subtype/Image/Width {size[0]}/Height {size[1]}"
+                                         f"{entries}/BitsPerComponent 8/Filter/DCTDecode",
+                                    fh, _source_length(src))
+        finally:
+            if fh is not src:
+                fh.close()
+        return num, size, rotation
+
+    if not isinstance(src, str):
+        src.seek(0)
+    img = load_image(src, max_dimension, mode=None)
+    if img.mode not in ("1", "L", "RGB"):
+        img = flatten_image(img, "RGB")
+    colorspace = "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray"
+    if was_jpeg and img.mode != "1":
+        # a resized/mirrored photo: stored losslessly it would be several times larger
+        buf = io.BytesIO()
+        encode_image(img, "JPEG", buf, quality=RESAMPLED_JPEG_QUALITY, optimize=False)
+        data, bits, filter_name = buf.getvalue(), 8, "DCTDecode"
+    else:
+        with stage("encode"):
+            data = zlib.compress(img.tobytes(), 6)
+        bits, filter_name = (1 if img.mode == "1" else 8), "FlateDecode"
+    writer.write_stream(num, f"/Type/XObject/Subtype/Image/Width {img.width}/Height {img.height}"
+                             f"/ColorSpace{colorspace}/BitsPerComponent {bits}/Filter/{filter_name}",
+                        data, len(data))
+    return num, img.size, 0
+
+
+def write_images_pdf(image_streams: Iterable, out: BinaryIO, page_size: str = "image",
+                     fit: str = "contain", dpi: float = 72, max_dimension: int = 0) -> int:
+    """
+    Write a PDF with one page per image to `out`; returns the page count.
+    image_streams: image paths or file-like streams, read one at a time.
+    """
+    sources = list(image_streams)
+    if not sources:
+        raise ValueError("No images provided")
+    writer = _PdfWriter(out)
+    kids = []
+    for i, src in enumerate(sources):
+        image_num, (w, h), rotation = _write_image(writer, src, max_dimension)
+        (pw, ph), (x, y, dw, dh) = _placement((w * 72.0 / dpi, h * 72.0 / dpi), page_size, fit)
+        content = f"q {dw:.3f} 0 0 {dh:.3f} {x:.3f} {y:.3f} cm /Im0 Do Q".encode("latin-1")
+        content_num = writer.reserve()
+        writer.write_stream(content_num, "", content, len(content))
+        page_num = writer.reserve()
+        writer.write_object(page_num, f"<</Type/Page/Parent 2 0 R/MediaBox[0 0 {pw:.3f} {ph:.3f}]"
+                                      f"{f'/Rotate {rotation}' if rotation else ''}"
+                                      f"/Resources<</XObject<</Im0 {image_num} 0 R>>>>"
+                                      f"/Contents {content_num} 0 R>>")
+        kids.append(page_num)
+        add_pages(1)
+        report_progress(i + 1, len(sources))
+    writer.finish(kids)
+    return len(kids)
+
+
+def images_to_pdf_stream(image_streams: Iterable, page_size: str = "image", fit: str = "contain",
+                         dpi: float = 72, max_dimension: int = 0) -> BinaryIO:
+    """write_images_pdf() into a new spooled output, rewound for reading."""
+    out = new_output()
+    write_images_pdf(image_streams, out, page_size, fit, dpi, max_dimension)
+    out.seek(0)
+    return out
@@ -0,0 +1,225 @@
+# image_pipeline.py
+"""
+Shared decode/resize/encode path for the image conversions.
+
+- JPEGs are decoded with Image.draft(), so libjpeg scales them down by 1/2,
+  1/4 or 1/8 in the DCT domain instead of decoding every pixel of a
+  40-megapixel photo and throwing most of them away.
+- EXIF orientation is applied once (and the tag dropped), so phone photos
+  come out upright in every output format.
+- `max_dimension` caps the longer side; `target_kb` searches the encoder
+  quality (then the size) until the output fits.
+- An input that already meets the request (same format, small enough, no
+  rotation pending) is returned as-is instead of being re-encoded.
+"""
+import io
+import os
+import shutil
+from typing import BinaryIO, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from metrics import stage
+from spool import new_output
+
+# Output formats by the names the options use
+FORMATS = {"jpeg": "JPEG", "jpg": "JPEG", "png": "PNG", "webp": "WEBP"}
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+# Lowest quality the target-size search will go to before shrinking the image
+MIN_SEARCH_QUALITY = int(os.environ.get("IMAGE_MIN_QUALITY", "30"))
+# Tolerated overshoot of target_kb (container overhead varies slightly)
+TARGET_SLACK = 1.02
+
+_ORIENTATION_TAG = 0x0112
+# Modes PNG can store directly (a JPEG's RGB stays RGB instead of growing an alpha channel)
+_PNG_MODES = ("1", "L", "LA", "P", "RGB", "RGBA", "I", "I;16")
+
+# libjpeg's standard luminance quantization table (quality 50)
+_STD_LUMA_QTABLE = (
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+)
+
+
+# =========================
+# Decoding
+# =========================
+def _orientation(img: Image.Image) -> int:
+    try:
+        return int(img.getexif().get(_ORIENTATION_TAG, 1) or 1)
+    except Exception:
+        return 1
+
+
+def jpeg_quality_estimate(img: Image.Image) -> Optional[int]:
+    """Approximate libjpeg quality a JPEG was saved with, from its luminance table."""
+    tables = getattr(img, "quantization", None)
+    if not tables or 0 not in tables:
+        return None
+    scale = 100.0 * sum(tables[0]) / sum(_STD_LUMA_QTABLE)
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return max(1, min(100, round(quality)))
+
+
+def fit_size(size: Tuple[int, int], max_dimension: int) -> Tuple[int, int]:
+    w, h = size
+    if not max_dimension or max(w, h) <= max_dimension:
+        return w, h
+    scale = max_dimension / max(w, h)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def flatten_image(img: Image.Image, mode: str) -> Image.Image:
+    """Convert to `mode`, putting transparent pixels on white when dropping alpha."""
+    if img.mode == mode:
+        return img
+    if mode == "RGB" and (img.mode in ("RGBA", "LA") or "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        base = Image.new("RGB", rgba.size, (255, 255, 255))
+        base.paste(rgba, mask=rgba.getchannel("A"))
+        return base
+    return img.convert(mode)
+
+
+def load_image(src, max_dimension: int = 0, mode: Optional[str] = "RGB") -> Image.Image:
+    """
+    Decode an image (path or file-like) upright, no larger than
+    `max_dimension` on its longer side, in `mode` (None keeps the file's).
+    """
+    img = Image.open(src)
+    orientation = _orientation(img)
+    with stage("decode"):
+        if max_dimension and img.format == "JPEG":
+            # draft() picks the largest 1/2^n DCT scale still >= the requested size;
+            # orientation doesn't matter since only the longer side is capped
+            img.draft(mode or img.mode, fit_size(img.size, max_dimension))
+        img.load()
+    with stage("resize"):
+        if orientation != 1:
+            img = ImageOps.exif_transpose(img)
+        if fit_size(img.size, max_dimension) != img.size:
+            img = img.resize(fit_size(img.size, max_dimension), Image.LANCZOS, reducing_gap=3.0)
+    return flatten_image(img, mode) if mode else img
+
+
+# =========================
+# Encoding
+# =========================
+def encode_image(img: Image.Image, fmt: str, out, quality: int = 85,
+                 progressive: bool = False, optimize: bool = True) -> None:
+    """Write `img` to `out` as `fmt` ("JPEG", "PNG" or "WEBP")."""
+    with stage("encode"):
+        if fmt == "JPEG":
+            # progressive JPEGs always get optimized Huffman tables
+            img.save(out, format="JPEG", quality=quality, optimize=optimize or progressive,
+                     progressive=progressive)
+        elif fmt == "WEBP":
+            img.save(out, format="WEBP", quality=quality, method=4 if optimize else 2)
+        else:
+            # optimize=True means zlib level 9 plus filter trials: several times slower
+            # for a few percent, so only on request
+            img.save(out, format="PNG", optimize=optimize, compress_level=6)
+
+
+def _encoded_size(img: Image.Image, fmt: str, quality: int, progressive: bool, optimize: bool) -> int:
+    buf = io.BytesIO()
+    encode_image(img, fmt, buf, quality, progressive, optimize)
+    return buf.tell()
+
+
+def _fit_target(img: Image.Image, fmt: str, quality: int, target_bytes: int,
+                progressive: bool, optimize: bool) -> Tuple[Image.Image, int]:
+    """
+    Highest quality (<= `quality`) whose output fits `target_bytes`. If even
+    MIN_SEARCH_QUALITY doesn't fit, the image is shrunk instead (keeping
+    `quality`) and the search repeats at the new size.
+    """
+    for _ in range(4):
+        top_size = _encoded_size(img, fmt, quality, progressive, optimize)
+        if top_size <= target_bytes:
+            return img, quality
+        if _encoded_size(img, fmt, MIN_SEARCH_QUALITY, progressive, optimize) <= target_bytes:
+            low, high, best = MIN_SEARCH_QUALITY, quality - 1, MIN_SEARCH_QUALITY
+            while low <= high:
+                mid = (low + high) // 2
+                if _encoded_size(img, fmt, mid, progressive, optimize) <= target_bytes:
+                    best, low = mid, mid + 1
+                else:
+                    high = mid - 1
+            return img, best
+        # bytes grow at most linearly with pixel count, so this scale undershoots at worst
+        scale = min(0.9, (target_bytes / top_size) ** 0.5)
+        with stage("resize"):
+            img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))),
+                             Image.LANCZOS, reducing_gap=3.0)
+    return img, MIN_SEARCH_QUALITY
+
+
+def _copy_input(src) -> BinaryIO:
+    out = new_output()
+    if isinstance(src, str):
+        with open(src, "rb") as f:
+            shutil.copyfileobj(f, out)
+    else:
+        src.seek(0)
+        shutil.copyfileobj(src, out)
+    out.seek(0)
+    return out
+
+
+def _input_size(src) -> int:
+    if isinstance(src, str):
+        return os.path.getsize(src)
+    pos = src.tell()
+    src.seek(0, io.SEEK_END)
+    size = src.tell()
+    src.seek(pos)
+    return size
+
+
+def convert_image(src, fmt: str = "JPEG", quality: int = 85, max_dimension: int = 0,
+                  target_kb: int = 0, progressive: bool = False, optimize: bool = True,
+                  passthrough: bool = True) -> BinaryIO:
+    """
+    Convert an image (path or file-like) to `fmt` and return the output stream.
+
+    With `passthrough`, an input already in `fmt` is returned unchanged when
+    re-encoding can't help: no EXIF rotation pending, within `max_dimension`,
+    and under `target_kb` (or, without a target, a JPEG already saved at a
+    lower quality than `quality`). An encoded result larger than such an input is
+    also dropped in favour of the input. `target_kb` doesn't apply to PNG,
+    which has no quality setting.
+    """
+    fmt = FORMATS.get(fmt.lower(), fmt.upper())
+    target_bytes = target_kb * 1024
+    with Image.open(src) as probe:
+        same_format = probe.format == fmt
+        untouched = (same_format and _orientation(probe) == 1 and not progressive
+                     and fit_size(probe.size, max_dimension) == probe.size)
+        input_quality = jpeg_quality_estimate(probe) if probe.format == "JPEG" else None
+    if passthrough and untouched:
+        if target_bytes:
+            if _input_size(src) <= target_bytes:
+                return _copy_input(src)
+        elif input_quality is not None and input_quality < quality:
+            # re-encoding at a higher quality only adds bytes (at the same quality,
+            # optimized Huffman tables may still save some)
+            return _copy_input(src)
+    if not isinstance(src, str):
+        src.seek(0)
+
+    img = load_image(src, max_dimension, mode=None if fmt == "PNG" else "RGB")
+    if fmt == "PNG" and img.mode not in _PNG_MODES:
+        img = img.convert("RGB")
+    if target_bytes and fmt != "PNG":
+        img, quality = _fit_target(img, fmt, quality, int(target_bytes / TARGET_SLACK), progressive, optimize)
+    out = new_output()
+    encode_image(img, fmt, out, quality, progressive, optimize)
+    if passthrough and untouched and out.tell() >= _input_size(src):
+        out.close()
+        return _copy_input(src)
+    out.seek(0)
+    return out
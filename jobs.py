@@ -0,0 +1,321 @@
+# jobs.py
+import os
+import time
+import uuid
+import queue
+import shutil
+import threading
+import multiprocessing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pools
+from metrics import observe_job
+
+
+# Where queued inputs and finished results live
+JOB_DIR = os.getenv("JOB_DIR", os.path.join("instance", "jobs"))
+os.makedirs(JOB_DIR, exist_ok=True)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+# Set inside a job's child process so helpers can report progress
+_progress_value = None
+# (collect, merge) pairs registered with share_stats()
+_shared_stats: List[Tuple[Callable[[], Dict[str, float]], Callable[[Dict[str, float]], None]]] = []
+
+
+class QueueFull(Exception):
+    """Raised when a lane already holds `queue_depth` waiting jobs."""
+
+
+def report_progress(done: int, total: int) -> None:
+    """
+    Record progress (done/total) for the job running in this process.
+    Safe to call from anywhere; a no-op outside of a job.
+    """
+    if _progress_value is None or total <= 0:
+        return
+    try:
+        _progress_value.value = max(0.0, min(1.0, float(done) / float(total)))
+    except Exception:
+        pass
+
+
+def share_stats(collect: Callable[[], Dict[str, float]], merge: Callable[[Dict[str, float]], None]) -> None:
+    """
+    Carry counters a job updates in its own process back to the server:
+    collect() runs in the job's process before and after the job, and
+    merge() gets the difference in the server's. Register at import time,
+    so the server and its job processes hold the same list.
+    """
+    _shared_stats.append((collect, merge))
+
+
+class Job:
+    def __init__(self, job_id: str, lane: str, conversion_type: str):
+        self.id = job_id
+        self.lane = lane
+        self.conversion_type = conversion_type
+        self.state = QUEUED
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.error: Optional[str] = None
+        self.download_name: Optional[str] = None
+        self.progress = multiprocessing.Value("d", 0.0, lock=False)
+
+    @property
+    def workdir(self) -> str:
+        return os.path.join(JOB_DIR, self.id)
+
+    @property
+    def result_path(self) -> str:
+        return os.path.join(self.workdir, "result.bin")
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        if self.state == DONE:
+            progress = 1.0
+        elif self.state == RUNNING:
+            progress = float(self.progress.value)
+        else:
+            progress = 0.0
+        return {
+            "job_id": self.id,
+            "lane": self.lane,
+            "conversion_type": self.conversion_type,
+            "state": self.state,
+            "progress": round(progress, 3),
+            "queued_seconds": round((self.started or now) - self.created, 3),
+            "running_seconds": round((self.finished or now) - self.started, 3) if self.started else 0.0,
+            "error": self.error,
+            "download_name": self.download_name,
+        }
+
+
+def _job_child(runner, conversion_type, inputs, options, result_path, progress, budget, conn):
+    """
+    Runs in the job's own process: convert the input files, write the result to disk.
+    Only the download name (or an error message) and the shared counters'
+    changes go back through the pipe. The job fans out to at most `budget`
+    pool workers, which are shut down when it is done.
+    """
+    global _progress_value
+    _progress_value = progress
+    pools.set_budget(budget)
+    before = [collect() for collect, _ in _shared_stats]
+    message = None
+    try:
+        out, download_name = runner(conversion_type, inputs, options)
+        with open(result_path, "wb") as f:
+            if hasattr(out, "read"):
+                out.seek(0)
+                shutil.copyfileobj(out, f)
+            else:
+                # streaming conversions hand back an iterator of chunks
+                for chunk in out:
+                    f.write(chunk)
+        message = ("ok", download_name)
+    except Exception as e:
+        message = ("error", str(e))
+    finally:
+        pools.shutdown()
+        if message is not None:
+            deltas = []
+            for (collect, _), start in zip(_shared_stats, before):
+                after = collect()
+                deltas.append({k: after[k] - start.get(k, 0) for k in after})
+            conn.send(message + (deltas,))
+        conn.close()
+
+
+def _job_context(runner: Callable):
+    """
+    Start method for job processes: forkserver (spawn where it isn't
+    available). Forking the server itself would copy whatever locks its
+    request threads hold at that moment, and its pools and caches, into the
+    job; a forkserver child starts from a clean process that has only
+    imported the runner's module.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    ctx = multiprocessing.get_context("forkserver")
+    # import the app once, in the server, rather than in every job
+    ctx.set_forkserver_preload([runner.__module__])
+    return ctx
+
+
+class JobLane:
+    """
+    A bounded queue plus `workers` slots. Every job runs in its own child
+    process (see _job_context), so a job that exceeds `timeout` seconds can be
+    terminated without taking other jobs in the lane down with it. A job may
+    use an equal share of the pool worker budget (see pools.py).
+    """
+
+    def __init__(self, name: str, runner: Callable, workers: int, queue_depth: int, timeout: float):
+        self.name = name
+        self.runner = runner
+        self.workers = max(1, int(workers))
+        self.timeout = float(timeout)
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, int(queue_depth)))
+        self._waiting: List[str] = []
+        self._lock = threading.Lock()
+        self._ctx = _job_context(runner)
+        self.budget = max(1, pools.WORKER_BUDGET // self.workers)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job-{name}-{i}", daemon=True)
+            t.start()
+
+    def submit(self, job: Job, inputs: List[Tuple[str, str]], options: Dict[str, Any]) -> None:
+        with self._lock:
+            self._waiting.append(job.id)
+        try:
+            self._queue.put_nowait((job, inputs, options))
+        except queue.Full:
+            with self._lock:
+                self._waiting.remove(job.id)
+            raise QueueFull(f"The '{self.name}' queue is full, try again later.")
+
+    def position(self, job_id: str) -> Optional[int]:
+        with self._lock:
+            try:
+                return self._waiting.index(job_id) + 1
+            except ValueError:
+                return None
+
+    def _worker_loop(self):
+        while True:
+            job, inputs, options = self._queue.get()
+            with self._lock:
+                if job.id in self._waiting:
+                    self._waiting.remove(job.id)
+            try:
+                self._run(job, inputs, options)
+            except Exception as e:
+                job.state = FAILED
+                job.error = str(e)
+                job.finished = time.time()
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job, inputs: List[Tuple[str, str]], options: Dict[str, Any]):
+        job.state = RUNNING
+        job.started = time.time()
+        parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+        proc = self._ctx.Process(
+            target=_job_child,
+            args=(self.runner, job.conversion_type, inputs, options,
+                  job.result_path, job.progress, self.budget, child_conn),
+        )
+        proc.start()
+        child_conn.close()
+
+        message = None
+        if parent_conn.poll(self.timeout):
+            try:
+                message = parent_conn.recv()
+            except EOFError:
+                message = None
+        proc.join(5)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+        parent_conn.close()
+
+        job.finished = time.time()
+        if message is None:
+            if job.finished - job.started >= self.timeout:
+                job.state = TIMEOUT
+                job.error = f"Job exceeded {self.timeout:g}s timeout"
+            else:
+                job.state = FAILED
+                job.error = f"Worker exited unexpectedly (code {proc.exitcode})"
+        else:
+            for (_, merge), delta in zip(_shared_stats, message[2]):
+                merge(delta)
+            if message[0] == "ok":
+                job.state = DONE
+                job.download_name = message[1]
+            else:
+                job.state = FAILED
+                job.error = message[1]
+        observe_job(job.conversion_type, job.state, job.finished - job.started)
+
+        # Inputs are no longer needed once the job is finished
+        for _, path in inputs:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class JobQueue:
+    """
+    Routes jobs to named lanes (e.g. "heavy" / "light") so slow conversions
+    cannot starve cheap ones, and keeps job state for the status endpoints.
+    """
+
+    def __init__(self, runner: Callable, lanes: Dict[str, Dict[str, Any]], result_ttl: float = 3600):
+        self.lanes = {
+            name: JobLane(name, runner, cfg.get("workers", 1), cfg.get("queue_depth", 16), cfg.get("timeout", 300))
+            for name, cfg in lanes.items()
+        }
+        self.result_ttl = float(result_ttl)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, lane: str, conversion_type: str,
+               uploads: List[Tuple[str, str]], options: Dict[str, Any]) -> Job:
+        """
+        Persist the uploads under the job's directory and enqueue the job.
+        uploads: list of (filename, path) pairs; the files are hard-linked
+        (or copied, across filesystems) so they outlive the request.
+        """
+        self.expire()
+        job = Job(_new_job_id(), lane, conversion_type)
+        os.makedirs(job.workdir, exist_ok=True)
+        inputs = []
+        for i, (filename, src_path) in enumerate(uploads):
+            path = os.path.join(job.workdir, f"input_{i}")
+            try:
+                os.link(src_path, path)
+            except OSError:
+                shutil.copyfile(src_path, path)
+            inputs.append((filename, path))
+        try:
+            self.lanes[lane].submit(job, inputs, options)
+        except QueueFull:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+            raise
+        with self._lock:
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job: Job) -> Dict[str, Any]:
+        info = job.to_dict()
+        if job.state == QUEUED:
+            info["position"] = self.lanes[job.lane].position(job.id)
+        return info
+
+    def expire(self) -> None:
+        """Forget finished jobs older than `result_ttl` and delete their files."""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            stale = [j for j in self._jobs.values() if j.finished and j.finished < cutoff]
+            for job in stale:
+                del self._jobs[job.id]
+        for job in stale:
+            shutil.rmtree(job.workdir, ignore_errors=True)
+
+
+def _new_job_id() -> str:
+    return uuid.uuid4().hex
@@ -0,0 +1,356 @@
+# metrics.py
+"""
+In-process instrumentation for conversions.
+
+A conversion request gets a RequestMetrics object held in a context variable;
+`stage(name)` blocks anywhere below the view (helpers, spool.save_pdf, the
+cache) add their duration to it without the object being passed around. When
+the response is closed everything is folded into per-conversion_type
+Prometheus histograms/counters, rendered by `render()` for GET /metrics.
+
+Counters live in the process that served the request: with several server
+processes, scrape each one (or put them behind a per-process port).
+"""
+import os
+import sys
+import time
+import random
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Opt-in profiler: dump a profile for requests slower than this (0 = off)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))
+# Fraction of requests that run under the profiler when it is on
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1.0"))
+# "cprofile" (CPU, .prof files for pstats/snakeviz) or "tracemalloc" (allocations, .txt)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile").strip().lower()
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("instance", "profiles"))
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(2 ** p for p in range(10, 32, 2))  # 1 KB .. 1 GB
+PAGE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+# =========================
+# Metric types
+# =========================
+def _label_str(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        key = tuple(str(v) for v in label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_str(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = TIME_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        key = tuple(str(v) for v in label_values)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            row[i] += 1
+            row[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, row in sorted(self._values.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, row):
+                    cumulative += count
+                    le = 'le="%g"' % bound
+                    lines.append(f"{self.name}_bucket{_label_str(self.labels, key, le)} {cumulative:g}")
+                cumulative += row[len(self.buckets)]
+                inf = _label_str(self.labels, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf} {cumulative:g}")
+                lines.append(f"{self.name}_sum{_label_str(self.labels, key)} {row[-1]:g}")
+                lines.append(f"{self.name}_count{_label_str(self.labels, key)} {cumulative:g}")
+        return lines
+
+
+REQUESTS = Counter("conversion_requests_total", "Conversion requests by final HTTP status.",
+                   ("conversion_type", "status"))
+ERRORS = Counter("conversion_errors_total", "Conversions that ended in a 4xx/5xx response.",
+                 ("conversion_type", "kind"))
+CACHE = Counter("conversion_cache_lookups_total", "Result cache lookups.", ("conversion_type", "result"))
+DURATION = Histogram("conversion_duration_seconds", "Whole request, including sending the result.",
+                     ("conversion_type",))
+STAGE = Histogram("conversion_stage_seconds", "Time per conversion stage (stages can nest).",
+                  ("conversion_type", "stage"))
+PAGES = Histogram("conversion_pages", "Pages (or images) processed per request.",
+                  ("conversion_type",), PAGE_BUCKETS)
+BYTES_IN = Histogram("conversion_input_bytes", "Uploaded bytes per request.", ("conversion_type",), SIZE_BUCKETS)
+BYTES_OUT = Histogram("conversion_output_bytes", "Result bytes per request.", ("conversion_type",), SIZE_BUCKETS)
+PEAK_RSS = Histogram("conversion_peak_rss_bytes",
+                     "Highest process RSS seen at a stage boundary during the request.",
+                     ("conversion_type",), SIZE_BUCKETS)
+JOBS = Histogram("conversion_job_seconds", "Background job run time by final state.",
+                 ("conversion_type", "state"))
+
+_ALL = (REQUESTS, ERRORS, CACHE, DURATION, STAGE, PAGES, BYTES_IN, BYTES_OUT, PEAK_RSS, JOBS)
+
+
+# =========================
+# Memory sampling
+# =========================
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 if unknown)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # peak, not current
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return 0
+
+
+# =========================
+# Per-request state
+# =========================
+class RequestMetrics:
+    def __init__(self, conversion_type: str = "unknown"):
+        self.conversion_type = conversion_type or "unknown"
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.pages = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss = current_rss()
+        self.cache: Optional[str] = None  # "hit" / "miss"
+        self.profiler = None
+        self.token = None  # from begin(); finish() restores the previous value
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        self.peak_rss = max(self.peak_rss, current_rss())
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing header (durations in ms)."""
+        return ", ".join(f"{name};dur={secs * 1000:.1f}" for name, secs in self.stages.items())
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("conversion_metrics", default=None)
+
+
+def begin(conversion_type: str = "unknown") -> RequestMetrics:
+    """Start collecting for the current request/context."""
+    rm = RequestMetrics(conversion_type)
+    rm.token = _current.set(rm)
+    _maybe_start_profiler(rm)
+    return rm
+
+
+def current() -> Optional[RequestMetrics]:
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block and add it to the current request (no-op outside of one)."""
+    rm = _current.get()
+    if rm is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        rm.add_stage(name, time.perf_counter() - t0)
+
+
+def add_pages(n: int) -> None:
+    rm = _current.get()
+    if rm is not None:
+        rm.pages += int(n)
+
+
+def add_bytes_in(n: int) -> None:
+    rm = _current.get()
+    if rm is not None:
+        rm.bytes_in += int(n)
+
+
+def record_cache(hit: bool) -> None:
+    rm = _current.get()
+    if rm is not None:
+        rm.cache = "hit" if hit else "miss"
+
+
+def count_output(rm: RequestMetrics, out):
+    """
+    Account for the result size. File-like results are measured directly;
+    chunk iterators are wrapped and counted while they are sent, along with
+    the time spent producing them (stage "send").
+    """
+    if hasattr(out, "read"):
+        try:
+            pos = out.tell()
+            out.seek(0, os.SEEK_END)
+            rm.bytes_out += out.tell() - pos
+            out.seek(pos)
+        except (OSError, ValueError):
+            pass
+        return out
+
+    def counted():
+        t0 = time.perf_counter()
+        try:
+            for chunk in out:
+                rm.bytes_out += len(chunk)
+                yield chunk
+        finally:
+            rm.add_stage("send", time.perf_counter() - t0)
+    return counted()
+
+
+def finish(rm: RequestMetrics, status: int) -> None:
+    """Fold one request into the process-wide metrics (call once, at response close)."""
+    ct = rm.conversion_type
+    elapsed = time.perf_counter() - rm.started
+    REQUESTS.inc(ct, status)
+    if status >= 400:
+        ERRORS.inc(ct, "client" if status < 500 else "server")
+    if rm.cache:
+        CACHE.inc(ct, rm.cache)
+    DURATION.observe(elapsed, ct)
+    for name, secs in rm.stages.items():
+        STAGE.observe(secs, ct, name)
+    if rm.pages:
+        PAGES.observe(rm.pages, ct)
+    BYTES_IN.observe(rm.bytes_in, ct)
+    BYTES_OUT.observe(rm.bytes_out, ct)
+    PEAK_RSS.observe(max(rm.peak_rss, current_rss()), ct)
+    _stop_profiler(rm, elapsed)
+    _reset_current(rm)
+
+
+def _reset_current(rm: RequestMetrics) -> None:
+    """Undo begin()'s set, so a reused worker thread doesn't keep the request around."""
+    token, rm.token = rm.token, None
+    if token is None:
+        return
+    try:
+        _current.reset(token)
+    except ValueError:
+        # closed from another context (e.g. a streamed response's close callback)
+        if _current.get() is rm:
+            _current.set(None)
+
+
+def observe_job(conversion_type: str, state: str, seconds: float) -> None:
+    JOBS.observe(seconds, conversion_type, state)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _ALL:
+        lines.extend(metric.render())
+    lines.append("# HELP process_resident_memory_bytes Resident memory size in bytes.")
+    lines.append("# TYPE process_resident_memory_bytes gauge")
+    lines.append(f"process_resident_memory_bytes {current_rss()}")
+    return "\n".join(lines) + "\n"
+
+
+# =========================
+# Slow-request profiler (opt-in)
+# =========================
+# cProfile allows one active profiler per process on newer Pythons, and
+# tracemalloc is process-wide, so at most one request is profiled at a time.
+_profile_lock = threading.Lock()
+
+
+def _maybe_start_profiler(rm: RequestMetrics) -> None:
+    if PROFILE_SLOW_MS <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    if not _profile_lock.acquire(blocking=False):
+        return
+    try:
+        if PROFILE_MODE == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start(10)
+            rm.profiler = ("tracemalloc", None)
+        else:
+            import cProfile
+            prof = cProfile.Profile()
+            prof.enable()
+            rm.profiler = ("cprofile", prof)
+    except Exception:
+        _profile_lock.release()
+        rm.profiler = None
+
+
+def _stop_profiler(rm: RequestMetrics, elapsed: float) -> None:
+    if rm.profiler is None:
+        return
+    mode, prof = rm.profiler
+    rm.profiler = None
+    try:
+        slow = elapsed * 1000 >= PROFILE_SLOW_MS
+        stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{rm.conversion_type}_{int(elapsed * 1000)}ms")
+        if mode == "cprofile":
+            prof.disable()
+            if slow:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                prof.dump_stats(stem + ".prof")
+        else:
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot() if slow else None
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if snapshot is not None:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                with open(stem + ".txt", "w", encoding="utf-8") as f:
+                    f.write(f"peak traced memory: {peak / 1048576:.1f} MB\n")
+                    for stat in snapshot.statistics("lineno")[:50]:
+                        f.write(f"{stat}\n")
+    except Exception:
+        pass
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,574 @@
+# ocr_engine.py
+"""
+OCR on the shared pool of long-lived worker processes (see pools.py).
+
+Each worker keeps its tesseract warm: with tesserocr installed, one
+PyTessBaseAPI per language/config is created on first use and reused for
+every later page and request, so the language data is loaded once per
+process instead of once per page. Without it, pages go through pytesseract
+(one tesseract run per page) as before. Page rasters reach the workers
+through shared-memory segments that are kept and reused for the life of
+the process, rather than being pickled through the pool's pipe.
+Rasters are cleaned up on the way (see ocr_preprocess.py).
+"""
+import os
+import re
+import sys
+import html
+import threading
+from collections import deque
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytesseract
+from PIL import Image
+
+from metrics import stage
+from ocr_preprocess import OCR_PREPROCESS, page_dpi, prepare_raster
+from pools import get_pool, on_pool_start, on_shutdown, on_worker_start, worker_count
+from spool import open_pdf
+
+try:
+    import tesserocr
+except ImportError:  # optional: falls back to the tesseract CLI via pytesseract
+    tesserocr = None
+
+
+# Pool workers per OCR request (within WORKER_BUDGET, see pools.py); 1 = in-process
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+# Render resolution for pages without a scanned image to take it from (and for hOCR/TSV/PDF output)
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# Pages whose text layer has at least this many characters are not OCR'd
+TEXT_LAYER_MIN_CHARS = int(os.getenv("OCR_TEXT_LAYER_MIN_CHARS", "20"))
+# "auto" (tesserocr when installed), "tesserocr" or "cli"
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").strip().lower()
+# Language loaded into each worker when it starts
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+# Idle shared-memory slots kept for reuse; beyond this, released slots are unlinked
+OCR_IDLE_SLOTS = int(os.getenv("OCR_IDLE_SLOTS", "8"))
+
+
+# =========================
+# Recognition (runs in the workers, or in-process for workers <= 1)
+# =========================
+# hOCR element ids carry the page number first: page_1, block_1_2, word_1_17, ...
+_HOCR_IDS = re.compile(r"(\b(?:page|block|par|line|word|carea|textline|photo|separator|caption|textfloat)_)1(?=[_'\"])")
+
+# (lang, config) -> PyTessBaseAPI, kept for the life of the process
+_apis: Dict[Tuple[str, str], "tesserocr.PyTessBaseAPI"] = {}
+
+
+def _use_tesserocr() -> bool:
+    if OCR_BACKEND == "cli":
+        return False
+    if tesserocr is None and OCR_BACKEND == "tesserocr":
+        raise RuntimeError("OCR_BACKEND=tesserocr but tesserocr is not installed")
+    return tesserocr is not None
+
+
+def _parse_config(config: str) -> Tuple[Optional[int], Dict[str, str]]:
+    """The tesseract CLI options tesserocr can take: --psm N and -c name=value."""
+    psm, variables = None, {}
+    tokens = config.split()
+    for i, token in enumerate(tokens):
+        value = tokens[i + 1] if i + 1 < len(tokens) else ""
+        if token == "--psm" and value.isdigit():
+            psm = int(value)
+        elif token == "-c" and "=" in value:
+            name, _, val = value.partition("=")
+            variables[name] = val
+    return psm, variables
+
+
+def _get_api(lang: Optional[str], config: str):
+    key = (lang or OCR_LANG, config)
+    api = _apis.get(key)
+    if api is None:
+        psm, variables = _parse_config(config)
+        api = tesserocr.PyTessBaseAPI(lang=key[0])
+        if psm is not None:
+            api.SetPageSegMode(psm)
+        for name, value in variables.items():
+            api.SetVariable(name, value)
+        _apis[key] = api
+    return api
+
+
+def _hocr_page(document: str, page_number: int) -> str:
+    """The ocr_page div of a one-page hOCR document, renumbered as page `page_number` (0-based)."""
+    body = document.split("<body>", 1)[-1].rsplit("</body>", 1)[0].strip("\n")
+    body = _HOCR_IDS.sub(lambda m: f"{m.group(1)}{page_number + 1}", body)
+    return body.replace("ppageno 0", f"ppageno {page_number}") + "\n"
+
+
+def _tsv_rows(tsv: str, page_number: int) -> str:
+    """TSV rows without the header line, page_num set to `page_number` + 1."""
+    rows = []
+    for line in tsv.splitlines():
+        cols = line.split("\t")
+        if len(cols) < 12 or not cols[0].isdigit():
+            continue
+        cols[1] = str(page_number + 1)
+        rows.append("\t".join(cols))
+    return "".join(row + "\n" for row in rows)
+
+
+def _tsv_words(tsv: str) -> List[Tuple[int, int, int, int, str]]:
+    """(left, top, width, height, text) for each recognized word of a TSV result."""
+    words = []
+    for line in tsv.splitlines():
+        cols = line.split("\t")
+        if len(cols) >= 12 and cols[0] == "5" and cols[11].strip():
+            words.append((int(cols[6]), int(cols[7]), int(cols[8]), int(cols[9]), cols[11]))
+    return words
+
+
+def _recognize(width: int, height: int, samples, lang: Optional[str], config: str,
+               mode: str = "txt", page_number: int = 0):
+    """
+    OCR an 8-bit grayscale raster (`samples`: bytes-like, width*height long).
+    Returns text for "txt", an ocr_page div for "hocr", TSV rows for "tsv",
+    or a list of word boxes (pixels) for "words".
+    """
+    try:
+        if _use_tesserocr():
+            api = _get_api(lang, config)
+            api.SetImageBytes(bytes(samples), width, height, 1, width)
+            try:
+                if mode == "hocr":
+                    return api.GetHOCRText(page_number)
+                if mode in ("tsv", "words"):
+                    tsv = api.GetTSVText(page_number)
+                    return _tsv_words(tsv) if mode == "words" else _tsv_rows(tsv, page_number)
+                return api.GetUTF8Text()
+            finally:
+                api.Clear()
+        img = Image.frombytes("L", (width, height), bytes(samples))
+        kwargs = {"lang": lang} if lang else {}
+        if mode == "hocr":
+            hocr = pytesseract.image_to_pdf_or_hocr(img, extension="hocr", config=config, **kwargs)
+            return _hocr_page(hocr.decode("utf-8"), page_number)
+        if mode in ("tsv", "words"):
+            tsv = pytesseract.image_to_data(img, config=config, **kwargs)
+            return _tsv_words(tsv) if mode == "words" else _tsv_rows(tsv, page_number)
+        return pytesseract.image_to_string(img, config=config, **kwargs)
+    except Exception as e:
+        # pytesseract's/tesserocr's exceptions don't survive pickling back to the parent
+        raise RuntimeError(str(e)) from None
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Map the parent's segment `name`; the parent owns it and unlinks it itself."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # older Pythons register the segment again on attach; that goes to the parent's
+    # resource tracker (see on_pool_start below), which already has it, so it's a no-op
+    return shared_memory.SharedMemory(name=name)
+
+
+def _ocr_shared(name: str, width: int, height: int, lang: Optional[str], config: str,
+                mode: str = "txt", page_number: int = 0):
+    shm = _attach(name)
+    view = shm.buf[:width * height]
+    try:
+        return _recognize(width, height, view, lang, config, mode, page_number)
+    finally:
+        # close() fails while a view of the buffer is still exported (e.g. held by a traceback)
+        view.release()
+        shm.close()
+
+
+if sys.version_info < (3, 13):
+    # A forked worker only shares the parent's resource tracker if it was already running;
+    # otherwise it would start its own, which unlinks the parent's segments when the worker exits
+    on_pool_start(resource_tracker.ensure_running)
+
+
+def _init_worker(tesseract_cmd: str):
+    # Tesseract's own OpenMP threads fight with our process pool; one each is fastest
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if tesserocr is not None and OCR_BACKEND != "cli":
+        try:
+            _get_api(OCR_LANG, "")  # load the default language before the first page arrives
+        except Exception:
+            pass  # reported on first use instead
+
+
+# the worker tesseract path is the parent's at the time the pool starts
+on_worker_start(_init_worker, lambda: (pytesseract.pytesseract.tesseract_cmd,))
+
+
+class _RasterSlots:
+    """
+    Shared-memory segments for rasters in flight, reused page after page and
+    request after request. A slot is handed out by put() and returned by
+    release() once its page is done; up to `idle` returned slots are kept
+    for the next put(). close() unlinks them all.
+    """
+
+    def __init__(self, idle: int = OCR_IDLE_SLOTS):
+        self.idle = max(0, idle)
+        self._free: List[shared_memory.SharedMemory] = []
+        self._all: List[shared_memory.SharedMemory] = []
+        self._lock = threading.Lock()
+
+    def put(self, samples) -> shared_memory.SharedMemory:
+        size = len(samples)
+        shm = None
+        with self._lock:
+            for i, slot in enumerate(self._free):
+                if slot.size >= size:
+                    shm = self._free.pop(i)
+                    break
+            if shm is None:
+                shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+                self._all.append(shm)
+        shm.buf[:size] = samples
+        return shm
+
+    def release(self, shm: shared_memory.SharedMemory) -> None:
+        with self._lock:
+            self._free.append(shm)
+            if len(self._free) <= self.idle:
+                return
+            # keep the largest: they fit any raster the smaller ones do
+            self._free.sort(key=lambda slot: slot.size)
+            victim = self._free.pop(0)
+            self._all.remove(victim)
+        victim.close()
+        victim.unlink()
+
+    def close(self) -> None:
+        with self._lock:
+            slots, self._all, self._free = self._all, [], []
+        for shm in slots:
+            shm.close()
+            shm.unlink()
+
+
+_slots: Optional[_RasterSlots] = None
+_slots_pid = None
+_slots_lock = threading.Lock()
+
+
+def _get_slots() -> _RasterSlots:
+    """This process's slots, created lazily (a forked child gets its own) and unlinked at shutdown."""
+    global _slots, _slots_pid
+    with _slots_lock:
+        if _slots is None or _slots_pid != os.getpid():
+            _slots, _slots_pid = _RasterSlots(), os.getpid()
+        return _slots
+
+
+def _close_slots() -> None:
+    with _slots_lock:
+        if _slots is not None and _slots_pid == os.getpid():
+            _slots.close()
+
+
+on_shutdown(_close_slots)
+
+
+def ocr_image(img: Image.Image, lang: Optional[str] = None, config: str = "",
+              workers: Optional[int] = None, mode: str = "txt", preprocess: Optional[bool] = None):
+    """OCR one image on a warm pool worker (in-process when workers <= 1); see _recognize for `mode`."""
+    workers = worker_count(OCR_WORKERS if workers is None else workers)
+    preprocess = OCR_PREPROCESS if preprocess is None else preprocess
+    gray = img if img.mode == "L" else img.convert("L")
+    width, height, samples = gray.width, gray.height, gray.tobytes()
+    if preprocess:
+        raster = prepare_raster(np.asarray(gray), geometry=mode == "txt")
+        if raster is None:
+            return ""  # blank
+        height, width = raster.shape
+        samples = raster.ravel()
+    if workers <= 1:
+        return _recognize(width, height, samples, lang, config, mode)
+    slots = _get_slots()
+    shm = slots.put(samples)
+    future = get_pool().submit(_ocr_shared, shm.name, width, height, lang, config, mode)
+    try:
+        return future.result()
+    finally:
+        if future.cancel() or future.done():
+            slots.release(shm)  # otherwise the worker still reads it; the segment goes at shutdown
+
+
+def page_has_text_layer(page, min_chars: int = TEXT_LAYER_MIN_CHARS) -> bool:
+    """True if the page already carries enough extractable text to skip OCR."""
+    return len(page.get_text("text").strip()) >= min_chars
+
+
+def iter_pages_for_ocr(doc, dpi: int = OCR_DPI,
+                       skip_text_pages: bool = True,
+                       preprocess: bool = False,
+                       geometry: bool = False) -> Iterator[Tuple[int, Optional[str], Optional[tuple]]]:
+    """
+    Walk the document one page at a time.
+    Yields (page_index, text, None) for pages with a usable text layer,
+    or (page_index, None, (width, height, gray_samples)) for pages to OCR.
+    With `preprocess` rasters are binarized; `geometry` also lets each page
+    pick its own resolution, be deskewed and cropped (so pixel positions no
+    longer match a `dpi` render), and has blank pages yielded as text "".
+    Only the current page's raster is held in memory here.
+    """
+    for page in doc:
+        if skip_text_pages and page_has_text_layer(page):
+            yield page.number, page.get_text("text"), None
+            continue
+        with stage("ocr_render"):
+            pix = page.get_pixmap(dpi=page_dpi(page, dpi) if preprocess and geometry else dpi,
+                                  colorspace=fitz.csGRAY, alpha=False)
+        if not preprocess:
+            yield page.number, None, (pix.width, pix.height, pix.samples)
+            continue
+        raster = prepare_raster(np.frombuffer(pix.samples_mv, np.uint8).reshape(pix.height, pix.width),
+                                geometry)
+        del pix
+        if raster is None:
+            yield page.number, "", None
+        else:
+            yield page.number, None, (raster.shape[1], raster.shape[0], raster.ravel())
+
+
+def iter_ocr_results(doc, mode: str = "txt",
+                     dpi: int = OCR_DPI,
+                     workers: Optional[int] = None,
+                     skip_text_pages: bool = True,
+                     lang: Optional[str] = None,
+                     config: str = "",
+                     preprocess: Optional[bool] = None) -> Iterator[Tuple[int, Any]]:
+    """
+    OCR a document's pages across the process pool, yielding (page_index,
+    result) in page order as soon as a page and every page before it are
+    done. result is what _recognize returns for `mode`, or None for pages
+    read from their text layer (and blank pages, which aren't sent to tesseract).
+
+    Pages are rasterized as a stream; at most ~2x `workers` rasters are in flight,
+    so memory stays bounded regardless of page count. `preprocess` (default
+    OCR_PREPROCESS) cleans each raster up first; word positions only come
+    back on the `dpi` grid, so "txt" is the only mode that also gets adaptive
+    resolution, deskew and cropping.
+    """
+    workers = worker_count(OCR_WORKERS if workers is None else workers)
+    pages = iter_pages_for_ocr(doc, dpi, skip_text_pages,
+                               preprocess=OCR_PREPROCESS if preprocess is None else preprocess,
+                               geometry=mode == "txt")
+    if workers <= 1:
+        for index, text, raster in pages:
+            yield index, None if raster is None else _recognize(*raster, lang, config, mode, index)
+        return
+
+    pool = get_pool()
+    window = max(2, 2 * workers)
+    slots = _get_slots()
+    in_flight = deque()  # (page_index, slot, future) in page order; None, None for text-layer pages
+
+    def _pop():
+        index, shm, future = in_flight.popleft()
+        try:
+            return index, (future.result() if future is not None else None)
+        finally:
+            if shm is not None:
+                slots.release(shm)
+
+    try:
+        for index, text, raster in pages:
+            if raster is None:
+                in_flight.append((index, None, None))
+            else:
+                width, height, samples = raster
+                shm = slots.put(samples)
+                in_flight.append((index, shm, pool.submit(_ocr_shared, shm.name, width, height,
+                                                          lang, config, mode, index)))
+            # hand back whatever is finished at the head, and block once the window is full
+            while in_flight and (len(in_flight) >= window or in_flight[0][2] is None
+                                 or in_flight[0][2].done()):
+                yield _pop()
+        while in_flight:
+            yield _pop()
+    finally:
+        for _, _, future in in_flight:
+            if future is not None:
+                future.cancel()
+        for _, shm, future in in_flight:
+            if future is None:
+                continue
+            if not future.cancelled():
+                try:
+                    future.result()  # a running worker may still be reading its slot
+                except Exception:
+                    pass
+            slots.release(shm)
+
+
+def ocr_pdf_pages(pdf_src,
+                  dpi: int = OCR_DPI,
+                  workers: Optional[int] = None,
+                  skip_text_pages: bool = True,
+                  lang: Optional[str] = None,
+                  config: str = "",
+                  progress: Optional[Callable[[int, int], None]] = None,
+                  preprocess: Optional[bool] = None) -> List[str]:
+    """OCR a PDF (path or bytes) and return one string per page, in page order."""
+    doc = open_pdf(pdf_src)
+    try:
+        texts: List[str] = []
+        for index, text in iter_ocr_results(doc, "txt", dpi, workers, skip_text_pages, lang, config,
+                                            preprocess):
+            texts.append(doc[index].get_text("text") if text is None else text)
+            if progress:
+                progress(len(texts), doc.page_count)
+        return texts
+    finally:
+        doc.close()
+
+
+# =========================
+# Output formats
+# =========================
+OUTPUT_MODES = ("txt", "hocr", "tsv", "pdf")
+
+HOCR_HEAD = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+  <meta name='ocr-system' content='tesseract'/>
+  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word ocrp_wconf'/>
+ </head>
+ <body>
+"""
+HOCR_TAIL = " </body>\n</html>\n"
+TSV_HEADER = "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+
+
+def _layer_words(page, dpi: int):
+    """Text-layer words as (block, line, word, pixel box on a `dpi` raster, text)."""
+    to_raster = page.rotation_matrix * fitz.Matrix(dpi / 72.0, dpi / 72.0)
+    for x0, y0, x1, y1, text, block, line, word in page.get_text("words"):
+        box = fitz.Rect(x0, y0, x1, y1) * to_raster
+        yield block, line, word, tuple(int(round(v)) for v in box), text
+
+
+def _raster_size(page, dpi: int) -> Tuple[int, int]:
+    return int(round(page.rect.width * dpi / 72.0)), int(round(page.rect.height * dpi / 72.0))
+
+
+def _text_layer_hocr(page, dpi: int) -> str:
+    """hOCR for a page read from its text layer, shaped like tesseract's."""
+    n = page.number + 1
+    width, height = _raster_size(page, dpi)
+    out = [f"  <div class='ocr_page' id='page_{n}' title='bbox 0 0 {width} {height}; ppageno {page.number}'>\n"]
+    current = None
+    for block, line, word, (x0, y0, x1, y1), text in _layer_words(page, dpi):
+        if (block, line) != current:
+            if current is not None:
+                out.append("   </span>\n")
+            current = (block, line)
+            out.append(f"   <span class='ocr_line' id='line_{n}_{block}_{line}'>\n")
+        out.append(f"    <span class='ocrx_word' id='word_{n}_{block}_{line}_{word}' "
+                   f"title='bbox {x0} {y0} {x1} {y1}; x_wconf 100'>{html.escape(text)}</span>\n")
+    if current is not None:
+        out.append("   </span>\n")
+    out.append("  </div>\n")
+    return "".join(out)
+
+
+def _text_layer_tsv(page, dpi: int) -> str:
+    """TSV rows (the page, then one per word) for a page read from its text layer."""
+    n = page.number + 1
+    width, height = _raster_size(page, dpi)
+    rows = [f"1\t{n}\t0\t0\t0\t0\t0\t0\t{width}\t{height}\t-1\t"]
+    for block, line, word, (x0, y0, x1, y1), text in _layer_words(page, dpi):
+        rows.append(f"5\t{n}\t{block + 1}\t1\t{line + 1}\t{word + 1}\t{x0}\t{y0}\t{x1 - x0}\t{y1 - y0}\t100\t{text}")
+    return "".join(row + "\n" for row in rows)
+
+
+def iter_ocr_output(pdf_src, mode: str = "txt",
+                    dpi: int = OCR_DPI,
+                    skip_text_pages: bool = True,
+                    lang: Optional[str] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Iterator[bytes]:
+    """
+    OCR a PDF into plain text, hOCR or TSV, as an iterator of UTF-8 chunks
+    that yields each page as soon as it (and every page before it) is done.
+    Pages with a text layer are written from it in the same format.
+    The PDF is opened up front so a broken upload fails before streaming starts.
+    """
+    doc = open_pdf(pdf_src)
+
+    def _chunks():
+        try:
+            if mode == "hocr":
+                yield HOCR_HEAD.encode("utf-8")
+            elif mode == "tsv":
+                yield TSV_HEADER.encode("utf-8")
+            for index, result in iter_ocr_results(doc, mode, dpi, skip_text_pages=skip_text_pages, lang=lang):
+                page = doc[index]
+                if mode == "hocr":
+                    chunk = result if result is not None else _text_layer_hocr(page, dpi)
+                elif mode == "tsv":
+                    chunk = result if result is not None else _text_layer_tsv(page, dpi)
+                else:
+                    chunk = (result if result is not None else page.get_text("text")) + "\n"
+                if progress:
+                    progress(index + 1, doc.page_count)
+                yield chunk.encode("utf-8")
+            if mode == "hocr":
+                yield HOCR_TAIL.encode("utf-8")
+        finally:
+            doc.close()
+
+    return _chunks()
+
+
+def add_text_layer(page, words: List[Tuple[int, int, int, int, str]], dpi: int) -> None:
+    """
+    Write OCR'd words (pixel boxes on a `dpi` raster of the page as
+    displayed) onto the page as invisible text, each stretched to its box so
+    selection and search highlights line up with the scan.
+    """
+    if not words:
+        return
+    scale = 72.0 / dpi
+    to_page = page.derotation_matrix
+    # words run left to right on the displayed page; undo the page rotation for the glyphs too
+    unrotate = ~fitz.Matrix(to_page.a, to_page.b, to_page.c, to_page.d, 0, 0)
+    shape = page.new_shape()
+    for left, top, width, height, text in words:
+        fontsize = max(1.0, height * scale)
+        natural = fitz.get_text_length(text, fontname="helv", fontsize=fontsize)
+        if natural <= 0:
+            continue
+        origin = fitz.Point(left * scale, (top + height * 0.8) * scale) * to_page
+        shape.insert_text(origin, text, fontname="helv", fontsize=fontsize, render_mode=3,
+                          morph=(origin, fitz.Matrix(width * scale / natural, 1) * unrotate))
+    shape.commit()
+
+
+def ocr_searchable_pdf(pdf_src,
+                       dpi: int = OCR_DPI,
+                       lang: Optional[str] = None,
+                       progress: Optional[Callable[[int, int], None]] = None) -> fitz.Document:
+    """
+    Add an invisible OCR text layer to every page of a PDF that lacks one,
+    rasterizing each page once; returns the open document for the caller to
+    save. Pages that already have a text layer are left alone.
+    """
+    doc = open_pdf(pdf_src)
+    try:
+        for index, words in iter_ocr_results(doc, "words", dpi, lang=lang):
+            if words is not None:
+                add_text_layer(doc[index], words, dpi)
+            if progress:
+                progress(index + 1, doc.page_count)
+    except Exception:
+        doc.close()
+        raise
+    return doc
@@ -0,0 +1,170 @@
+# ocr_preprocess.py
+"""
+Raster clean-up before tesseract, all in vectorized NumPy.
+
+- The render resolution follows the page: a scan is rendered at the
+  resolution its image was captured at (clamped to OCR_MIN_DPI..OCR_MAX_DPI),
+  since rendering above it only interpolates pixels and below it throws
+  detail away.
+- Pages are binarized with Otsu's threshold, so tesseract gets clean black
+  text on white instead of JPEG noise and paper tint.
+- Skew is measured from the ink's horizontal projection and undone, and
+  empty margins are cropped, so tesseract lays out fewer, straighter pixels.
+
+Deskew and cropping move pixels, so they only run where word positions
+aren't reported (plain text output).
+"""
+import os
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from metrics import stage
+
+# Set to 0 to hand tesseract the plain grayscale render
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1").lower() in ("1", "true", "yes")
+# Clamp for the resolution taken from a page's scanned image
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+# Largest skew (degrees, either way) deskew looks for
+OCR_MAX_SKEW = float(os.getenv("OCR_MAX_SKEW", "5"))
+
+# An image covering at least this share of the page is taken to be the scan
+_SCAN_COVERAGE = 0.5
+# Skew is measured on a copy at most this many pixels on its longer side
+_SKEW_SAMPLE_SIDE = 1000
+# ...using at most this many ink pixels
+_SKEW_MAX_POINTS = 100_000
+# Angles smaller than this (degrees) aren't worth a rotation
+_MIN_ROTATION = 0.1
+# Rows/columns need this many ink pixels to count as content (drops specks)
+_MIN_INK = 2
+
+
+# =========================
+# Resolution
+# =========================
+def page_dpi(page, default: int) -> int:
+    """
+    Resolution to render `page` at for OCR: the effective resolution of a
+    scan covering most of the page, clamped to OCR_MIN_DPI..OCR_MAX_DPI,
+    or `default` for pages without one (vector text, small images).
+    """
+    page_area = abs(page.rect)
+    best_area, native = 0.0, 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        bw, bh = abs(x1 - x0), abs(y1 - y0)
+        area = bw * bh
+        if area < _SCAN_COVERAGE * page_area or area <= best_area or not bw or not bh:
+            continue
+        # compare long side to long side, so an image placed with a quarter turn still matches
+        w, h = info["width"], info["height"]
+        best_area = area
+        native = 72.0 * min(max(w, h) / max(bw, bh), min(w, h) / min(bw, bh))
+    if not native:
+        return default
+    return int(round(min(max(native, OCR_MIN_DPI), OCR_MAX_DPI)))
+
+
+# =========================
+# Pixel stages
+# =========================
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Otsu's threshold of an 8-bit image: the level that best separates ink from paper."""
+    # every other row and column: the same histogram shape at a quarter of the cost
+    hist = np.bincount(gray[::2, ::2].ravel(), minlength=256).astype(np.float64)
+    weight = np.cumsum(hist)
+    mass = np.cumsum(hist * np.arange(256))
+    total = weight[-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = (mass[-1] * weight - mass * total) ** 2 / (weight * (total - weight))
+    between[~np.isfinite(between)] = 0
+    # a clean two-tone page scores every level between its tones the same; take the middle one
+    best = np.flatnonzero(between == between.max())
+    return int(best[0] + best[-1]) // 2
+
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    """0 for ink, 255 for paper."""
+    return (gray > otsu_threshold(gray)).view(np.uint8) * np.uint8(255)
+
+
+def _shrink_ink(ink: np.ndarray) -> np.ndarray:
+    """Block-OR `ink` down to at most _SKEW_SAMPLE_SIDE pixels on its longer side."""
+    k = max(1, -(-max(ink.shape) // _SKEW_SAMPLE_SIDE))
+    if k == 1:
+        return ink
+    h, w = ink.shape[0] // k, ink.shape[1] // k
+    return ink[:h * k, :w * k].reshape(h, k, w, k).any(axis=(1, 3))
+
+
+def _profile_scores(ys: np.ndarray, xs: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """
+    Sharpness of the ink's row profile when the page is sheared by each angle:
+    text lines collapse into a few full rows at the true skew, which
+    maximizes the sum of squared row counts.
+    """
+    rad = np.radians(angles)[:, None]
+    rows = np.rint(ys * np.cos(rad) - xs * np.sin(rad)).astype(np.int64)
+    rows -= rows.min(axis=1, keepdims=True)
+    span = int(rows.max()) + 1
+    rows += np.arange(len(angles))[:, None] * span
+    counts = np.bincount(rows.ravel(), minlength=len(angles) * span).reshape(len(angles), span)
+    return (counts.astype(np.float64) ** 2).sum(axis=1)
+
+
+def estimate_skew(binary: np.ndarray, max_angle: float = OCR_MAX_SKEW) -> float:
+    """
+    Angle (degrees) the text lines run downhill to the right, found by a
+    coarse then fine search of the projection profile; 0.0 for pages with
+    too little ink to tell.
+    """
+    ys, xs = np.nonzero(_shrink_ink(binary == 0))
+    if len(ys) < 100 or max_angle <= 0:
+        return 0.0
+    if len(ys) > _SKEW_MAX_POINTS:
+        step = len(ys) // _SKEW_MAX_POINTS + 1
+        ys, xs = ys[::step], xs[::step]
+    ys, xs = ys.astype(np.float64), xs.astype(np.float64)
+    coarse = np.arange(-max_angle, max_angle + 1e-9, 0.5)
+    best = coarse[np.argmax(_profile_scores(ys, xs, coarse))]
+    fine = np.arange(best - 0.5, best + 0.5 + 1e-9, 0.05)
+    return float(fine[np.argmax(_profile_scores(ys, xs, fine))])
+
+
+def deskew(binary: np.ndarray, angle: float) -> np.ndarray:
+    """Undo a skew of `angle` (as estimate_skew reports it) so the lines run level; corners are filled with paper."""
+    if abs(angle) < _MIN_ROTATION:
+        return binary
+    rotated = Image.fromarray(binary).rotate(angle, resample=Image.NEAREST, expand=True, fillcolor=255)
+    return np.asarray(rotated)
+
+
+def crop_margins(binary: np.ndarray, padding: int = 16) -> Optional[np.ndarray]:
+    """The ink's bounding box plus `padding` pixels of paper; None for a blank page."""
+    ink = binary == 0
+    rows = np.flatnonzero(np.count_nonzero(ink, axis=1) >= _MIN_INK)
+    cols = np.flatnonzero(np.count_nonzero(ink, axis=0) >= _MIN_INK)
+    if not len(rows) or not len(cols):
+        return None
+    top, bottom = max(0, rows[0] - padding), min(binary.shape[0], rows[-1] + padding + 1)
+    left, right = max(0, cols[0] - padding), min(binary.shape[1], cols[-1] + padding + 1)
+    return np.ascontiguousarray(binary[top:bottom, left:right])
+
+
+def prepare_raster(gray: np.ndarray, geometry: bool = True) -> Optional[np.ndarray]:
+    """
+    Binarize an 8-bit grayscale page; with `geometry`, also deskew it and
+    crop its margins (returning None when the page is blank). Each stage is
+    timed into the current request's metrics.
+    """
+    with stage("ocr_binarize"):
+        binary = binarize(gray)
+    if not geometry:
+        return binary
+    with stage("ocr_deskew"):
+        binary = deskew(binary, estimate_skew(binary))
+    with stage("ocr_crop"):
+        return crop_margins(binary)
@@ -0,0 +1,159 @@
+# pdf_compress.py
+import io
+import hashlib
+import inspect
+from typing import Any, Callable, Dict, Optional
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+
+# Save options for compressed output: drop unused objects, merge duplicates
+# (identical fonts/images), deflate streams, pack objects into object streams.
+COMPRESSED_SAVE_OPTIONS = {"garbage": 4, "deflate": True, "use_objstms": 1}
+if "use_objstms" not in inspect.signature(fitz.Document.save).parameters:  # PyMuPDF < 1.24
+    del COMPRESSED_SAVE_OPTIONS["use_objstms"]
+
+# Already-efficient bilevel encodings; re-encoding them as JPEG only grows them
+_SKIP_FILTERS = ("JBIG2Decode", "CCITTFaxDecode")
+
+
+def _image_display_sizes(doc) -> Dict[int, tuple]:
+    """
+    Largest on-page size (in points) each image xref is drawn at, over all pages.
+    """
+    sizes: Dict[int, tuple] = {}
+    for page in doc:
+        for info in page.get_images(full=True):
+            xref = info[0]
+            try:
+                rects = page.get_image_rects(xref)
+            except Exception:
+                rects = []
+            for r in rects:
+                w, h = sizes.get(xref, (0.0, 0.0))
+                sizes[xref] = (max(w, abs(r.width)), max(h, abs(r.height)))
+    return sizes
+
+
+def _encode_downsampled(doc, xref: int, scale: float, jpeg_quality: int):
+    """Decode an image XObject, resample it by `scale`, return (jpeg, w, h, colorspace)."""
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)  # drop alpha
+    if pix.n not in (1, 3):  # CMYK, Lab, ... -> RGB
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    pix = None
+
+    new_w = max(1, int(round(img.width * scale)))
+    new_h = max(1, int(round(img.height * scale)))
+    # reducing_gap lets Pillow do a cheap integer reduce before the final resample
+    img = img.resize((new_w, new_h), Image.LANCZOS, reducing_gap=3.0)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=jpeg_quality)
+    return buf.getvalue(), new_w, new_h, "/DeviceGray" if mode == "L" else "/DeviceRGB"
+
+
+def _write_jpeg_xobject(doc, xref: int, data: bytes, width: int, height: int, colorspace: str):
+    """Replace an image XObject's stream and dictionary in place (all pages see it)."""
+    doc.update_stream(xref, data, compress=False)
+    doc.xref_set_key(xref, "Filter", "/DCTDecode")
+    doc.xref_set_key(xref, "DecodeParms", "null")
+    doc.xref_set_key(xref, "Decode", "null")
+    doc.xref_set_key(xref, "Width", str(width))
+    doc.xref_set_key(xref, "Height", str(height))
+    doc.xref_set_key(xref, "BitsPerComponent", "8")
+    doc.xref_set_key(xref, "ColorSpace", colorspace)
+
+
+def compress_pdf_images(doc, target_dpi: int = 150, jpeg_quality: int = 75,
+                        progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Downsample and re-encode embedded images whose effective resolution is
+    above `target_dpi`. Text and vector content are left untouched.
+
+    Identical images (same raw stream) are encoded once; the duplicates get
+    the same bytes and are merged into one object on save (garbage=4).
+    An image is only downsampled as far as its largest placement allows.
+    Images with soft masks and bilevel (JBIG2/CCITT) images are skipped.
+    Returns simple stats for logging/metrics.
+    """
+    sizes = _image_display_sizes(doc)
+    stats = {"images": len(sizes), "recompressed": 0, "deduplicated": 0, "bytes_saved": 0}
+
+    # Group candidate images by raw stream digest, tracking the largest placement
+    groups: Dict[str, Dict[str, Any]] = {}
+    for xref, (disp_w, disp_h) in sizes.items():
+        if disp_w <= 0 or disp_h <= 0:
+            continue
+        if doc.xref_get_key(xref, "SMask")[0] != "null" or doc.xref_get_key(xref, "Mask")[0] != "null":
+            continue
+        filt = doc.xref_get_key(xref, "Filter")[1]
+        if any(f in filt for f in _SKIP_FILTERS):
+            continue
+        try:
+            width = int(doc.xref_get_key(xref, "Width")[1])
+            height = int(doc.xref_get_key(xref, "Height")[1])
+            bpc = int(doc.xref_get_key(xref, "BitsPerComponent")[1])
+        except (TypeError, ValueError):
+            continue
+        if bpc == 1:
+            continue
+        raw = doc.xref_stream_raw(xref)
+        digest = hashlib.sha1(raw).hexdigest()
+        group = groups.setdefault(digest, {
+            "xrefs": [], "width": width, "height": height,
+            "raw_len": len(raw), "disp_w": 0.0, "disp_h": 0.0,
+        })
+        group["xrefs"].append(xref)
+        group["disp_w"] = max(group["disp_w"], disp_w)
+        group["disp_h"] = max(group["disp_h"], disp_h)
+
+    total = len(groups)
+    for n, group in enumerate(groups.values(), start=1):
+        if progress:
+            progress(n, total)
+        # effective resolution at the largest placement (pixels per inch)
+        dpi = min(group["width"] / (group["disp_w"] / 72.0), group["height"] / (group["disp_h"] / 72.0))
+        if dpi <= target_dpi * 1.1:
+            continue
+        xrefs = group["xrefs"]
+        try:
+            result = _encode_downsampled(doc, xrefs[0], target_dpi / dpi, jpeg_quality)
+        except Exception:
+            continue
+        if len(result[0]) >= group["raw_len"]:
+            continue  # not worth it
+        for xref in xrefs:
+            _write_jpeg_xobject(doc, xref, *result)
+        stats["recompressed"] += 1
+        stats["deduplicated"] += len(xrefs) - 1
+        stats["bytes_saved"] += group["raw_len"] * len(xrefs) - len(result[0])
+    return stats
+
+
+def rasterize_pdf_pages(doc, dpi: int, jpeg_quality: int,
+                        progress: Optional[Callable[[int, int], None]] = None) -> None:
+    """
+    Fallback mode: rasterize each PDF page at `dpi` and re-embed as JPEG with
+    `jpeg_quality`. Shrinks anything, but text is no longer searchable.
+    The page's original content and resources are dropped, so garbage
+    collection on save can remove the fonts/images only they used.
+    """
+    for page in doc:
+        pix = page.get_pixmap(dpi=dpi)
+        mode = "RGB" if pix.alpha == 0 else "RGBA"
+        pil = Image.frombytes(mode, [pix.width, pix.height], pix.samples)
+        img_buf = io.BytesIO()
+        pil.convert("RGB").save(img_buf, format="JPEG", quality=jpeg_quality, optimize=True)
+        img_buf.seek(0)
+        rect = page.rect
+        page.clean_contents()
+        for xref in page.get_contents():
+            doc.update_stream(xref, b" ")
+        doc.xref_set_key(page.xref, "Resources", "<<>>")
+        page.insert_image(rect, stream=img_buf.getvalue())
+        if progress:
+            progress(page.number + 1, doc.page_count)
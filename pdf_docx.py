@@ -0,0 +1,597 @@
+# pdf_docx.py
+"""
+PDF -> DOCX from PyMuPDF's text extraction.
+
+Pages are read in chunks on the shared process pool (see pools.py). Each
+worker turns its pages into plain records: paragraphs (styled runs), ruled
+tables and images, in reading order, with two-column layouts read column by
+column. The parent appends them to the document body in page order as
+chunks arrive, building the XML directly so each paragraph costs
+the same however long the document gets. Headings are assigned at the end,
+from font sizes relative to the document's body size.
+
+Not reconstructed: tables without ruling lines, headers/footers (kept as
+ordinary text), footnotes, floating positions, and more than two columns.
+"""
+import io
+import os
+import re
+import bisect
+import itertools
+from collections import Counter, deque
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from docx import Document
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.shared import Pt
+
+from metrics import stage, add_pages
+from pools import get_pool, worker_count
+from spool import Source, open_pdf, new_output
+
+
+# Pool workers to fan out to (within WORKER_BUDGET, see pools.py); 1 = extract in the request's own process
+PDF_DOCX_WORKERS = int(os.getenv("PDF_DOCX_WORKERS", str(os.cpu_count() or 1)))
+# Pages per task: big enough to amortize IPC, small enough to keep every worker busy
+PDF_DOCX_CHUNK_PAGES = int(os.getenv("PDF_DOCX_CHUNK_PAGES", "20"))
+# Ruling lines closer than this (points) are the same line
+_SNAP = 2.0
+# Images smaller than this (points, either side) are decoration, not content
+_MIN_IMAGE_PT = 8
+# A paragraph at least this much larger than the body size is a heading candidate
+_HEADING_RATIO = 1.15
+_HEADING_MAX_CHARS = 200
+
+_TEXT_FLAGS = fitz.TEXT_PRESERVE_IMAGES | fitz.TEXT_PRESERVE_WHITESPACE | fitz.TEXT_DEHYPHENATE
+_BULLET_GLYPHS = "•▪●◦‣⁃–*-"
+_BULLET = re.compile(r"^\s*([" + _BULLET_GLYPHS + r"]|\(?\d{1,3}[.)]|[a-zA-Z][.)])(\s|$)")
+# Formats Word can embed as-is; anything else is converted to PNG
+_DOCX_IMAGE_EXTS = {"png", "jpeg", "jpg", "gif", "bmp", "tiff", "tif"}
+
+# =========================
+# Worker side: page -> records
+# =========================
+def _span_style(span: Dict[str, Any]) -> Tuple[float, bool, bool, bool, bool, int]:
+    flags, font = span["flags"], span["font"]
+    bold = bool(flags & fitz.TEXT_FONT_BOLD) or "Bold" in font or "Black" in font
+    italic = bool(flags & fitz.TEXT_FONT_ITALIC) or "Italic" in font or "Oblique" in font
+    mono = bool(flags & fitz.TEXT_FONT_MONOSPACED)
+    sup = bool(flags & fitz.TEXT_FONT_SUPERSCRIPT)
+    return round(span["size"] * 2) / 2, bold, italic, mono, sup, span["color"]
+
+
+def _block_paragraphs(block: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Split a text block into paragraphs. Lines sharing a baseline are joined
+    with a tab; a new paragraph starts at a list marker or a vertical gap
+    larger than half a line.
+    """
+    rows: List[List[Dict[str, Any]]] = []
+    for line in block["lines"]:
+        if not any(s["text"].strip() for s in line["spans"]):
+            continue
+        if rows and abs(line["bbox"][3] - rows[-1][-1]["bbox"][3]) < 0.5 * (line["bbox"][3] - line["bbox"][1]):
+            rows[-1].append(line)
+        else:
+            rows.append([line])
+
+    paragraphs: List[Dict[str, Any]] = []
+    current: Optional[Dict[str, Any]] = None
+    for row in rows:
+        x0 = min(l["bbox"][0] for l in row)
+        x1 = max(l["bbox"][2] for l in row)
+        top = min(l["bbox"][1] for l in row)
+        bottom = max(l["bbox"][3] for l in row)
+        bullet = bool(_BULLET.match("".join(s["text"] for s in row[0]["spans"])))
+        if current is None or bullet or top - current["bbox"][3] > 0.5 * (bottom - top):
+            current = {"kind": "paragraph", "runs": [], "bbox": [x0, top, x1, bottom],
+                       "rows": 0, "bullet": bullet}
+            paragraphs.append(current)
+        elif current["runs"] and not current["runs"][-1][0].endswith((" ", "\t")):
+            current["runs"][-1][0] += " "
+        box = current["bbox"]
+        box[0], box[2], box[3] = min(box[0], x0), max(box[2], x1), bottom
+        current["line_h"] = bottom - top
+        current["rows"] += 1
+        for i, line in enumerate(row):
+            if i and current["runs"]:
+                current["runs"][-1][0] += "\t"
+            for span in line["spans"]:
+                text = span["text"]
+                if not text:
+                    continue
+                style = _span_style(span)
+                runs = current["runs"]
+                if runs and runs[-1][1] == style:
+                    runs[-1][0] += text
+                else:
+                    runs.append([text, style])
+    for para in paragraphs:
+        para["size"] = _dominant_size(para["runs"])
+    return paragraphs
+
+
+def _dominant_size(runs) -> float:
+    sizes = Counter()
+    for text, style in runs:
+        sizes[style[0]] += len(text)
+    return sizes.most_common(1)[0][0] if sizes else 0
+
+
+def _join_continuations(paragraphs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    MuPDF starts a new block where the line spacing changes (e.g. a line
+    with a larger run); a paragraph that carries on directly below the
+    previous one at the same indent and size is the same paragraph.
+    """
+    joined: List[Dict[str, Any]] = []
+    for para in paragraphs:
+        prev = joined[-1] if joined else None
+        if (prev is not None and not para["bullet"] and para["size"] == prev["size"]
+                and abs(para["bbox"][0] - prev["bbox"][0]) < 2
+                and -1 < para["bbox"][1] - prev["bbox"][3] < 0.5 * para["line_h"]):
+            if prev["runs"] and not prev["runs"][-1][0].endswith((" ", "\t")):
+                prev["runs"][-1][0] += " "
+            prev["runs"].extend(para["runs"])
+            prev["rows"] += para["rows"]
+            box = prev["bbox"]
+            box[2], box[3] = max(box[2], para["bbox"][2]), para["bbox"][3]
+            prev["line_h"] = para["line_h"]
+            continue
+        joined.append(para)
+    return joined
+
+
+def _finish_paragraph(para: Dict[str, Any], content: Tuple[float, float]) -> Optional[Dict[str, Any]]:
+    """Final runs, size, alignment and indent; None if the paragraph has no text."""
+    runs = []
+    for text, style in para["runs"]:
+        if runs and runs[-1][1] == style:
+            runs[-1][0] += text
+        elif text:
+            runs.append([text, style])
+    if runs:
+        runs[-1][0] = runs[-1][0].rstrip()
+    if para["bullet"] and runs and runs[0][0].lstrip()[:1] in _BULLET_GLYPHS:
+        # the list style draws its own bullet
+        runs[0][0] = runs[0][0].lstrip()[1:].lstrip()
+        para["style"] = "ListBullet"
+    para["runs"] = [(text, style) for text, style in runs if text]
+    if not para["runs"]:
+        return None
+    para["size"] = _dominant_size(para["runs"])
+    para["chars"] = sum(len(text) for text, _ in para["runs"])
+    para["bold"] = all(style[1] for text, style in para["runs"] if text.strip())
+    left, right = content
+    middle, width = (left + right) / 2, right - left
+    x0, _, x1, _ = para["bbox"]
+    centered = abs((x0 + x1) / 2 - middle) < 0.03 * width
+    para["align"] = "center" if centered and x1 - x0 < 0.8 * width else None
+    para["indent"] = max(0.0, x0 - left) if not para["align"] and "style" not in para else 0.0
+    for key in ("bbox", "line_h", "bullet"):
+        del para[key]
+    return para
+
+
+def _merge_segments(segs: List[Tuple[float, float, float]]) -> List[List[float]]:
+    """Collinear (position, start, end) segments joined into [position, start, end] lines."""
+    segs.sort()
+    groups: List[Tuple[float, List[Tuple[float, float]]]] = []
+    for pos, a, b in segs:
+        if groups and pos - groups[-1][0] <= _SNAP:
+            groups[-1][1].append((a, b))
+        else:
+            groups.append((pos, [(a, b)]))
+    lines: List[List[float]] = []
+    for pos, spans in groups:
+        spans.sort()
+        current = None
+        for a, b in spans:
+            if current is not None and a <= current[2] + _SNAP:
+                current[2] = max(current[2], b)
+            else:
+                current = [pos, a, b]
+                lines.append(current)
+    return lines
+
+
+def _rulings(paths: List[Dict[str, Any]]) -> Tuple[List[List[float]], List[List[float]]]:
+    """Horizontal and vertical lines drawn on the page: stroked lines/boxes and hairline fills."""
+    h: List[Tuple[float, float, float]] = []
+    v: List[Tuple[float, float, float]] = []
+    for path in paths:
+        stroked = "s" in path["type"]
+        for item in path["items"]:
+            if item[0] == "l" and stroked:
+                (x0, y0), (x1, y1) = item[1], item[2]
+                if abs(y0 - y1) <= 1:
+                    h.append((y0, min(x0, x1), max(x0, x1)))
+                elif abs(x0 - x1) <= 1:
+                    v.append((x0, min(y0, y1), max(y0, y1)))
+            elif item[0] == "re":
+                x0, y0, x1, y1 = item[1]
+                if y1 - y0 <= _SNAP < x1 - x0:
+                    h.append(((y0 + y1) / 2, x0, x1))
+                elif x1 - x0 <= _SNAP < y1 - y0:
+                    v.append(((x0 + x1) / 2, y0, y1))
+                elif stroked:
+                    h += [(y0, x0, x1), (y1, x0, x1)]
+                    v += [(x0, y0, y1), (x1, y0, y1)]
+    return _merge_segments(h), _merge_segments(v)
+
+
+def _ruled_tables(paths: List[Dict[str, Any]], blocks: List[Dict[str, Any]],
+                  content_width: float) -> List[Tuple[Tuple[float, float, float, float], Dict[str, Any]]]:
+    """
+    Tables drawn with ruling lines, found from the page's vector paths: each
+    group of connected horizontal and vertical lines is a cell grid, and a
+    missing line between two grid cells merges them. Text is placed in
+    cells span by span from the page's text dict. (find_tables does the same
+    but builds a per-character text model first, ~150 ms a page.)
+    """
+    hs, vs = _rulings(paths)
+    if len(hs) < 2 or len(vs) < 3:
+        return []
+    segs = [("h", s) for s in hs] + [("v", s) for s in vs]
+    parent = list(range(len(segs)))
+
+    def _find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(hs)):
+        y, x0, x1 = hs[i]
+        for j in range(len(vs)):
+            x, y0, y1 = vs[j]
+            if y0 - _SNAP <= y <= y1 + _SNAP and x0 - _SNAP <= x <= x1 + _SNAP:
+                parent[_find(i)] = _find(len(hs) + j)
+    groups: Dict[int, List[Tuple[str, List[float]]]] = {}
+    for i, seg in enumerate(segs):
+        groups.setdefault(_find(i), []).append(seg)
+
+    spans = [(span, line) for b in blocks if b["type"] == 0 for line in b["lines"] for span in line["spans"]
+             if span["text"].strip()]
+    tables = []
+    for group in groups.values():
+        h_lines = [s for kind, s in group if kind == "h"]
+        v_lines = [s for kind, s in group if kind == "v"]
+        ys = sorted({round(s[0], 1) for s in h_lines})
+        xs = sorted({round(s[0], 1) for s in v_lines})
+        if len(ys) < 2 or len(xs) < 3:
+            continue
+
+        def _ruled(lines, pos: float, mid: float) -> bool:
+            return any(abs(l[0] - pos) <= 0.1 and l[1] - _SNAP <= mid <= l[2] + _SNAP for l in lines)
+
+        nrows, ncols = len(ys) - 1, len(xs) - 1
+        owner: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for r in range(nrows):
+            ymid = (ys[r] + ys[r + 1]) / 2
+            for c in range(ncols):
+                xmid = (xs[c] + xs[c + 1]) / 2
+                if r and not _ruled(h_lines, ys[r], xmid):
+                    owner[r, c] = owner[r - 1, c]
+                elif c and not _ruled(v_lines, xs[c], ymid):
+                    owner[r, c] = owner[r, c - 1]
+                else:
+                    owner[r, c] = (r, c)
+
+        bbox = (xs[0], ys[0], xs[-1], ys[-1])
+        parts: Dict[Tuple[int, int], List[Tuple[float, float, int, str]]] = {}
+        for span, line in spans:
+            cx = (span["bbox"][0] + span["bbox"][2]) / 2
+            cy = (span["bbox"][1] + span["bbox"][3]) / 2
+            if not (bbox[0] < cx < bbox[2] and bbox[1] < cy < bbox[3]):
+                continue
+            cell = owner[bisect.bisect_right(ys, cy) - 1, bisect.bisect_right(xs, cx) - 1]
+            parts.setdefault(cell, []).append((round(line["bbox"][3]), span["bbox"][0], id(line), span["text"]))
+
+        def _cell_text(cell: Tuple[int, int]) -> str:
+            text, prev = "", None
+            for y, _, line_id, part in sorted(parts.get(cell, ())):
+                if prev is not None and line_id != prev[1]:
+                    text += "\n" if y != prev[0] else " "
+                text += part
+                prev = (y, line_id)
+            return "\n".join(l.strip() for l in text.strip().split("\n"))
+
+        rows = []
+        for r in range(nrows):
+            row = []
+            for c in range(ncols):
+                cell = owner[r, c]
+                if c and owner[r, c - 1] == cell:
+                    continue
+                span = 1
+                while c + span < ncols and owner[r, c + span] == cell:
+                    span += 1
+                tall = cell[0] < r or (r + 1 < nrows and owner[r + 1, c] == cell)
+                row.append({"col": c, "span": span,
+                            "text": _cell_text(cell) if cell == (r, c) else "",
+                            "merge": ("restart" if cell[0] == r else "continue") if tall else None})
+            rows.append(row)
+        widths = [xs[i + 1] - xs[i] for i in range(ncols)]
+        scale = min(1.0, content_width / max(1.0, sum(widths)))
+        tables.append((bbox, {"kind": "table", "rows": rows, "widths": [w * scale for w in widths]}))
+    return tables
+
+
+def _reading_order(items: List[Tuple[Tuple[float, float, float, float], Dict[str, Any]]],
+                   content: Tuple[float, float]) -> List[Dict[str, Any]]:
+    """
+    Order items top to bottom; between items that span the page, a two-column
+    stretch is read left column first, then right.
+    """
+    left, right = content
+    middle, tol = (left + right) / 2, 0.02 * (right - left)
+    ordered: List[Dict[str, Any]] = []
+    segment: List[Tuple[Tuple[float, float, float, float], Dict[str, Any]]] = []
+
+    def _flush():
+        lefts = [it for it in segment if it[0][2] <= middle + tol]
+        rights = [it for it in segment if it[0][2] > middle + tol]
+        if lefts and rights and min(b[1] for b, _ in rights) < max(b[3] for b, _ in lefts):
+            segment[:] = sorted(lefts, key=lambda it: it[0][1]) + sorted(rights, key=lambda it: it[0][1])
+        ordered.extend(rec for _, rec in segment)
+        segment.clear()
+
+    for bbox, rec in sorted(items, key=lambda it: (round(it[0][1]), it[0][0])):
+        if bbox[0] < middle - tol and bbox[2] > middle + tol:
+            _flush()
+            ordered.append(rec)
+        else:
+            segment.append((bbox, rec))
+    _flush()
+    return ordered
+
+
+def _page_records(page) -> Dict[str, Any]:
+    data = page.get_text("dict", flags=_TEXT_FLAGS, sort=False)
+    text_blocks = [b for b in data["blocks"] if b["type"] == 0]
+    if text_blocks:
+        content = (min(b["bbox"][0] for b in text_blocks), max(b["bbox"][2] for b in text_blocks))
+    else:
+        content = (0.0, page.rect.width)
+    tables = _ruled_tables(page.get_cdrawings(), data["blocks"], content[1] - content[0])
+    table_boxes = [fitz.Rect(bbox) for bbox, _ in tables]
+
+    items, paragraphs = list(tables), []
+    for block in data["blocks"]:
+        bbox = block["bbox"]
+        if block["type"] == 1:
+            w, h = bbox[2] - bbox[0], bbox[3] - bbox[1]
+            if w >= _MIN_IMAGE_PT and h >= _MIN_IMAGE_PT and block.get("image"):
+                items.append((bbox, {"kind": "image", "data": block["image"], "ext": block["ext"],
+                                     "w": w, "h": h}))
+            continue
+        if table_boxes:
+            # text inside a table is already in the table's cells
+            lines = [l for l in block["lines"]
+                     if not any(fitz.Point((l["bbox"][0] + l["bbox"][2]) / 2,
+                                           (l["bbox"][1] + l["bbox"][3]) / 2) in r for r in table_boxes)]
+            if not lines:
+                continue
+            block = dict(block, lines=lines)
+        paragraphs.extend(_block_paragraphs(block))
+    for para in _join_continuations(paragraphs):
+        bbox = tuple(para["bbox"])
+        if _finish_paragraph(para, content):
+            items.append((bbox, para))
+    return {"items": _reading_order(items, content)}
+
+
+def _extract_pages(src: Source, start: int, stop: int) -> List[Dict[str, Any]]:
+    with open_pdf(src) as doc:
+        return [_page_records(doc[pno]) for pno in range(start, stop)]
+
+
+# =========================
+# Parent side: records -> DOCX XML
+# =========================
+def _el(parent, tag: str, **attrs):
+    el = parent.makeelement(qn(tag), {qn("w:" + k): str(v) for k, v in attrs.items()})
+    parent.append(el)
+    return el
+
+
+class _Writer:
+    """Appends records to a python-docx body in O(1) per element."""
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.body = doc.element.body
+        self.sect = self.body.sectPr
+        self.paragraphs: List[Tuple[Any, Dict[str, Any]]] = []  # (w:p, record) for the heading pass
+        self.sizes: Counter = Counter()
+        self._shape_ids = itertools.count(1)
+        self._images: Dict[int, Tuple[str, Any]] = {}
+        self.content_width = doc.sections[0].page_width - doc.sections[0].left_margin \
+            - doc.sections[0].right_margin
+
+    def _add(self, tag: str):
+        el = self.body.makeelement(qn(tag), {})
+        if self.sect is not None:
+            self.sect.addprevious(el)
+        else:
+            self.body.append(el)
+        return el
+
+    def paragraph(self, rec: Dict[str, Any]) -> None:
+        p = self._add("w:p")
+        if rec.get("style") or rec["align"] or rec["indent"] > 1:
+            ppr = _el(p, "w:pPr")
+            if rec.get("style"):
+                _el(ppr, "w:pStyle", val=rec["style"])
+            if rec["indent"] > 1:
+                _el(ppr, "w:ind", left=int(rec["indent"] * 20))
+            if rec["align"]:
+                _el(ppr, "w:jc", val=rec["align"])
+        for text, (size, bold, italic, mono, sup, color) in rec["runs"]:
+            r = _el(p, "w:r")
+            rpr = _el(r, "w:rPr")
+            if mono:
+                _el(rpr, "w:rFonts", ascii="Courier New", hAnsi="Courier New", cs="Courier New")
+            if bold:
+                _el(rpr, "w:b")
+            if italic:
+                _el(rpr, "w:i")
+            if color:
+                _el(rpr, "w:color", val=f"{color:06X}")
+            _el(rpr, "w:sz", val=int(size * 2))
+            if sup:
+                _el(rpr, "w:vertAlign", val="superscript")
+            for i, part in enumerate(text.split("\t")):
+                if i:
+                    _el(r, "w:tab")
+                if part:
+                    t = _el(r, "w:t")
+                    t.text = part
+                    if part[0] == " " or part[-1] == " ":
+                        t.set("{http://www.w3.org/XML/1998/namespace}space", "preserve")
+        self.paragraphs.append((p, rec))
+        self.sizes[rec["size"]] += rec["chars"]
+
+    def table(self, rec: Dict[str, Any]) -> None:
+        tbl = self._add("w:tbl")
+        tblpr = _el(tbl, "w:tblPr")
+        _el(tblpr, "w:tblStyle", val="TableGrid")
+        _el(tblpr, "w:tblW", w=0, type="auto")
+        grid = _el(tbl, "w:tblGrid")
+        for w in rec["widths"]:
+            _el(grid, "w:gridCol", w=int(w * 20))
+        for row in rec["rows"]:
+            tr = _el(tbl, "w:tr")
+            for cell in row:
+                tc = _el(tr, "w:tc")
+                tcpr = _el(tc, "w:tcPr")
+                width = sum(rec["widths"][cell["col"]:cell["col"] + cell["span"]])
+                _el(tcpr, "w:tcW", w=int(width * 20), type="dxa")
+                if cell["span"] > 1:
+                    _el(tcpr, "w:gridSpan", val=cell["span"])
+                if cell["merge"]:
+                    _el(tcpr, "w:vMerge", val=cell["merge"])
+                for line in (cell["text"] or "").split("\n") if cell["merge"] != "continue" else [""]:
+                    p = _el(tc, "w:p")
+                    if line:
+                        _el(_el(p, "w:r"), "w:t").text = line
+
+    def image(self, rec: Dict[str, Any]) -> None:
+        data, ext = rec["data"], rec["ext"].lower()
+        key = hash(data)
+        if key not in self._images:
+            if ext not in _DOCX_IMAGE_EXTS:
+                try:
+                    data = fitz.Pixmap(data).tobytes("png")
+                except Exception:  # e.g. JBIG2 or a broken stream
+                    return
+            try:
+                self._images[key] = self.doc.part.get_or_add_image(io.BytesIO(data))
+            except Exception:
+                return
+        rid, image = self._images[key]
+        width = Pt(rec["w"])
+        height = Pt(rec["h"])
+        if width > self.content_width:
+            height = int(height * self.content_width / width)
+            width = self.content_width
+        shape_id = next(self._shape_ids)
+        inline = CT_Inline.new_pic_inline(shape_id, rid, image.filename or f"image{shape_id}.png",
+                                          int(width), int(height))
+        p = self._add("w:p")
+        _el(_el(p, "w:r"), "w:drawing").append(inline)
+
+    def page_break(self) -> None:
+        _el(_el(self._add("w:p"), "w:r"), "w:br", type="page")
+
+    def finish(self) -> None:
+        """Body size on the Normal style; larger short paragraphs become headings."""
+        if not self.sizes:
+            return
+        body = self.sizes.most_common(1)[0][0]
+        self.doc.styles["Normal"].font.size = Pt(body)
+        heading_sizes = sorted({rec["size"] for _, rec in self.paragraphs
+                                if rec["size"] >= body * _HEADING_RATIO
+                                and rec["chars"] <= _HEADING_MAX_CHARS}, reverse=True)
+        levels = {size: min(i + 1, 3) for i, size in enumerate(heading_sizes)}
+        bold_level = min(len(heading_sizes) + 1, 4)
+        body_sz = str(int(body * 2))
+        for p, rec in self.paragraphs:
+            level = self._heading_level(rec, levels, bold_level, body)
+            if level:
+                ppr = p.find(qn("w:pPr"))
+                if ppr is None:
+                    ppr = p.makeelement(qn("w:pPr"), {})
+                    p.insert(0, ppr)
+                ppr.insert(0, ppr.makeelement(qn("w:pStyle"), {qn("w:val"): f"Heading{level}"}))
+            # run formatting the paragraph style already gives is dropped
+            for rpr in p.iter(qn("w:rPr")):
+                for el in list(rpr):
+                    if (el.tag == qn("w:sz") and (level or el.get(qn("w:val")) == body_sz)) \
+                            or (level and el.tag == qn("w:b")):
+                        rpr.remove(el)
+
+    @staticmethod
+    def _heading_level(rec: Dict[str, Any], levels: Dict[float, int], bold_level: int,
+                       body: float) -> Optional[int]:
+        if rec.get("style") or rec["chars"] > _HEADING_MAX_CHARS:
+            return None
+        if rec["size"] in levels:
+            return levels[rec["size"]]
+        # a short, fully bold line at body size that doesn't end like a sentence
+        if (rec["bold"] and rec["rows"] == 1 and rec["size"] >= body and 3 <= rec["chars"] <= 80
+                and not rec["runs"][-1][0].endswith((".", ":", ","))):
+            return bold_level
+        return None
+
+
+def _iter_page_records(src: Source, total: int, workers: int):
+    """Page records in page order; chunks run on the pool, at most ~2x workers in flight."""
+    size = max(1, PDF_DOCX_CHUNK_PAGES)
+    chunks = [(start, min(total, start + size)) for start in range(0, total, size)]
+    if workers <= 1 or len(chunks) <= 1:
+        for start, stop in chunks:
+            yield from _extract_pages(src, start, stop)
+        return
+    pool = get_pool()
+    window = max(2, 2 * workers)
+    in_flight = deque()
+    for start, stop in chunks:
+        in_flight.append(pool.submit(_extract_pages, src, start, stop))
+        if len(in_flight) >= window:
+            yield from in_flight.popleft().result()
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+
+def pdf_to_docx_stream(pdf_src: Source, workers: Optional[int] = None,
+                       progress: Optional[Callable[[int, int], None]] = None) -> BinaryIO:
+    """
+    Convert a PDF (path or bytes) to DOCX. One DOCX page break per PDF page;
+    `progress(done, total)` is called as pages are added.
+    """
+    workers = worker_count(PDF_DOCX_WORKERS if workers is None else workers)
+    with open_pdf(pdf_src) as pdf:
+        total = pdf.page_count
+    add_pages(total)
+
+    doc = Document()
+    writer = _Writer(doc)
+    with stage("extract"):
+        for pno, page in enumerate(_iter_page_records(pdf_src, total, workers)):
+            if pno:
+                writer.page_break()
+            for rec in page["items"]:
+                getattr(writer, rec["kind"])(rec)
+            if progress:
+                progress(pno + 1, total)
+        writer.finish()
+
+    out = new_output()
+    with stage("save"):
+        doc.save(out)
+    out.seek(0)
+    return out
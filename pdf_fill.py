@@ -1,43 +1,104 @@
 # pdf_fill.py
 import os
 import io
-import uuid
 import json
-from typing import List, Dict, Any, Tuple
+import shutil
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO, List, Dict, Any, Tuple, Union
 import fitz  # PyMuPDF
 
+from pdf_store import get_store
 
-# Where to store temporary PDFs
-UPLOAD_DIR = os.path.join("instance", "formfill")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# How many parsed PDFs (and their page geometry) to keep open between requests
+DOC_CACHE_SIZE = int(os.getenv("FORMFILL_DOC_CACHE", "16"))
 
-
-def _new_id() -> str:
-    return uuid.uuid4().hex
+logger = logging.getLogger(__name__)
 
 
 def _pdf_path(pdf_id: str) -> str:
-    # very basic guard
-    if not pdf_id or len(pdf_id) > 64 or not pdf_id.isalnum():
-        raise ValueError("Invalid pdf_id")
-    return os.path.join(UPLOAD_DIR, f"{pdf_id}.pdf")
+    # ValueError for a malformed id, FileNotFoundError for an unknown/expired one
+    return get_store().path(pdf_id)
+
+
+def pdf_path(pdf_id: str) -> str:
+    """Absolute path of a stored PDF (for send_file); raises FileNotFoundError if missing."""
+    return _pdf_path(pdf_id)
+
+
+# =========================
+# Open-document cache
+# =========================
+def _file_signature(path: str) -> Tuple[int, int, int]:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class _CachedPdf:
+    def __init__(self, doc, signature):
+        self.doc = doc
+        self.signature = signature
+        self.pages = [(float(p.rect.width), float(p.rect.height)) for p in doc]
+        self.lock = threading.Lock()  # fitz documents are not thread-safe
+
+
+class _DocCache:
+    """
+    LRU of open fitz documents keyed by pdf_id (or any key plus an explicit
+    path). An entry is dropped as soon as the file's (mtime, size, inode) no
+    longer matches, so edits on disk are picked up on the next access.
+    Whoever writes through a cached handle must hold its lock and refresh
+    its signature afterwards.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, _CachedPdf]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, path: str = None) -> _CachedPdf:
+        path = path or _pdf_path(key)
+        signature = _file_signature(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.signature == signature:
+                self._entries.move_to_end(key)
+                return entry
+        entry = _CachedPdf(fitz.open(path), signature)
+        with self._lock:
+            stale = self._entries.pop(key, None)
+            self._entries[key] = entry
+            evicted = [stale] if stale else []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for old in evicted:
+            with old.lock:
+                old.doc.close()
+        return entry
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            with entry.lock:
+                entry.doc.close()
+
+
+_doc_cache = _DocCache(DOC_CACHE_SIZE)
 
 
-def save_pdf_temp(pdf_bytes: bytes) -> str:
+def save_pdf_temp(pdf_bytes: Union[bytes, BinaryIO]) -> str:
     """
-    Save bytes to a temp file and return a pdf_id.
+    Store an uploaded PDF (bytes or a binary stream) and return a pdf_id.
+    See pdf_store.py for expiry, quotas and deduplication.
     """
-    pdf_id = _new_id()
-    path = _pdf_path(pdf_id)
-    with open(path, "wb") as f:
-        f.write(pdf_bytes)
-    return pdf_id
+    return get_store().put(pdf_bytes)
 
 
 def load_pdf_bytes(pdf_id: str) -> bytes:
-    path = _pdf_path(pdf_id)
-    with open(path, "rb") as f:
-        return f.read()
+    return get_store().read(pdf_id)
 
 
 def get_pdf_page_info(pdf_id: str) -> Dict[str, Any]:
@@ -53,13 +114,9 @@ def get_pdf_page_info(pdf_id: str) -> Dict[str, Any]:
     }
     Units are PDF points.
     """
-    path = _pdf_path(pdf_id)
-    doc = fitz.open(path)
-    pages = []
-    for i, page in enumerate(doc):
-        rect = page.rect  # fitz.Rect
-        pages.append({"index": i, "width": float(rect.width), "height": float(rect.height)})
-    doc.close()
+    # geometry is measured once when the document enters the cache
+    sizes = _doc_cache.get(pdf_id).pages
+    pages = [{"index": i, "width": w, "height": h} for i, (w, h) in enumerate(sizes)]
     return {"pdf_id": pdf_id, "pages": pages}
 
 
@@ -84,6 +141,244 @@ def _parse_hex_color(hex_str: str) -> Tuple[float, float, float]:
         return (0, 0, 0)
 
 
+def _filled_path(pdf_id: str) -> str:
+    return os.path.join(get_store().workdir(pdf_id), "filled.pdf")
+
+
+def _overlays_path(pdf_id: str) -> str:
+    return os.path.join(get_store().workdir(pdf_id), "overlays.json")
+
+
+def _load_applied_overlays(pdf_id: str) -> List[Dict[str, Any]]:
+    try:
+        with open(_overlays_path(pdf_id), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, list) else []
+    except (OSError, ValueError):
+        return []
+
+
+def _store_applied_overlays(pdf_id: str, overlays: List[Dict[str, Any]], pretty: bool = False) -> None:
+    path = _overlays_path(pdf_id)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(overlays, f, ensure_ascii=False, indent=2 if pretty else None)
+    os.replace(tmp, path)
+
+
+# One apply at a time per document (they extend the same filled copy)
+_apply_locks: Dict[str, threading.Lock] = {}
+_apply_locks_guard = threading.Lock()
+
+
+def _apply_lock(pdf_id: str) -> threading.Lock:
+    with _apply_locks_guard:
+        return _apply_locks.setdefault(pdf_id, threading.Lock())
+
+
+@lru_cache(maxsize=16)
+def _font(fontname: str):
+    """fitz.Font for a built-in font name (Helvetica if unknown); metrics only."""
+    try:
+        return fitz.Font(fontname)
+    except Exception:
+        return fitz.Font("helv")
+
+
+@lru_cache(maxsize=65536)
+def _unit_text_length(fontname: str, text: str) -> float:
+    """Width of `text` at font size 1; scale by the font size."""
+    try:
+        return _font(fontname).text_length(text, fontsize=1)
+    except Exception:
+        return len(text) * 0.5  # rough fallback
+
+
+def overlay_page(item: Dict[str, Any], page_count: int) -> int:
+    """
+    The 0-based page an overlay goes on ("page", negative counts from the
+    end); IndexError if the document has no such page.
+    """
+    page = item.get("page", 0)
+    try:
+        page_index = int(page)
+    except (TypeError, ValueError):
+        raise ValueError(f"page {page!r} is not a number")
+    if page_index < 0:
+        page_index += page_count
+    if not 0 <= page_index < page_count:
+        raise IndexError(f"page {page} not in document ({page_count} pages)")
+    return page_index
+
+
+def draw_overlays(doc, overlays: List[Dict[str, Any]], default_font: str = "helv",
+                  default_size: float = 12.0, default_color: str = "#000000") -> List[str]:
+    """
+    Draw overlays grouped by page: all of a page's text goes into one Shape,
+    committed once, so each page gets a single new content stream and one
+    font resource no matter how many fields it has. Widths for center/right
+    alignment come from cached font metrics instead of a per-field PDF call.
+
+    Overlays that can't be drawn (a page outside the document, a value that
+    isn't a number) are skipped. Returns one message per skipped overlay,
+    e.g. "overlay 3: page 7 not in document (2 pages)", for the caller to report.
+    """
+    errors: List[str] = []
+    by_page: Dict[int, List[Tuple[int, float, float, str, float, Tuple[float, float, float]]]] = {}
+    page_sizes: Dict[int, Tuple[float, float]] = {}
+    page_count = doc.page_count
+    for n, item in enumerate(overlays, start=1):
+        try:
+            if not isinstance(item, dict):
+                raise ValueError("not an object")
+            page_index = overlay_page(item, page_count)
+            if page_index not in page_sizes:
+                rect = doc[page_index].rect
+                page_sizes[page_index] = (float(rect.width), float(rect.height))
+            page_w, page_h = page_sizes[page_index]
+
+            # normalized coords -> absolute points
+            nx = float(item.get("x", 0))
+            ny = float(item.get("y", 0))
+            x = max(0.0, min(1.0, nx)) * page_w
+            y = max(0.0, min(1.0, ny)) * page_h
+
+            text = str(item.get("text", ""))
+            if not text:
+                continue
+
+            font_size = float(item.get("font_size", default_size))
+            color = _parse_hex_color(item.get("color", default_color))
+            align = (item.get("align") or "left").lower()
+
+            if align in ("center", "right"):
+                text_len = _unit_text_length(default_font, text) * font_size
+                draw_x = x - (text_len / 2.0 if align == "center" else text_len)
+            else:
+                draw_x = x
+
+            # Draw text (top-left baseline correction: PyMuPDF draws from baseline;
+            # we nudge down a bit, so it looks like top-left anchor)
+            draw_y = y + font_size * 0.75
+            by_page.setdefault(page_index, []).append((n, draw_x, draw_y, text, font_size, color))
+        except (AttributeError, TypeError, ValueError, IndexError) as e:
+            # Continue with the others even if one fails
+            errors.append(f"overlay {n}: {e}")
+
+    for page_index, items in by_page.items():
+        page = doc[page_index]
+        shape = page.new_shape()
+        for n, draw_x, draw_y, text, font_size, color in items:
+            try:
+                shape.insert_text((draw_x, draw_y), text, fontsize=font_size,
+                                  fontname=default_font, color=color, render_mode=0)
+            except (RuntimeError, ValueError) as e:
+                errors.append(f"overlay {n}: {e}")
+        shape.commit()
+    return errors
+
+
+def _log_overlay_errors(pdf_id: str, errors: List[str]) -> None:
+    for error in errors:
+        logger.warning("Formfill %s: %s", pdf_id, error)
+
+
+def _rebuild_filled(pdf_id: str, overlays: List[Dict[str, Any]], draw_args: tuple) -> None:
+    """Start the filled copy over from the original and draw all `overlays` (skipped ones are logged)."""
+    filled = _filled_path(pdf_id)
+    tmp = filled + ".tmp"
+    _doc_cache.invalidate(filled)
+    shutil.copyfile(_pdf_path(pdf_id), tmp)
+    doc = fitz.open(tmp)
+    try:
+        _log_overlay_errors(pdf_id, draw_overlays(doc, overlays, *draw_args))
+        if doc.can_save_incrementally():
+            # only the new page content is appended to the copied original
+            doc.saveIncr()
+        else:  # e.g. the original needed repair on open
+            doc.save(tmp + ".full", garbage=1)
+            os.replace(tmp + ".full", tmp)
+    finally:
+        doc.close()
+    os.replace(tmp, filled)
+
+
+class _FileSnapshot(io.RawIOBase):
+    """Read-only view of the first `size` bytes of a file, unaffected by later appends."""
+
+    def __init__(self, path: str):
+        self._f = open(path, "rb")
+        self._size = os.fstat(self._f.fileno()).st_size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self._size - self._f.tell())
+        if n <= 0:
+            return 0
+        return self._f.readinto(memoryview(b)[:n])
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            return self._f.seek(self._size + offset)
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def apply_text_overlays_stream(
+    pdf_id: str,
+    overlays: List[Dict[str, Any]],
+    default_font: str = "helv",   # built-in Helvetica
+    default_size: float = 12.0,
+    default_color: str = "#000000",
+    write_debug_json: bool = False
+) -> BinaryIO:
+    """
+    Apply text overlays and return the filled PDF as a read-only stream.
+
+    The overlays already applied are stored in the document's store
+    directory (overlays.json) together with a filled copy (filled.pdf). When `overlays` starts with the stored list (the
+    editor only added fields), just the new ones are drawn and written as an
+    incremental update appended to the filled copy, so the cost follows the
+    number of new overlays rather than the document size. Any other change
+    (edited/removed/reordered fields) rebuilds the copy from the original.
+    The stream is a snapshot: a later apply appending to the copy does not
+    change what it returns.
+    """
+    draw_args = (default_font, default_size, default_color)
+    filled = _filled_path(pdf_id)
+    with _apply_lock(pdf_id):
+        applied = _load_applied_overlays(pdf_id)
+        extends = (os.path.exists(filled) and len(overlays) >= len(applied)
+                   and overlays[:len(applied)] == applied)
+        if not extends:
+            _rebuild_filled(pdf_id, overlays, draw_args)
+        elif len(overlays) > len(applied):
+            entry = _doc_cache.get(filled, filled)
+            with entry.lock:
+                doc = entry.doc
+                errors = draw_overlays(doc, overlays[len(applied):], *draw_args)
+                if doc.can_save_incrementally():
+                    doc.saveIncr()
+                    entry.signature = _file_signature(filled)
+                    _log_overlay_errors(pdf_id, errors)
+                else:
+                    _doc_cache.invalidate(filled)
+                    _rebuild_filled(pdf_id, overlays, draw_args)
+        _store_applied_overlays(pdf_id, overlays, pretty=write_debug_json)
+        return io.BufferedReader(_FileSnapshot(filled))
+
+
 def apply_text_overlays(
     pdf_id: str,
     overlays: List[Dict[str, Any]],
@@ -111,73 +406,8 @@ def apply_text_overlays(
     Notes:
     - Coordinates are **normalized** so UI can work at any zoom.
     - We align by computing text length for center/right.
+    - See apply_text_overlays_stream() for how repeated calls are made incremental.
     """
-    path = _pdf_path(pdf_id)
-    doc = fitz.open(path)
-
-    if write_debug_json:
-        # optional: save last overlays to a sidecar file for debugging
-        with open(os.path.join(UPLOAD_DIR, f"{pdf_id}.overlays.json"), "w", encoding="utf-8") as f:
-            json.dump(overlays, f, ensure_ascii=False, indent=2)
-
-    for item in overlays:
-        try:
-            page_index = int(item.get("page", 0))
-            page = doc[page_index]
-
-            rect = page.rect
-            page_w, page_h = float(rect.width), float(rect.height)
-
-            # normalized coords -> absolute points
-            nx = float(item.get("x", 0))
-            ny = float(item.get("y", 0))
-            x = max(0.0, min(1.0, nx)) * page_w
-            y = max(0.0, min(1.0, ny)) * page_h
-
-            text = str(item.get("text", ""))
-            if not text:
-                continue
-
-            font_size = float(item.get("font_size", default_size))
-            color = _parse_hex_color(item.get("color", default_color))
-            align = (item.get("align") or "left").lower()
-
-            # Text measurement for alignment
-            try:
-                text_len = page.get_text_length(text, fontname=default_font, fontsize=font_size)
-            except Exception:
-                # older/newer API fallback
-                try:
-                    text_len = fitz.get_text_length(text, fontname=default_font, fontsize=font_size)
-                except Exception:
-                    text_len = len(text) * (font_size * 0.5)  # rough fallback
-
-            if align == "center":
-                draw_x = x - (text_len / 2.0)
-            elif align == "right":
-                draw_x = x - text_len
-            else:
-                draw_x = x
-
-            # Draw text (top-left baseline correction: PyMuPDF draws from baseline;
-            # we nudge down a bit, so it looks like top-left anchor)
-            baseline_adjust = font_size * 0.75
-            draw_y = y + baseline_adjust
-
-            page.insert_text(
-                (draw_x, draw_y),
-                text,
-                fontsize=font_size,
-                fontname=default_font,
-                fill=color,
-                render_mode=0  # fill text
-            )
-        except Exception as e:
-            # Continue with others even if one fails
-            print("Overlay error:", e)
-
-    out = io.BytesIO()
-    doc.save(out)
-    doc.close()
-    out.seek(0)
-    return out.read()
+    with apply_text_overlays_stream(pdf_id, overlays, default_font, default_size,
+                                    default_color, write_debug_json) as f:
+        return f.read()
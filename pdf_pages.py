@@ -0,0 +1,414 @@
+# pdf_pages.py
+"""
+Page-level PDF operations on PyMuPDF.
+
+- Page specs ("1,3,5-7", "last") are parsed once into 0-based page lists.
+- remove/extract/reorder/rotate change one document in place: select()
+  keeps the wanted pages without copying them; split writes each group of
+  pages to its own PDF, streamed out as a ZIP.
+- Merging (merge_pdfs, or append_pdfs onto an open document) copies the
+  selected pages of each part with insert_pdf, reading the spooled inputs
+  directly. Each part gets a bookmark (part_title) with its own outline
+  nested beneath it.
+- dedupe_objects stores fonts and images that the merged inputs share once.
+"""
+import os
+import re
+import json
+import hashlib
+from typing import Any, BinaryIO, Dict, Iterator, List, Sequence, Tuple
+
+import fitz  # PyMuPDF
+
+from metrics import stage, add_pages
+from spool import Source, open_pdf, save_pdf
+from zipstream import STORED_SUFFIXES, iter_zip
+
+
+class PageSpecError(ValueError):
+    """A page spec or merge spec that can't be applied; reported as a 400."""
+
+
+# =========================
+# Page specs
+# =========================
+def _page_number(token: str, page_count: int, spec: str) -> int:
+    token = token.strip().lower()
+    if token in ("end", "last"):
+        return page_count
+    try:
+        n = int(token)
+    except ValueError:
+        raise PageSpecError(f"'{token}' in page spec '{spec}' is not a page number")
+    if not 1 <= n <= page_count:
+        raise PageSpecError(f"page {n} in '{spec}' is out of range (document has {page_count} pages)")
+    return n
+
+
+def parse_page_spec(spec: str, page_count: int, empty_means_all: bool = True) -> List[int]:
+    """
+    Zero-based page indexes for a spec like "1,3,5-7", in the order written
+    (duplicates kept). Pages are 1-based; "end"/"last" is the last page,
+    "5-" runs to the end, "-3" starts at 1, and "7-5" runs backwards.
+    Raises PageSpecError for anything it can't read.
+    """
+    spec = (spec or "").strip()
+    if not spec:
+        if empty_means_all:
+            return list(range(page_count))
+        raise PageSpecError("no pages given")
+    pages: List[int] = []
+    for part in spec.replace(";", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            a, b = part.split("-", 1)
+            first = _page_number(a, page_count, spec) if a.strip() else 1
+            last = _page_number(b, page_count, spec) if b.strip() else page_count
+            step = 1 if last >= first else -1
+            pages.extend(range(first - 1, last - 1 + step, step))
+        else:
+            pages.append(_page_number(part, page_count, spec) - 1)
+    if not pages:
+        raise PageSpecError(f"no pages in '{spec}'")
+    return pages
+
+
+def page_runs(pages: Sequence[int]) -> List[Tuple[int, int]]:
+    """Consecutive (ascending or descending) stretches of `pages` as (first, last) pairs."""
+    runs: List[Tuple[int, int]] = []
+    for p in pages:
+        if runs:
+            first, last = runs[-1]
+            step = last - first
+            if (p == last + 1 and step >= 0) or (p == last - 1 and step <= 0):
+                runs[-1] = (first, p)
+                continue
+        runs.append((p, p))
+    return runs
+
+
+# =========================
+# Page operations
+# =========================
+PAGE_OPS = ("remove", "extract", "reorder", "rotate", "split")
+
+
+def apply_page_op(doc: fitz.Document, op: str, spec: str = "", angle: int = 90) -> None:
+    """
+    Apply one page operation to `doc` in place:
+    - remove: drop the pages in `spec`
+    - extract: keep only the pages in `spec`, in document order
+    - reorder: keep the pages in the order `spec` lists them (repeats allowed)
+    - rotate: turn the pages in `spec` (blank = all) by `angle` degrees clockwise
+    Raises PageSpecError for a bad spec or angle.
+    """
+    n = doc.page_count
+    if op == "remove":
+        drop = set(parse_page_spec(spec, n, empty_means_all=False))
+        if len(drop) == n:
+            raise PageSpecError("that would remove every page")
+        doc.select([i for i in range(n) if i not in drop])
+    elif op == "extract":
+        doc.select(sorted(set(parse_page_spec(spec, n, empty_means_all=False))))
+    elif op == "reorder":
+        doc.select(parse_page_spec(spec, n, empty_means_all=False))
+    elif op == "rotate":
+        if angle % 90:
+            raise PageSpecError(f"rotation must be a multiple of 90 degrees, not {angle}")
+        for i in sorted(set(parse_page_spec(spec, n))):
+            page = doc[i]
+            page.set_rotation((page.rotation + angle) % 360)
+    else:
+        raise PageSpecError(f"unknown page operation '{op}'")
+
+
+def split_groups(spec: str, page_count: int, every: int = 0) -> List[List[int]]:
+    """
+    Page groups for a split, one per output file: `every` pages at a time,
+    or one group per comma-separated item of `spec` ("1-3,4-end").
+    Blank spec and no `every` means one file per page.
+    """
+    if every > 0:
+        return [list(range(i, min(i + every, page_count))) for i in range(0, page_count, every)]
+    if not (spec or "").strip():
+        return [[i] for i in range(page_count)]
+    groups = [parse_page_spec(item, page_count, empty_means_all=False)
+              for item in spec.replace(";", ",").split(",") if item.strip()]
+    if not groups:
+        raise PageSpecError(f"no pages in '{spec}'")
+    return groups
+
+
+def iter_split_pdfs(doc: fitz.Document, groups: List[List[int]], stem: str = "part") -> Iterator[Tuple[str, bytes]]:
+    """Yield ("<stem>_N.pdf", pdf_bytes) per group, building one output at a time."""
+    width = len(str(len(groups)))
+    for n, pages in enumerate(groups, 1):
+        part = fitz.open()
+        for first, last in page_runs(pages):
+            part.insert_pdf(doc, from_page=first, to_page=last)
+        data = part.tobytes(garbage=1, deflate=True)
+        part.close()
+        add_pages(len(pages))
+        yield f"{stem}_{n:0{width}d}.pdf", data
+
+
+def page_op_stream(src: Source, op: str, spec: str = "", angle: int = 90) -> BinaryIO:
+    """Apply a single-output page operation to a PDF and save it once."""
+    doc = open_pdf(src)
+    try:
+        with stage("pages"):
+            apply_page_op(doc, op, spec, angle)
+        add_pages(doc.page_count)
+        # garbage=1 drops objects only the removed pages used
+        return save_pdf(doc, garbage=1, deflate=True)
+    finally:
+        doc.close()
+
+
+def split_pdf_zip_chunks(src: Source, spec: str = "", every: int = 0, stem: str = "part") -> Iterator[bytes]:
+    """
+    Split a PDF into several and return an iterator of ZIP chunks. The
+    document is opened and the spec checked up front, so errors surface
+    before streaming starts.
+    """
+    doc = open_pdf(src)
+    try:
+        groups = split_groups(spec, doc.page_count, every)
+    except Exception:
+        doc.close()
+        raise
+
+    def _chunks():
+        try:
+            # the parts are compressed already; store them
+            yield from iter_zip(iter_split_pdfs(doc, groups, stem), STORED_SUFFIXES + (".pdf",))
+        finally:
+            doc.close()
+
+    return _chunks()
+
+
+# =========================
+# Merging
+# =========================
+class MergePart:
+    """One input of a merge: a source, the pages to take and its bookmark title."""
+
+    def __init__(self, src: Source, pages: str = "", title: str = ""):
+        self.src = src
+        self.pages = pages
+        self.title = title
+
+
+def part_title(name: str) -> str:
+    """Default bookmark title for an uploaded file: its name without the extension."""
+    return os.path.splitext(os.path.basename(name or ""))[0] or "Document"
+
+
+def parse_merge_spec(raw: str, uploads: List[Tuple[str, Source]]) -> List[MergePart]:
+    """
+    Merge parts for the uploaded files. `raw` is either
+    - empty: every file, all pages, in upload order;
+    - one page spec per file, one per line, in upload order (blank = all);
+    - JSON: [{"file": index or filename, "pages": "1-3", "bookmark": "Intro"}, ...],
+      which may reorder or repeat files.
+    """
+    raw = (raw or "").strip()
+    if not raw.startswith("["):
+        lines = raw.splitlines() if raw else []
+        if len(lines) > len(uploads):
+            raise PageSpecError(f"{len(lines)} page ranges given for {len(uploads)} files")
+        lines += [""] * (len(uploads) - len(lines))
+        return [MergePart(src, line.strip(), part_title(name)) for (name, src), line in zip(uploads, lines)]
+
+    try:
+        entries = json.loads(raw)
+    except ValueError:
+        raise PageSpecError("merge spec is not valid JSON")
+    by_name = {name: i for i, (name, _) in enumerate(uploads)}
+    parts = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise PageSpecError("each merge spec entry must be an object")
+        ref = entry.get("file", 0)
+        index = by_name.get(ref) if isinstance(ref, str) else ref
+        if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(uploads):
+            raise PageSpecError(f"merge spec refers to unknown file {ref!r}")
+        name, src = uploads[index]
+        parts.append(MergePart(src, str(entry.get("pages") or ""), str(entry.get("bookmark") or part_title(name))))
+    if not parts:
+        raise PageSpecError("merge spec is empty")
+    return parts
+
+
+def _nested_toc(toc: List[list], page_map: Dict[int, int], base_level: int) -> List[list]:
+    """A source outline moved under `base_level`, kept only for pages that were copied."""
+    out = []
+    level_cap = base_level
+    for level, title, page in toc:
+        target = page_map.get(page - 1)
+        if target is None:
+            continue
+        level = min(base_level + level, level_cap + 1)  # levels may only deepen one step at a time
+        out.append([level, title, target + 1])
+        level_cap = level
+    return out
+
+
+_REF = re.compile(r"(\d+) (\d+) R")
+_TYPE = re.compile(r"^<<.*?/Type\s*/(\w+)", re.S)
+# Dictionary types that mean the same thing wherever they are used
+_SHAREABLE_TYPES = {"Font", "FontDescriptor", "ExtGState", "Encoding", "XObject"}
+
+
+def dedupe_objects(doc: fitz.Document) -> int:
+    """
+    Point every reference to an identical font, image, ICC profile or other
+    shareable object at one copy; returns how many copies became unused
+    (a save with garbage>=1 drops them). Same result as MuPDF's garbage=4
+    for merged inputs, but hashes each object once instead of comparing
+    all pairs, which grows quadratically with the number of inputs.
+
+    Streams and reference-free values are compared by content; dictionaries
+    and arrays that point to them become identical once their references
+    are rewritten, so this repeats until nothing changes (a Type0 font is
+    four levels deep). Pages, annotations and outline items are never
+    shared, since they are tied to one place in the document.
+    """
+    n = doc.xref_length()
+    texts: Dict[int, str] = {}
+    streams = set()
+    for x in range(1, n):
+        try:
+            text = doc.xref_object(x, compressed=True)
+        except RuntimeError:  # freed by an edit (removed pages, replaced images)
+            continue
+        if text == "null":
+            continue
+        texts[x] = text
+        if doc.xref_is_stream(x):
+            streams.add(x)
+    digests: Dict[int, bytes] = {}
+
+    def _shareable(x: int) -> bool:
+        text = texts.get(x)
+        if text is None:
+            return False
+        match = _TYPE.match(text)
+        if x in streams:
+            return not match or match.group(1) not in ("XRef", "ObjStm", "Metadata")
+        if match:
+            return match.group(1) in _SHAREABLE_TYPES
+        # arrays (and untyped values) only when everything they point to is shareable
+        return text.startswith("[") and all(_shareable(int(r[0])) for r in _REF.findall(text))
+
+    candidates = [x for x in texts if _shareable(x)]
+    remap: Dict[int, int] = {}
+    while True:
+        seen: Dict[Tuple[str, bytes], int] = {}
+        found: Dict[int, int] = {}
+        for x in candidates:
+            if x in remap:
+                continue
+            if x in streams and x not in digests:
+                digests[x] = hashlib.sha1(doc.xref_stream_raw(x)).digest()
+            canonical = seen.setdefault((texts[x], digests.get(x, b"")), x)
+            if canonical != x:
+                found[x] = canonical
+        if not found:
+            return len(remap)
+        remap.update(found)
+
+        def _sub(m):
+            return f"{found.get(int(m.group(1)), m.group(1))} {m.group(2)} R"
+
+        for x, text in texts.items():
+            if x in remap or " R" not in text:
+                continue
+            new_text = _REF.sub(_sub, text)
+            if new_text == text:
+                continue
+            texts[x] = new_text
+            if x not in streams:
+                doc.update_object(x, new_text)
+                continue
+            # update_object would drop the stream data; rewrite the changed keys only
+            for key in doc.xref_get_keys(x):
+                value = doc.xref_get_key(x, key)[1]
+                new_value = _REF.sub(_sub, value)
+                if new_value != value:
+                    doc.xref_set_key(x, key, new_value)
+
+
+def _src_key(src: Source):
+    return src if isinstance(src, str) else id(src)
+
+
+def merge_pdfs(parts: List[MergePart], bookmarks: bool = True) -> fitz.Document:
+    """
+    Merge the parts into a new document. With `bookmarks`, every part gets a
+    top-level bookmark with its source's own outline nested beneath.
+    """
+    out = fitz.open()
+    try:
+        append_pdfs(out, parts, bookmarks)
+    except Exception:
+        out.close()
+        raise
+    return out
+
+
+def append_pdfs(out: fitz.Document, parts: List[MergePart], bookmarks: bool = True) -> None:
+    """Append the parts' pages to `out` in place; see merge_pdfs for `bookmarks`."""
+    toc: List[list] = out.get_toc(simple=False) if bookmarks else []
+    added = False
+    docs: Dict[Any, fitz.Document] = {}
+    last_use = {_src_key(p.src): i for i, p in enumerate(parts)}
+    try:
+        for i, part in enumerate(parts):
+            key = _src_key(part.src)
+            src = docs.get(key)
+            if src is None:
+                try:
+                    src = docs[key] = open_pdf(part.src)
+                except Exception as e:
+                    raise PageSpecError(f"could not open '{part.title}': {e}")
+                if src.needs_pass:
+                    raise PageSpecError(f"'{part.title}' is password protected")
+            try:
+                pages = parse_page_spec(part.pages, src.page_count)
+            except PageSpecError as e:
+                raise PageSpecError(f"{part.title}: {e}")
+            start = out.page_count
+            runs = page_runs(pages)
+            for j, (first, last) in enumerate(runs):
+                # the graft map (source object -> copied object) is kept until a
+                # source's last use, so repeated pages share their resources
+                out.insert_pdf(src, from_page=first, to_page=last,
+                               final=int(i == last_use[key] and j == len(runs) - 1))
+            if bookmarks:
+                page_map: Dict[int, int] = {}
+                for offset, p in enumerate(pages):
+                    page_map.setdefault(p, start + offset)
+                toc.append([1, part.title, start + 1])
+                toc.extend(_nested_toc(src.get_toc(simple=True), page_map, 1))
+                added = True
+    finally:
+        for doc in docs.values():
+            doc.close()
+    if added:
+        out.set_toc(toc)
+
+
+def merge_pdfs_stream(parts: List[MergePart], bookmarks: bool = True) -> BinaryIO:
+    """Merge and save, storing objects the inputs share (fonts, images) once."""
+    with stage("merge"):
+        out = merge_pdfs(parts, bookmarks=bookmarks)
+    with stage("dedupe"):
+        dedupe_objects(out)
+    add_pages(out.page_count)
+    stream = save_pdf(out, garbage=2, deflate=True)
+    out.close()
+    return stream
@@ -0,0 +1,253 @@
+# pdf_pipeline.py
+"""
+Chained PDF operations on one PyMuPDF document.
+
+A pipeline such as remove -> merge -> compress -> watermark -> protect opens
+the first upload once, lets every step change that document in place and
+saves it once at the end. Separate /convert calls would re-upload, re-parse
+and re-serialize the PDF at every step. Save options are collected from the
+steps that ran: deduplication after a merge or compress, object streams
+after a compress, AES-256 encryption for protect.
+"""
+import json
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from jobs import report_progress
+from metrics import stage, add_pages
+from pdf_compress import COMPRESSED_SAVE_OPTIONS, compress_pdf_images, rasterize_pdf_pages
+from pdf_pages import PageSpecError, append_pdfs, apply_page_op, dedupe_objects, parse_merge_spec, part_title
+from spool import Source, open_pdf, save_pdf
+from watermark import stamp_text_watermark
+
+# Same PDF presets as /convert's compression_level: (dpi, jpeg quality)
+COMPRESSION_PRESETS = {"low": (150, 75), "medium": (100, 55), "high": (72, 35)}
+DEFAULT_COMPRESSION = (100, 75)
+
+
+class PipelineError(ValueError):
+    """A pipeline that can't be run as given; reported as a 400."""
+
+
+class PipelineStep:
+    """One operation of a pipeline and its (validated) parameters."""
+
+    def __init__(self, op: str, params: Dict[str, Any]):
+        self.op = op
+        self.params = params
+
+
+# =========================
+# Steps
+# =========================
+def _page_step(doc: fitz.Document, params: Dict[str, Any], save: Dict[str, Any]) -> None:
+    apply_page_op(doc, params["op"], params["pages"], params["angle"])
+
+
+def _merge_step(doc: fitz.Document, params: Dict[str, Any], save: Dict[str, Any]) -> None:
+    if params["bookmarks"] and doc.page_count:
+        # the working document becomes the first part, its own outline nested under it
+        doc.set_toc([[1, params["title"], 1]] +
+                    [[level + 1, title, page] for level, title, page in doc.get_toc(simple=True)])
+    append_pdfs(doc, params["parts"], params["bookmarks"])
+    save["dedupe"] = True
+
+
+def _compress_step(doc: fitz.Document, params: Dict[str, Any], save: Dict[str, Any]) -> None:
+    if params["mode"] == "rasterize":
+        rasterize_pdf_pages(doc, params["dpi"], params["quality"])
+    else:
+        compress_pdf_images(doc, target_dpi=params["dpi"], jpeg_quality=params["quality"])
+    save["dedupe"] = True
+    save.update({k: v for k, v in COMPRESSED_SAVE_OPTIONS.items() if k != "garbage"})
+
+
+def _watermark_step(doc: fitz.Document, params: Dict[str, Any], save: Dict[str, Any]) -> None:
+    stamp_text_watermark(doc, params["text"], params["font_size"], params["opacity"], params["rotation"])
+
+
+def _protect_step(doc: fitz.Document, params: Dict[str, Any], save: Dict[str, Any]) -> None:
+    save.update(protect_save_options(params["password"], params["owner_password"]))
+
+
+_STEPS: Dict[str, Callable[[fitz.Document, Dict[str, Any], Dict[str, Any]], None]] = {
+    "remove": _page_step,
+    "extract": _page_step,
+    "reorder": _page_step,
+    "rotate": _page_step,
+    "merge": _merge_step,
+    "compress": _compress_step,
+    "watermark": _watermark_step,
+    "protect": _protect_step,
+}
+PIPELINE_OPS = tuple(_STEPS)
+
+
+def protect_save_options(password: str, owner_password: str = "") -> Dict[str, Any]:
+    """save() options that encrypt with AES-256; opening needs `password`."""
+    return {"encryption": fitz.PDF_ENCRYPT_AES_256, "user_pw": password,
+            "owner_pw": owner_password or password}
+
+
+# =========================
+# Parsing
+# =========================
+def _text(entry: dict, name: str, default: str = "") -> str:
+    value = entry.get(name, default)
+    if not isinstance(value, str):
+        raise PipelineError(f"'{name}' must be a string")
+    return value
+
+
+def _number(entry: dict, name: str, default, low, high, kind=int):
+    value = entry.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+        raise PipelineError(f"'{name}' must be a {'whole ' if kind is int else ''}number")
+    if not low <= value <= high:
+        raise PipelineError(f"'{name}' must be between {low} and {high}")
+    return kind(value)
+
+
+_ALLOWED = {
+    "remove": {"pages"},
+    "extract": {"pages"},
+    "reorder": {"pages"},
+    "rotate": {"pages", "angle"},
+    "merge": {"pages", "bookmarks"},
+    "compress": {"level", "dpi", "quality", "mode"},
+    "watermark": {"text", "font_size", "opacity", "rotation"},
+    "protect": {"password", "owner_password"},
+}
+
+
+def _parse_step(entry: dict, uploads: List[Tuple[str, Source]]) -> PipelineStep:
+    op = entry["op"]
+    unknown = set(entry) - _ALLOWED[op] - {"op"}
+    if unknown:
+        raise PipelineError(f"unknown parameter(s) {', '.join(sorted(unknown))}")
+
+    if op in ("remove", "extract", "reorder", "rotate"):
+        return PipelineStep(op, {"op": op, "pages": _text(entry, "pages"),
+                                 "angle": _number(entry, "angle", 90, -270, 270)})
+    if op == "merge":
+        if len(uploads) < 2:
+            raise PipelineError("upload the PDFs to append after the first one")
+        pages = entry.get("pages", "")
+        if isinstance(pages, list):
+            pages = json.dumps(pages)
+        elif not isinstance(pages, str):
+            raise PipelineError("'pages' must be a string or a list")
+        # the spec works like merge_spec, over the files after the first
+        parts = parse_merge_spec(pages, uploads[1:])
+        bookmarks = entry.get("bookmarks", True)
+        if not isinstance(bookmarks, bool):
+            raise PipelineError("'bookmarks' must be true or false")
+        return PipelineStep(op, {"parts": parts, "bookmarks": bookmarks, "title": part_title(uploads[0][0])})
+    if op == "compress":
+        level = _text(entry, "level").strip().lower()
+        if level and level not in COMPRESSION_PRESETS:
+            raise PipelineError(f"'level' must be one of: {', '.join(COMPRESSION_PRESETS)}")
+        dpi, quality = COMPRESSION_PRESETS.get(level, DEFAULT_COMPRESSION)
+        mode = _text(entry, "mode", "images").strip().lower()
+        if mode not in ("images", "rasterize"):
+            raise PipelineError("'mode' must be images or rasterize")
+        return PipelineStep(op, {"dpi": _number(entry, "dpi", dpi, 10, 1200),
+                                 "quality": _number(entry, "quality", quality, 1, 100), "mode": mode})
+    if op == "watermark":
+        text = _text(entry, "text").strip()
+        if not text:
+            raise PipelineError("'text' is required")
+        return PipelineStep(op, {"text": text, "font_size": _number(entry, "font_size", 48, 6, 400),
+                                 "opacity": _number(entry, "opacity", 0.3, 0, 1, float),
+                                 "rotation": _number(entry, "rotation", 45, -360, 360)})
+    # protect
+    password = _text(entry, "password")
+    if not password:
+        raise PipelineError("'password' is required")
+    return PipelineStep(op, {"password": password, "owner_password": _text(entry, "owner_password")})
+
+
+def parse_pipeline(raw: str, uploads: List[Tuple[str, Source]]) -> List[PipelineStep]:
+    """
+    Steps from a JSON list such as
+    [{"op": "remove", "pages": "1"}, {"op": "merge"}, {"op": "compress", "level": "high"},
+     {"op": "watermark", "text": "DRAFT"}, {"op": "protect", "password": "s3cret"}].
+    A bare op name stands for the op with default parameters. Everything is
+    checked before any work starts; protect, which only sets how the result
+    is saved, must come last.
+    """
+    try:
+        entries = json.loads(raw or "")
+    except ValueError:
+        raise PipelineError("steps must be a JSON list of operations")
+    if not isinstance(entries, list) or not entries:
+        raise PipelineError("steps must be a non-empty JSON list of operations")
+    steps = []
+    for i, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {"op": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("op"), str):
+            raise PipelineError(f"step {i + 1} must be an object with an 'op'")
+        entry = dict(entry, op=entry["op"].strip().lower())
+        if entry["op"] not in _STEPS:
+            raise PipelineError(f"step {i + 1}: unknown op '{entry['op']}' "
+                                f"(one of: {', '.join(PIPELINE_OPS)})")
+        if entry["op"] == "protect" and i != len(entries) - 1:
+            raise PipelineError("protect must be the last step")
+        try:
+            steps.append(_parse_step(entry, uploads))
+        except (PipelineError, PageSpecError) as e:
+            raise PipelineError(f"step {i + 1} ({entry['op']}): {e}")
+    return steps
+
+
+def pipeline_ops(raw: str) -> List[str]:
+    """The op names in a steps string, without validating it ([] if it doesn't parse)."""
+    try:
+        entries = json.loads(raw or "")
+    except ValueError:
+        return []
+    if not isinstance(entries, list):
+        return []
+    names = [e if isinstance(e, str) else e.get("op") if isinstance(e, dict) else None for e in entries]
+    return [n.strip().lower() for n in names if isinstance(n, str)]
+
+
+# =========================
+# Running
+# =========================
+def apply_pipeline(doc: fitz.Document, steps: List[PipelineStep],
+                   progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Run the steps on `doc` in place, in order, each timed as stage
+    "pipeline_<op>"; returns the options to save the result with.
+    """
+    save: Dict[str, Any] = {"garbage": 1, "deflate": True}
+    for i, step in enumerate(steps):
+        with stage(f"pipeline_{step.op}"):
+            try:
+                _STEPS[step.op](doc, step.params, save)
+            except PageSpecError as e:
+                raise PipelineError(f"step {i + 1} ({step.op}): {e}")
+        if progress:
+            progress(i + 1, len(steps))
+    if save.pop("dedupe", False):
+        # pages from several files, or re-encoded images, can repeat; store each once
+        with stage("dedupe"):
+            dedupe_objects(doc)
+        save["garbage"] = 2
+    return save
+
+
+def run_pipeline(src: Source, steps: List[PipelineStep]) -> BinaryIO:
+    """Open a PDF, run the steps on it and save the result once."""
+    doc = open_pdf(src)
+    try:
+        if doc.needs_pass:
+            raise PipelineError("the PDF is password protected")
+        save = apply_pipeline(doc, steps, progress=report_progress)
+        add_pages(doc.page_count)
+        return save_pdf(doc, **save)
+    finally:
+        doc.close()
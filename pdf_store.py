@@ -0,0 +1,398 @@
+# pdf_store.py
+"""
+Storage for formfill PDFs (uploads plus the files derived from them).
+
+PdfStore is the interface pdf_fill.py talks to; LocalPdfStore keeps
+everything under one directory, which may be shared by several app
+instances (NFS, a mounted volume, ...): all state it relies on lives on
+disk, and every operation tolerates another instance having got there first.
+
+Layout under `root`:
+    blobs/ab/<sha256>.pdf       upload contents, stored once per distinct file
+    docs/cd/<pdf_id>/source.pdf hard link to the blob (copy if links are unsupported)
+    docs/cd/<pdf_id>/...        derived files (filled copy, overlays, ...)
+A blob whose link count drops to 1 is no longer used by any document.
+"""
+import os
+import abc
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+# Where formfill PDFs live (shared by all instances that should see the same ids)
+STORE_DIR = os.getenv("FORMFILL_STORE_DIR", os.path.join("instance", "formfill"))
+# Documents not accessed for this long are deleted by the sweeper
+STORE_TTL = float(os.getenv("FORMFILL_TTL_HOURS", "24")) * 3600
+# Quotas: total bytes on disk and number of documents (least recently used go first)
+STORE_MAX_BYTES = int(os.getenv("FORMFILL_STORE_MAX_MB", "2048")) * 1024 * 1024
+STORE_MAX_DOCS = int(os.getenv("FORMFILL_STORE_MAX_DOCS", "10000"))
+# Seconds between background sweeps
+SWEEP_INTERVAL = float(os.getenv("FORMFILL_SWEEP_SECONDS", "300"))
+
+# Access times are refreshed at most this often (saves a metadata write per request)
+_TOUCH_GRANULARITY = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+class StoreFull(Exception):
+    """The upload does not fit in the store even after evicting old documents."""
+
+
+class PdfStore(abc.ABC):
+    """
+    Interface for formfill storage. Documents are addressed by an opaque
+    pdf_id and must be available as local files while in use (fitz and
+    send_file work on paths). Each document also gets a private directory
+    for derived files. Subclasses implement put/path/workdir/delete; sweep
+    and stats are optional.
+    """
+
+    @abc.abstractmethod
+    def put(self, data: Union[bytes, BinaryIO]) -> str:
+        """Store a PDF (bytes or a readable binary stream) and return its new pdf_id."""
+
+    @abc.abstractmethod
+    def path(self, pdf_id: str) -> str:
+        """Local path of the stored PDF; raises FileNotFoundError if unknown or expired."""
+
+    @abc.abstractmethod
+    def workdir(self, pdf_id: str) -> str:
+        """Directory for files derived from `pdf_id` (removed together with it)."""
+
+    @abc.abstractmethod
+    def delete(self, pdf_id: str) -> None:
+        """Remove a document and its derived files (no error if it is already gone)."""
+
+    def sweep(self) -> Dict[str, int]:
+        """Apply TTL and quotas; return what was removed."""
+        return {}
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+    def read(self, pdf_id: str) -> bytes:
+        with open(self.path(pdf_id), "rb") as f:
+            return f.read()
+
+
+def check_pdf_id(pdf_id: str) -> str:
+    # very basic guard
+    if not pdf_id or len(pdf_id) > 64 or not pdf_id.isalnum():
+        raise ValueError("Invalid pdf_id")
+    return pdf_id
+
+
+class LocalPdfStore(PdfStore):
+    def __init__(self, root: str, ttl: float = STORE_TTL, max_bytes: int = STORE_MAX_BYTES,
+                 max_docs: int = STORE_MAX_DOCS):
+        self.root = root
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self._blobs = os.path.join(root, "blobs")
+        self._docs = os.path.join(root, "docs")
+        self._tmp = os.path.join(root, "tmp")
+        for d in (self._blobs, self._docs, self._tmp):
+            os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._usage: Optional[Tuple[int, int]] = None  # (bytes, docs), refreshed by sweep()
+
+    # ---------- paths ----------
+    def _doc_dir(self, pdf_id: str) -> str:
+        check_pdf_id(pdf_id)
+        return os.path.join(self._docs, pdf_id[:2], pdf_id)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._blobs, digest[:2], f"{digest}.pdf")
+
+    def _legacy_path(self, pdf_id: str) -> str:
+        # flat <root>/<pdf_id>.pdf files written before the store existed
+        return os.path.join(self.root, f"{pdf_id}.pdf")
+
+    # ---------- writes ----------
+    def put(self, data: Union[bytes, BinaryIO]) -> str:
+        digest, size, tmp = self._spool(data)
+        try:
+            self._make_room(size)
+            pdf_id = uuid.uuid4().hex
+            doc_dir = self._doc_dir(pdf_id)
+            os.makedirs(doc_dir)
+            self._install(tmp, digest, os.path.join(doc_dir, "source.pdf"))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with self._lock:
+            if self._usage is not None:
+                self._usage = (self._usage[0] + size, self._usage[1] + 1)
+        return pdf_id
+
+    def _install(self, tmp: str, digest: str, source: str) -> None:
+        """
+        Make `source` hold the spooled file, sharing the blob for `digest`.
+        The document gets its own link first, so a sweeper collecting the blob
+        concurrently can at worst cost the dedupe, never the data.
+        """
+        try:
+            os.link(tmp, source)
+        except OSError:
+            shutil.copyfile(tmp, source)  # filesystem without hard links: no dedupe
+            return
+        blob = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        try:
+            os.link(source, blob)
+            return  # first copy of this content
+        except FileExistsError:
+            pass  # identical upload already stored: point the document at it
+        except OSError:
+            return
+        shared = source + ".link"
+        try:
+            os.link(blob, shared)
+            os.replace(shared, source)
+        except OSError:
+            if os.path.exists(shared):
+                os.remove(shared)
+
+    def _spool(self, data: Union[bytes, BinaryIO]) -> Tuple[str, int, str]:
+        """Write to a temp file in the store while hashing; return (sha256, size, tmp_path)."""
+        h = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self._tmp, suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(data, (bytes, bytearray)):
+                h.update(data)
+                f.write(data)
+                size = len(data)
+            else:
+                while True:
+                    chunk = data.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        return h.hexdigest(), size, tmp
+
+    def delete(self, pdf_id: str) -> None:
+        doc_dir = self._doc_dir(pdf_id)
+        # rename first so a concurrent reader never sees a half-deleted directory
+        trash = os.path.join(self._tmp, f"del_{pdf_id}_{uuid.uuid4().hex[:8]}")
+        try:
+            os.rename(doc_dir, trash)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    # ---------- reads ----------
+    def path(self, pdf_id: str) -> str:
+        doc_dir = self._doc_dir(pdf_id)
+        source = os.path.join(doc_dir, "source.pdf")
+        try:
+            atime = os.stat(doc_dir).st_mtime
+        except FileNotFoundError:
+            legacy = self._legacy_path(pdf_id)
+            if not os.path.isfile(legacy):
+                raise FileNotFoundError(pdf_id)
+            self._adopt_legacy(pdf_id, legacy)
+            return self.path(pdf_id)
+        now = time.time()
+        if self.ttl > 0 and now - atime > self.ttl:
+            raise FileNotFoundError(pdf_id)  # expired, the sweeper will remove it
+        if now - atime > _TOUCH_GRANULARITY:
+            try:
+                os.utime(doc_dir, (now, now))
+            except OSError:
+                pass
+        return os.path.abspath(source)
+
+    def _adopt_legacy(self, pdf_id: str, legacy: str) -> None:
+        """Move a flat-layout upload (and its <pdf_id>.* sidecars) into the store."""
+        doc_dir = self._doc_dir(pdf_id)
+        os.makedirs(doc_dir, exist_ok=True)
+        with open(legacy, "rb") as f:
+            digest, _, tmp = self._spool(f)
+        try:
+            self._install(tmp, digest, os.path.join(doc_dir, "source.pdf"))
+        except FileExistsError:
+            pass  # adopted concurrently
+        finally:
+            os.remove(tmp)
+        prefix = f"{pdf_id}."
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.startswith(prefix) and entry.path != legacy:
+                try:
+                    os.replace(entry.path, os.path.join(doc_dir, entry.name[len(prefix):]))
+                except OSError:
+                    pass
+        try:
+            os.remove(legacy)
+        except OSError:
+            pass
+
+    def workdir(self, pdf_id: str) -> str:
+        doc_dir = self._doc_dir(pdf_id)
+        if not os.path.isdir(doc_dir):
+            self.path(pdf_id)  # raises, or adopts a legacy file
+        return doc_dir
+
+    # ---------- lifecycle ----------
+    def _iter_docs(self) -> Iterator[Tuple[str, str]]:
+        for shard in os.scandir(self._docs):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.is_dir():
+                        yield entry.name, entry.path
+
+    @staticmethod
+    def _dir_usage(path: str) -> int:
+        total = 0
+        for entry in os.scandir(path):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            # a linked source is shared with its blob and counted there
+            if not (entry.name == "source.pdf" and st.st_nlink > 1):
+                total += st.st_size
+        return total
+
+    def _blob_usage(self) -> Tuple[int, List[str]]:
+        """(bytes used by referenced blobs, paths of unreferenced blobs)."""
+        used, orphans = 0, []
+        for shard in os.scandir(self._blobs):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if st.st_nlink <= 1:
+                    orphans.append(entry.path)
+                else:
+                    used += st.st_size
+        return used, orphans
+
+    def _remove_orphans(self) -> int:
+        removed = 0
+        for blob in self._blob_usage()[1]:
+            try:
+                os.remove(blob)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def sweep(self, need_bytes: int = 0) -> Dict[str, int]:
+        """
+        Remove expired documents, then the least recently used ones while the
+        store is over its byte/document quota (keeping room for `need_bytes`
+        more), then blobs no document links to any more, and stale temp files.
+        """
+        now = time.time()
+        removed = {"expired": 0, "evicted": 0, "blobs": 0}
+        docs = []
+        for pdf_id, path in self._iter_docs():
+            try:
+                atime = os.stat(path).st_mtime
+                size = self._dir_usage(path)
+            except FileNotFoundError:
+                continue
+            if self.ttl > 0 and now - atime > self.ttl:
+                self.delete(pdf_id)
+                removed["expired"] += 1
+            else:
+                docs.append((atime, pdf_id, size))
+        removed["blobs"] += self._remove_orphans()
+        total = self._blob_usage()[0] + sum(d[2] for d in docs)
+
+        docs.sort()  # least recently used first
+        max_docs = self.max_docs - (1 if need_bytes else 0)
+        while docs and (total + need_bytes > self.max_bytes or len(docs) > max_docs):
+            _, pdf_id, size = docs.pop(0)
+            try:
+                st = os.stat(os.path.join(self._doc_dir(pdf_id), "source.pdf"))
+                if st.st_nlink == 2:
+                    size += st.st_size  # its blob goes too
+            except OSError:
+                pass
+            self.delete(pdf_id)
+            total -= size
+            removed["evicted"] += 1
+        if removed["evicted"]:
+            removed["blobs"] += self._remove_orphans()
+
+        for entry in os.scandir(self._tmp):
+            try:
+                if now - entry.stat().st_mtime > 3600:
+                    if entry.is_dir():
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    else:
+                        os.remove(entry.path)
+            except OSError:
+                pass
+
+        with self._lock:
+            self._usage = (max(0, total), len(docs))
+        return removed
+
+    def _make_room(self, size: int) -> None:
+        if size > self.max_bytes:
+            raise StoreFull(f"PDF is larger than the store quota ({self.max_bytes // (1024 * 1024)} MB)")
+        with self._lock:
+            usage = self._usage
+        if usage is None or usage[0] + size > self.max_bytes or usage[1] + 1 > self.max_docs:
+            self.sweep(need_bytes=size)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            usage = self._usage
+        if usage is None:
+            self.sweep()
+            with self._lock:
+                usage = self._usage
+        return {"bytes": usage[0], "documents": usage[1],
+                "max_bytes": self.max_bytes, "max_documents": self.max_docs}
+
+
+# =========================
+# Active store + sweeper
+# =========================
+_store: Optional[PdfStore] = None
+_store_lock = threading.Lock()
+_sweeper: Optional[threading.Thread] = None
+
+
+def set_store(store: PdfStore) -> None:
+    """Replace the store used by pdf_fill (e.g. a subclass backed by shared storage)."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def get_store() -> PdfStore:
+    """The active store; the default LocalPdfStore and the sweeper start on first use."""
+    global _store, _sweeper
+    with _store_lock:
+        if _store is None:
+            _store = LocalPdfStore(STORE_DIR)
+        if _sweeper is None and SWEEP_INTERVAL > 0:
+            _sweeper = threading.Thread(target=_sweep_loop, name="formfill-sweeper", daemon=True)
+            _sweeper.start()
+        return _store
+
+
+def _sweep_loop():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        try:
+            get_store().sweep()
+        except Exception:  # keep sweeping; the next pass may succeed
+            logger.exception("Formfill sweep failed")
@@ -0,0 +1,105 @@
+# pools.py
+"""
+One process pool shared by every CPU-bound fan-out: OCR pages, PDF -> DOCX
+chunks, batch files and bulk form fills.
+
+The pool is created on first use and kept for the life of the process, so
+its workers (and whatever they have loaded, e.g. a warm tesseract) are
+reused across requests; it is shut down at exit. Its size is the process's
+worker budget (WORKER_BUDGET), and callers ask worker_count() how far they
+may fan out. On a pool worker the budget is 1, so work that runs there
+(e.g. one file of a batch) converts in-process instead of starting pools of
+its own; a background job's process gets its share of the budget (see
+jobs.py).
+"""
+import os
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+# Worker processes in the shared pool: the most any process fans out to
+WORKER_BUDGET = int(os.getenv("WORKER_BUDGET", str(os.cpu_count() or 1)))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+# Workers this process may use; 1 on pool workers, a share in job processes
+_budget = max(1, WORKER_BUDGET)
+# (fn, args factory): run in each worker as it starts, args taken when the pool is created
+_worker_inits: List[Tuple[Callable, Callable[[], tuple]]] = []
+# Run in this process before it starts a pool
+_start_hooks: List[Callable[[], None]] = []
+# Run by shutdown(), before the pool goes away
+_shutdown_hooks: List[Callable[[], None]] = []
+
+
+def set_budget(workers: int) -> None:
+    """Cap the workers this process may use (call before the pool is first used)."""
+    global _budget
+    _budget = max(1, int(workers))
+
+
+def worker_count(requested: Optional[int] = None) -> int:
+    """`requested` workers (default: all of them) within this process's budget; 1 = run in-process."""
+    return max(1, min(_budget if requested is None else int(requested), _budget))
+
+
+def on_worker_start(fn: Callable, args: Callable[[], tuple] = tuple) -> None:
+    """Run fn(*args()) in every pool worker as it starts (register at import time)."""
+    _worker_inits.append((fn, args))
+
+
+def on_pool_start(fn: Callable[[], None]) -> None:
+    """Run fn() in this process just before it starts a pool (register at import time)."""
+    _start_hooks.append(fn)
+
+
+def on_shutdown(fn: Callable[[], None]) -> None:
+    """Run fn() when the pool is shut down (at exit, or at the end of a job)."""
+    _shutdown_hooks.append(fn)
+
+
+def _init_worker(inits: List[Tuple[Callable, tuple]]) -> None:
+    global _budget
+    _budget = 1  # no pools of our own inside a pool worker
+    for fn, args in inits:
+        fn(*args)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """
+    The shared pool, created lazily. A forked child must not reuse its
+    parent's executor, so it is rebuilt when the pid changes, and so is a
+    pool broken by a worker that died (e.g. killed by the OOM killer).
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid() or getattr(_pool, "_broken", False):
+            for fn in _start_hooks:
+                fn()
+            _pool = ProcessPoolExecutor(
+                max_workers=_budget,
+                initializer=_init_worker,
+                initargs=([(fn, args()) for fn, args in _worker_inits],),
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def shutdown() -> None:
+    """Run the shutdown hooks and stop this process's pool (pending work is cancelled)."""
+    global _pool, _pool_pid
+    for fn in _shutdown_hooks:
+        try:
+            fn()
+        except Exception:
+            pass
+    with _pool_lock:
+        pool, pid = _pool, _pool_pid
+        _pool = _pool_pid = None
+    if pool is not None and pid == os.getpid():
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown)
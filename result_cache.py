@@ -0,0 +1,221 @@
+# result_cache.py
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+
+# Bump when a conversion's output changes, so stale results are never served
+CACHE_VERSION = "10"
+
+# Where cached results are stored (can be shared by several processes)
+CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("instance", "cache"))
+
+
+def _hash_source(h, src) -> None:
+    """Feed a path (read in chunks) or raw bytes into the hash."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        h.update(f"{len(src)}\0".encode("utf-8"))
+        h.update(src)
+        return
+    h.update(f"{os.path.getsize(src)}\0".encode("utf-8"))
+    with open(src, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+
+
+def cache_key(conversion_type: str, uploads: List[Tuple[str, Any]], options: Dict[str, Any]) -> str:
+    """
+    Content address for a conversion: sha256 over the input files, the
+    conversion type and every option. Only the file extension of each upload
+    is included (it picks the code path); the rest of the name is irrelevant.
+    uploads: list of (filename, path or bytes) pairs.
+    """
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_VERSION}\0{conversion_type}\0".encode("utf-8"))
+    h.update(json.dumps(options, sort_keys=True, default=str).encode("utf-8"))
+    for name, src in uploads:
+        ext = os.path.splitext(name or "")[1].lower()
+        h.update(f"\0{ext}\0".encode("utf-8"))
+        _hash_source(h, src)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Disk-backed conversion result store with LRU eviction by total size.
+
+    Layout: <root>/<key[:2]>/<key>.bin plus a <key>.json sidecar holding the
+    download name. Recency is the file mtime, so several app processes sharing
+    the directory agree on what is least recently used.
+    """
+
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = 1024 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()  # key -> size, oldest first
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    # ---------- paths ----------
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.root, key[:2], key)
+        return base + ".bin", base + ".json"
+
+    def _load_index(self):
+        """Rebuild the index from the files on disk, oldest first."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for fn in filenames:
+                if not fn.endswith(".bin"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, fn))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, fn[:-4], st.st_size))
+        index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        with self._lock:
+            self._index = index
+            self._total = sum(index.values())
+
+    # ---------- lookups ----------
+    def get(self, key: str):
+        """Return (open file, download name) on a hit, else None."""
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            fh = open(data_path, "rb")
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(data_path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+        return fh, meta["download_name"]
+
+    # ---------- stores ----------
+    def _commit(self, key: str, tmp_path: str, download_name: str):
+        data_path, meta_path = self._paths(key)
+        size = os.path.getsize(tmp_path)
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            return
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"download_name": download_name, "size": size, "created": time.time()}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        os.replace(tmp_path, data_path)
+        with self._lock:
+            old = self._index.pop(key, 0)
+            self._index[key] = size
+            self._total += size - old
+            self.stores += 1
+        self._evict()
+
+    def _tmp_path(self, key: str) -> str:
+        folder = os.path.join(self.root, key[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f".{key}.{uuid.uuid4().hex}.tmp")
+
+    def put(self, key: str, out, download_name: str):
+        """
+        Store a conversion result and return something equivalent to `out`
+        for the caller to send: the same stream (rewound), or for chunk
+        iterators a generator that writes to the cache while it is consumed.
+        """
+        tmp_path = self._tmp_path(key)
+        if hasattr(out, "read"):
+            out.seek(0)
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(out, f)
+            out.seek(0)
+            self._commit(key, tmp_path, download_name)
+            return out
+        return self._tee(key, tmp_path, out, download_name)
+
+    def _tee(self, key, tmp_path, chunks, download_name):
+        completed = False
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed:
+                self._commit(key, tmp_path, download_name)
+            else:
+                # client went away mid-stream: never cache a partial result
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    # ---------- eviction ----------
+    def _evict(self):
+        victims = []
+        with self._lock:
+            while self._total > self.max_bytes and self._index:
+                key, size = self._index.popitem(last=False)
+                self._total -= size
+                self.evictions += 1
+                victims.append(key)
+        for key in victims:
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # ---------- counters from other processes ----------
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions}
+
+    def merge_counters(self, delta: Dict[str, int]) -> None:
+        """
+        Add another process's activity on the same directory (e.g. a
+        background job's, see jobs.share_stats); entries it stored or evicted
+        are picked up by re-reading the index from disk.
+        """
+        with self._lock:
+            self.hits += delta.get("hits", 0)
+            self.misses += delta.get("misses", 0)
+            self.stores += delta.get("stores", 0)
+            self.evictions += delta.get("evictions", 0)
+        if delta.get("stores") or delta.get("evictions"):
+            self._load_index()
+            self._evict()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,93 @@
+# spool.py
+import os
+import io
+import tempfile
+from typing import BinaryIO, Union
+
+import fitz  # PyMuPDF
+from flask import Request
+
+from metrics import stage
+
+
+# Uploads are written here while a request is parsed, and large outputs spill here
+SPOOL_DIR = os.path.join("instance", "spool")
+os.makedirs(SPOOL_DIR, exist_ok=True)
+
+# Outputs smaller than this stay in memory; bigger ones roll over to a temp file
+SPOOL_MEMORY_LIMIT = int(os.getenv("SPOOL_MEMORY_LIMIT_KB", "1024")) * 1024
+
+# A conversion input: a path on disk, or raw bytes
+Source = Union[str, bytes]
+
+
+class SpooledRequest(Request):
+    """
+    Request that streams every uploaded file straight into a named temp file
+    under SPOOL_DIR, so handlers can pass the path to PyMuPDF/PIL/PyPDF2
+    instead of reading the upload into memory. Werkzeug closes (and thereby
+    deletes) the files when the request ends.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile("w+b", dir=SPOOL_DIR, prefix="upload_")
+
+
+def upload_path(file_storage) -> str:
+    """Path of an uploaded file on disk (spooled by SpooledRequest)."""
+    stream = file_storage.stream
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        stream.flush()
+        return name
+    raise ValueError("Upload was not spooled to disk")
+
+
+def open_pdf(src: Source) -> fitz.Document:
+    """Open a PDF from a path (lazily, no full read) or from bytes."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=src, filetype="pdf")
+    return fitz.open(src, filetype="pdf")
+
+
+def as_file(src: Source):
+    """Something PIL / PyPDF2 / python-docx can open: the path itself, or a BytesIO."""
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(src)
+    return src
+
+
+def new_output() -> BinaryIO:
+    """Output buffer that rolls over to disk once it exceeds SPOOL_MEMORY_LIMIT."""
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_LIMIT, dir=SPOOL_DIR)
+
+
+class _NamelessWriter:
+    """
+    PyMuPDF treats any object with a `.name` as a filename; temp files have
+    one, so hand Document.save() this thin write/seek/tell proxy instead.
+    """
+
+    def __init__(self, fileobj):
+        self._f = fileobj
+
+    def write(self, data):
+        return self._f.write(data)
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def truncate(self, *args):
+        return self._f.truncate(*args)
+
+
+def save_pdf(doc: fitz.Document, **save_options) -> BinaryIO:
+    """Save a PyMuPDF document into a new spooled output, rewound for reading."""
+    out = new_output()
+    with stage("save"):
+        doc.save(_NamelessWriter(out), **save_options)
+    out.seek(0)
+    return out
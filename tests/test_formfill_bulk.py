@@ -0,0 +1,153 @@
+# tests/test_formfill_bulk.py
+import io
+import json
+import zipfile
+
+import fitz
+import pytest
+
+import formfill_bulk
+from formfill_bulk import BulkInputError, iter_bulk_zip, parse_layout, read_rows
+
+
+# =========================
+# read_rows
+# =========================
+def test_csv_rows():
+    rows = read_rows(io.BytesIO(b"\xef\xbb\xbfname,city\nAda,London\nAlan,Wilmslow\n"), "people.csv")
+    assert rows == [{"name": "Ada", "city": "London"}, {"name": "Alan", "city": "Wilmslow"}]
+
+
+def test_jsonl_rows_skip_blank_lines():
+    data = b'{"name": "Ada"}\n\n{"name": "Alan", "age": 41}\n'
+    assert read_rows(io.BytesIO(data), "people.jsonl") == [{"name": "Ada"}, {"name": "Alan", "age": 41}]
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b'  {"name": "Ada"}\n', [{"name": "Ada"}]),
+    (b"name\nAda\n", [{"name": "Ada"}]),
+])
+def test_format_sniffed_without_extension(data, expected):
+    assert read_rows(io.BytesIO(data), "upload") == expected
+
+
+@pytest.mark.parametrize("data, filename, message", [
+    (b"", "rows.csv", "no rows"),
+    (b"[1, 2]\n", "rows.jsonl", "line 1: expected a JSON object"),
+    (b'{"name": \n', "rows.jsonl", "could not read rows"),
+    (b"name\n\xff\xfe\n", "rows.csv", "could not read rows"),
+])
+def test_bad_rows(data, filename, message):
+    with pytest.raises(BulkInputError, match=message):
+        read_rows(io.BytesIO(data), filename)
+
+
+def test_too_many_rows(monkeypatch):
+    monkeypatch.setattr(formfill_bulk, "BULK_MAX_ROWS", 2)
+    assert len(read_rows(io.BytesIO(b"n\n1\n2\n"), "rows.csv")) == 2
+    with pytest.raises(BulkInputError, match="too many rows"):
+        read_rows(io.BytesIO(b"n\n1\n2\n3\n"), "rows.csv")
+
+
+# =========================
+# parse_layout
+# =========================
+def test_layout_list_or_wrapped():
+    fields = [{"field": "name", "x": 10, "y": 20}]
+    assert parse_layout(json.dumps(fields)) == fields
+    assert parse_layout(json.dumps({"overlays": fields})) == fields
+    assert parse_layout(json.dumps({"fields": fields})) == fields
+
+
+@pytest.mark.parametrize("raw, message", [
+    ("", "layout must be JSON"),
+    ("{not json", "layout must be JSON"),
+    ('"text"', "list of field objects"),
+    ('[{"x": 1}, 2]', "list of field objects"),
+    ("[]", "no fields"),
+])
+def test_bad_layout(raw, message):
+    with pytest.raises(BulkInputError, match=message):
+        parse_layout(raw)
+
+
+def test_layout_pages_resolved_against_template():
+    layout = parse_layout('[{"text": "a"}, {"text": "b", "page": -1}, {"text": "c", "page": "1"}]', page_count=3)
+    assert [f["page"] for f in layout] == [0, 2, 1]
+
+
+@pytest.mark.parametrize("page, message", [(3, "field 1: page 3 not in document"),
+                                           (-4, "field 1: page -4 not in document"),
+                                           ("two", "field 1: page 'two' is not a number")])
+def test_layout_page_outside_template(page, message):
+    with pytest.raises(BulkInputError, match=message):
+        parse_layout(json.dumps([{"text": "a", "page": page}]), page_count=3)
+
+
+# =========================
+# Filling
+# =========================
+@pytest.fixture
+def template(tmp_path):
+    doc = fitz.open()
+    doc.new_page()
+    doc.new_page()
+    path = tmp_path / "template.pdf"
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def test_bulk_zip_in_row_order_with_manifest(template):
+    layout = parse_layout(json.dumps([{"text": "Dear {name}", "x": 0.1, "y": 0.1},
+                                      {"field": "city", "x": 0.1, "y": 0.2, "page": -1}]), page_count=2)
+    rows = [{"name": "Ada", "city": "London"}, {"name": "Alan", "city": "Wilmslow"}]
+    data = b"".join(iter_bulk_zip(template, layout, rows, name_template="{name}.pdf", workers=1))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == ["Ada.pdf", "Alan.pdf", "manifest.json"]
+        with fitz.open("pdf", zf.read("Alan.pdf")) as doc:
+            assert "Dear Alan" in doc[0].get_text()
+            assert "Wilmslow" in doc[1].get_text()
+        manifest = json.loads(zf.read("manifest.json"))
+    assert (manifest["rows"], manifest["succeeded"], manifest["failed"]) == (2, 2, 0)
+
+
+def test_row_with_undrawable_field_is_reported(template):
+    layout = parse_layout('[{"text": "{name}", "x": 0.1, "y": 0.1, "font_size": "large"}]', page_count=2)
+    data = b"".join(iter_bulk_zip(template, layout, [{"name": "Ada"}], workers=1))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == ["manifest.json"]
+        manifest = json.loads(zf.read("manifest.json"))
+    assert manifest["failed"] == 1
+    assert manifest["results"] == [{"row": 1, "status": "error",
+                                    "error": "overlay 1: could not convert string to float: 'large'"}]
+
+
+def test_concatenated_pdf_leaves_out_failed_rows(template, monkeypatch):
+    draw = formfill_bulk.draw_overlays
+
+    def failing_for_alan(doc, overlays):
+        if overlays[0]["text"] == "Alan":
+            return ["overlay 1: bad value"]
+        return draw(doc, overlays)
+
+    monkeypatch.setattr(formfill_bulk, "draw_overlays", failing_for_alan)
+    layout = parse_layout('[{"text": "{name}", "x": 0.1, "y": 0.1}]', page_count=2)
+    rows = [{"name": "Ada"}, {"name": "Alan"}, {"name": "Grace"}]
+    out, stats = formfill_bulk.bulk_concatenated_pdf(template, layout, rows, workers=1)
+    assert stats["failed"] == 1
+    with fitz.open("pdf", out.read()) as doc:
+        assert [page.get_text().strip() for page in doc] == ["Ada", "", "Grace", ""]
+
+    with pytest.raises(BulkInputError, match="no row could be filled: overlay 1: bad value"):
+        formfill_bulk.bulk_concatenated_pdf(template, layout, rows[1:2], workers=1)
+
+
+@pytest.mark.parametrize("template, expected", [
+    ("Dear {name}, row {n}", "Dear Ada, row 3"),
+    ("{missing}|{age}|{none}", "|36|"),
+    ("{name.__class__.__mro__}", "{name.__class__.__mro__}"),
+    ("{name[0]} {age:>5} {0}", "{name[0]} {age:>5} "),
+])
+def test_fill_only_substitutes_plain_placeholders(template, expected):
+    assert formfill_bulk._fill(template, {"name": "Ada", "age": 36, "none": None}, 3) == expected
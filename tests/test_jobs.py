@@ -0,0 +1,92 @@
+# tests/test_jobs.py
+import io
+import os
+import time
+
+import pytest
+
+import jobs
+
+
+def _runner(conversion_type, inputs, options):
+    if conversion_type == "fail":
+        raise ValueError("bad input")
+    time.sleep(options.get("sleep", 0))
+    with open(inputs[0][1], "rb") as f:
+        return io.BytesIO(f.read().upper()), "out.txt"
+
+
+def _wait(queue, job, timeout=60):
+    deadline = time.time() + timeout
+    while job.state in (jobs.QUEUED, jobs.RUNNING) and time.time() < deadline:
+        time.sleep(0.05)
+    return queue.status(job)
+
+
+def _queue(tmp_path, monkeypatch, queue_depth=4, timeout=30):
+    monkeypatch.setattr(jobs, "JOB_DIR", str(tmp_path / "jobs"))
+    return jobs.JobQueue(_runner, {"main": {"workers": 1, "queue_depth": queue_depth, "timeout": timeout}})
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    return _queue(tmp_path, monkeypatch)
+
+
+@pytest.fixture
+def upload(tmp_path):
+    path = tmp_path / "upload.txt"
+    path.write_bytes(b"hello")
+    return [("upload.txt", str(path))]
+
+
+def test_job_runs_in_child_and_writes_result(queue, upload):
+    job = queue.submit("main", "upper", upload, {})
+    info = _wait(queue, job)
+    assert info["state"] == jobs.DONE
+    assert info["progress"] == 1.0
+    assert info["download_name"] == "out.txt"
+    with open(job.result_path, "rb") as f:
+        assert f.read() == b"HELLO"
+    # inputs are removed once the job has finished
+    assert not os.path.exists(os.path.join(job.workdir, "input_0"))
+
+
+def test_runner_error_fails_job(queue, upload):
+    job = queue.submit("main", "fail", upload, {})
+    info = _wait(queue, job)
+    assert info["state"] == jobs.FAILED
+    assert info["error"] == "bad input"
+
+
+def test_slow_job_times_out(tmp_path, monkeypatch, upload):
+    queue = _queue(tmp_path, monkeypatch, timeout=1)
+    job = queue.submit("main", "upper", upload, {"sleep": 3})
+    info = _wait(queue, job)
+    assert info["state"] == jobs.TIMEOUT
+    assert "timeout" in info["error"]
+
+
+def test_full_lane_rejects_job(tmp_path, monkeypatch, upload):
+    q = _queue(tmp_path, monkeypatch, queue_depth=1)
+    running = q.submit("main", "upper", upload, {"sleep": 0.5})
+    while running.state == jobs.QUEUED:
+        time.sleep(0.01)
+    waiting = q.submit("main", "upper", upload, {})
+    assert q.status(waiting)["position"] == 1
+    with pytest.raises(jobs.QueueFull):
+        q.submit("main", "upper", upload, {})
+    # the rejected job's directory is not left behind
+    assert sorted(os.listdir(jobs.JOB_DIR)) == sorted([running.id, waiting.id])
+
+
+def test_expire_forgets_old_jobs_and_their_files(queue, upload):
+    job = queue.submit("main", "upper", upload, {})
+    _wait(queue, job)
+    queue.expire()
+    assert queue.get(job.id) is job
+
+    job.finished = time.time() - queue.result_ttl - 1
+    queue.expire()
+    assert queue.get(job.id) is None
+    assert not os.path.exists(job.workdir)
@@ -0,0 +1,37 @@
+# tests/test_ocr_engine.py
+from multiprocessing import shared_memory
+
+import pytest
+
+import ocr_engine
+
+
+def test_recognizer_error_reaches_the_caller(monkeypatch):
+    seen = []
+
+    def failing(width, height, samples, lang, config, mode="txt", page_number=0):
+        seen.append(bytes(samples))
+        raise RuntimeError("tesseract failed")
+
+    monkeypatch.setattr(ocr_engine, "_recognize", failing)
+    shm = shared_memory.SharedMemory(create=True, size=16)
+    try:
+        shm.buf[:6] = b"pixels"
+        with pytest.raises(RuntimeError, match="tesseract failed"):
+            ocr_engine._ocr_shared(shm.name, 3, 2, None, "")
+        assert seen == [b"pixels"]
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_shared_raster_reaches_the_recognizer(monkeypatch):
+    monkeypatch.setattr(ocr_engine, "_recognize",
+                        lambda width, height, samples, *args: (width, height, bytes(samples)))
+    slots = ocr_engine._RasterSlots(idle=1)
+    try:
+        shm = slots.put(b"abcdef")
+        assert ocr_engine._ocr_shared(shm.name, 3, 2, None, "") == (3, 2, b"abcdef")
+        slots.release(shm)
+    finally:
+        slots.close()
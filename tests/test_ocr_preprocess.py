@@ -0,0 +1,115 @@
+# tests/test_ocr_preprocess.py
+import fitz
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from ocr_preprocess import binarize, crop_margins, deskew, estimate_skew, otsu_threshold, page_dpi, prepare_raster
+
+
+def _text_page(angle: float = 0.0) -> np.ndarray:
+    """A white page with dark lines of 'text' (bars with gaps), tilted by `angle` degrees."""
+    img = Image.new("L", (1200, 1600), 235)
+    draw = ImageDraw.Draw(img)
+    for y in range(200, 1400, 60):
+        for x in range(150, 1050, 90):
+            draw.rectangle((x, y, x + 70, y + 20), fill=30)
+    if angle:
+        img = img.rotate(angle, resample=Image.BILINEAR, fillcolor=235)
+    return np.asarray(img)
+
+
+# =========================
+# Binarization
+# =========================
+def test_otsu_splits_two_levels():
+    gray = np.full((100, 100), 200, np.uint8)
+    gray[:, :30] = 40
+    threshold = otsu_threshold(gray)
+    assert 40 <= threshold < 200
+
+
+def test_otsu_ignores_noise_around_the_levels():
+    rng = np.random.default_rng(0)
+    gray = np.where(rng.random((200, 200)) < 0.2, 50, 210) + rng.integers(-15, 16, (200, 200))
+    assert 65 <= otsu_threshold(gray.astype(np.uint8)) <= 195
+
+
+def test_binarize_is_black_on_white():
+    gray = np.array([[10, 20, 230, 240]] * 4, np.uint8)
+    binary = binarize(gray)
+    assert binary.dtype == np.uint8
+    assert binary.tolist() == [[0, 0, 255, 255]] * 4
+
+
+def test_uniform_page_is_all_paper():
+    assert set(np.unique(binarize(np.full((50, 50), 128, np.uint8)))) <= {0, 255}
+
+
+# =========================
+# Geometry
+# =========================
+def test_level_page_has_no_skew():
+    assert abs(estimate_skew(binarize(_text_page()))) < 0.2
+
+
+@pytest.mark.parametrize("angle", [-3.0, 1.5, 4.0])
+def test_estimate_skew_finds_the_tilt(angle):
+    skew = estimate_skew(binarize(_text_page(angle)))
+    assert abs(abs(skew) - abs(angle)) < 0.3
+    # undoing what it reports levels the page
+    assert abs(estimate_skew(deskew(binarize(_text_page(angle)), skew))) < 0.3
+
+
+def test_blank_page_has_no_skew():
+    assert estimate_skew(np.full((500, 500), 255, np.uint8)) == 0.0
+
+
+def test_small_skew_is_not_rotated():
+    binary = binarize(_text_page())
+    assert deskew(binary, 0.05) is binary
+
+
+def test_crop_margins():
+    binary = np.full((100, 200), 255, np.uint8)
+    binary[40:50, 60:90] = 0
+    binary[5, 5] = 0  # a speck
+    cropped = crop_margins(binary, padding=4)
+    assert cropped.shape == (18, 38)
+    assert crop_margins(np.full((10, 10), 255, np.uint8)) is None
+
+
+def test_prepare_raster():
+    gray = _text_page(2.0)
+    assert prepare_raster(gray, geometry=False).shape == gray.shape
+    prepared = prepare_raster(gray)
+    assert prepared.shape[0] < gray.shape[0] and prepared.shape[1] < gray.shape[1]
+    assert prepare_raster(np.full((300, 300), 250, np.uint8)) is None
+
+
+# =========================
+# Resolution
+# =========================
+def _scan_pdf(pixels_wide: int, pixels_high: int) -> fitz.Document:
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    pix = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, pixels_wide, pixels_high), False)
+    pix.clear_with(200)
+    page.insert_image(page.rect, pixmap=pix, keep_proportion=False)
+    return doc
+
+
+@pytest.mark.parametrize("pixels, expected", [
+    ((1700, 2200), 200),  # 8.5 x 11 in at 200 dpi
+    ((4250, 5500), 300),  # 500 dpi, clamped to OCR_MAX_DPI
+    ((425, 550), 150),  # 50 dpi, clamped to OCR_MIN_DPI
+])
+def test_page_dpi_follows_the_scan(pixels, expected):
+    with _scan_pdf(*pixels) as doc:
+        assert page_dpi(doc[0], 123) == expected
+
+
+def test_page_dpi_default_without_a_scan():
+    with fitz.open() as doc:
+        doc.new_page().insert_text((72, 72), "vector text")
+        assert page_dpi(doc[0], 123) == 123
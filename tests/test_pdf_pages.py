@@ -0,0 +1,171 @@
+# tests/test_pdf_pages.py
+import json
+
+import fitz
+import pytest
+
+from pdf_pages import (PageSpecError, apply_page_op, iter_split_pdfs, merge_pdfs, page_runs,
+                       parse_merge_spec, parse_page_spec, split_groups)
+
+
+def _pdf(pages: int, label: str = "p", toc: bool = False) -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"{label}{i + 1}")
+    if toc:
+        doc.set_toc([[1, f"{label} chapter", 1]])
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _labels(doc: fitz.Document):
+    return [page.get_text().strip() for page in doc]
+
+
+# =========================
+# Page specs
+# =========================
+@pytest.mark.parametrize("spec, expected", [
+    ("", [0, 1, 2, 3, 4]),
+    ("1,3,5", [0, 2, 4]),
+    ("2-4", [1, 2, 3]),
+    ("4-2", [3, 2, 1]),
+    ("4-", [3, 4]),
+    ("-2", [0, 1]),
+    ("last", [4]),
+    ("1; end", [0, 4]),
+    ("2,2,1", [1, 1, 0]),
+    (" 1 , , 2 ", [0, 1]),
+])
+def test_parse_page_spec(spec, expected):
+    assert parse_page_spec(spec, 5) == expected
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("0", "page 0 in '0' is out of range"),
+    ("6", "page 6 in '6' is out of range"),
+    ("2-9", "page 9 in '2-9' is out of range"),
+    ("x", "'x' in page spec 'x' is not a page number"),
+    (",", "no pages in ','"),
+])
+def test_bad_page_spec(spec, message):
+    with pytest.raises(PageSpecError, match=message):
+        parse_page_spec(spec, 5)
+
+
+def test_empty_spec_can_be_an_error():
+    with pytest.raises(PageSpecError, match="no pages given"):
+        parse_page_spec(" ", 5, empty_means_all=False)
+
+
+def test_page_runs():
+    assert page_runs([0, 1, 2, 5, 4, 3, 7, 7]) == [(0, 2), (5, 3), (7, 7), (7, 7)]
+
+
+# =========================
+# Page operations
+# =========================
+@pytest.mark.parametrize("op, spec, expected", [
+    ("remove", "2,4", ["p1", "p3", "p5"]),
+    ("extract", "4,2,2", ["p2", "p4"]),
+    ("reorder", "5-4,1,1", ["p5", "p4", "p1", "p1"]),
+])
+def test_page_ops(op, spec, expected):
+    with fitz.open("pdf", _pdf(5)) as doc:
+        apply_page_op(doc, op, spec)
+        assert _labels(doc) == expected
+
+
+def test_rotate_adds_to_existing_rotation():
+    with fitz.open("pdf", _pdf(3)) as doc:
+        doc[0].set_rotation(90)
+        apply_page_op(doc, "rotate", "1-2", 270)
+        assert [page.rotation for page in doc] == [0, 270, 0]
+        apply_page_op(doc, "rotate", "", -90)
+        assert [page.rotation for page in doc] == [270, 180, 270]
+
+
+@pytest.mark.parametrize("op, spec, angle, message", [
+    ("remove", "1-3", 90, "that would remove every page"),
+    ("remove", "", 90, "no pages given"),
+    ("extract", "", 90, "no pages given"),
+    ("rotate", "1", 45, "multiple of 90 degrees"),
+    ("shuffle", "1", 90, "unknown page operation 'shuffle'"),
+])
+def test_bad_page_op(op, spec, angle, message):
+    with fitz.open("pdf", _pdf(3)) as doc:
+        with pytest.raises(PageSpecError, match=message):
+            apply_page_op(doc, op, spec, angle)
+        assert doc.page_count == 3
+
+
+@pytest.mark.parametrize("spec, every, expected", [
+    ("", 0, [[0], [1], [2], [3], [4]]),
+    ("", 2, [[0, 1], [2, 3], [4]]),
+    ("1-2, 5, 3-end", 0, [[0, 1], [4], [2, 3, 4]]),
+])
+def test_split_groups(spec, every, expected):
+    assert split_groups(spec, 5, every) == expected
+
+
+def test_split_outputs():
+    with fitz.open("pdf", _pdf(12)) as doc:
+        parts = list(iter_split_pdfs(doc, split_groups("", 12, every=5), stem="doc"))
+    assert [name for name, _ in parts] == ["doc_1.pdf", "doc_2.pdf", "doc_3.pdf"]
+    with fitz.open("pdf", parts[2][1]) as last:
+        assert _labels(last) == ["p11", "p12"]
+
+
+# =========================
+# Merge specs
+# =========================
+UPLOADS = [("intro.pdf", b"a"), ("body.pdf", b"b")]
+
+
+def test_merge_spec_defaults_to_every_file():
+    parts = parse_merge_spec("", UPLOADS)
+    assert [(p.src, p.pages, p.title) for p in parts] == [(b"a", "", "intro"), (b"b", "", "body")]
+
+
+def test_merge_spec_one_line_per_file():
+    parts = parse_merge_spec("1-2\n", UPLOADS)
+    assert [(p.src, p.pages) for p in parts] == [(b"a", "1-2"), (b"b", "")]
+    with pytest.raises(PageSpecError, match="3 page ranges given for 2 files"):
+        parse_merge_spec("1\n2\n3", UPLOADS)
+
+
+def test_merge_spec_json_reorders_and_repeats():
+    raw = json.dumps([{"file": "body.pdf", "pages": "2"}, {"file": 0, "bookmark": "Start"}, {"file": 1}])
+    parts = parse_merge_spec(raw, UPLOADS)
+    assert [(p.src, p.pages, p.title) for p in parts] == [
+        (b"b", "2", "body"), (b"a", "", "Start"), (b"b", "", "body")]
+
+
+@pytest.mark.parametrize("raw, message", [
+    ("[1", "not valid JSON"),
+    ("[1]", "must be an object"),
+    ('[{"file": 2}]', "unknown file 2"),
+    ('[{"file": "other.pdf"}]', "unknown file 'other.pdf'"),
+    ('[{"file": true}]', "unknown file True"),
+    ("[]", "merge spec is empty"),
+])
+def test_bad_merge_spec(raw, message):
+    with pytest.raises(PageSpecError, match=message):
+        parse_merge_spec(raw, UPLOADS)
+
+
+def test_merge_pages_and_bookmarks():
+    uploads = [("a.pdf", _pdf(3, "a", toc=True)), ("b.pdf", _pdf(2, "b"))]
+    doc = merge_pdfs(parse_merge_spec('[{"file": 1, "pages": "2"}, {"file": 0, "pages": "3-1"}]', uploads))
+    try:
+        assert _labels(doc) == ["b2", "a3", "a2", "a1"]
+        assert doc.get_toc(simple=True) == [[1, "b", 1], [1, "a", 2], [2, "a chapter", 4]]
+    finally:
+        doc.close()
+
+
+def test_merge_reports_the_part_with_a_bad_range():
+    uploads = [("a.pdf", _pdf(2, "a"))]
+    with pytest.raises(PageSpecError, match="a: page 3 in '3' is out of range"):
+        merge_pdfs(parse_merge_spec("3", uploads))
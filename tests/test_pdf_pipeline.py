@@ -0,0 +1,115 @@
+# tests/test_pdf_pipeline.py
+import json
+
+import fitz
+import pytest
+
+from pdf_pipeline import PipelineError, apply_pipeline, parse_pipeline, pipeline_ops, run_pipeline
+
+
+def _pdf(pages: int, label: str = "p") -> bytes:
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"{label}{i + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+UPLOADS = [("first.pdf", b"a"), ("second.pdf", b"b")]
+
+
+def _parse(steps, uploads=UPLOADS):
+    return parse_pipeline(json.dumps(steps), uploads)
+
+
+# =========================
+# Parsing
+# =========================
+def test_bare_names_get_defaults():
+    steps = _parse(["merge", "compress", {"op": " Watermark ", "text": "DRAFT"}])
+    assert [s.op for s in steps] == ["merge", "compress", "watermark"]
+    assert steps[0].params["bookmarks"] is True and steps[0].params["title"] == "first"
+    assert (steps[1].params["dpi"], steps[1].params["quality"], steps[1].params["mode"]) == (100, 75, "images")
+    assert steps[2].params["font_size"] == 48
+
+
+def test_compress_level_and_overrides():
+    (step,) = _parse([{"op": "compress", "level": "HIGH", "quality": 50}])
+    assert (step.params["dpi"], step.params["quality"]) == (72, 50)
+
+
+def test_merge_pages_as_a_list():
+    (step,) = _parse([{"op": "merge", "pages": [{"file": 0, "pages": "2"}]}])
+    assert [(p.src, p.pages) for p in step.params["parts"]] == [(b"b", "2")]
+
+
+@pytest.mark.parametrize("steps, message", [
+    ("not json", "must be a JSON list"),
+    ([], "non-empty JSON list"),
+    ([1], "step 1 must be an object with an 'op'"),
+    (["shred"], "step 1: unknown op 'shred'"),
+    (["protect", "compress"], "protect must be the last step"),
+    ([{"op": "rotate", "pages": "1", "speed": 2}], r"step 1 \(rotate\): unknown parameter\(s\) speed"),
+    ([{"op": "rotate", "angle": 1000}], "'angle' must be between -270 and 270"),
+    ([{"op": "rotate", "angle": 1.5}], "'angle' must be a whole number"),
+    ([{"op": "rotate", "angle": True}], "'angle' must be a whole number"),
+    ([{"op": "compress", "level": "extreme"}], "'level' must be one of"),
+    ([{"op": "compress", "mode": "magic"}], "'mode' must be images or rasterize"),
+    (["watermark"], r"step 1 \(watermark\): 'text' is required"),
+    ([{"op": "watermark", "text": "x", "opacity": 2}], "'opacity' must be between 0 and 1"),
+    (["protect"], "'password' is required"),
+    ([{"op": "merge", "bookmarks": "yes"}], "'bookmarks' must be true or false"),
+    ([{"op": "merge", "pages": '[{"file": 5}]'}], r"step 1 \(merge\): merge spec refers to unknown file 5"),
+])
+def test_bad_pipeline(steps, message):
+    raw = steps if isinstance(steps, str) else json.dumps(steps)
+    with pytest.raises(PipelineError, match=message):
+        parse_pipeline(raw, UPLOADS)
+
+
+def test_merge_needs_a_second_upload():
+    with pytest.raises(PipelineError, match="upload the PDFs to append"):
+        _parse(["merge"], UPLOADS[:1])
+
+
+def test_pipeline_ops_without_validating():
+    assert pipeline_ops('["Merge", {"op": "compress"}, 3, {"x": 1}]') == ["merge", "compress"]
+    assert pipeline_ops("nonsense") == []
+    assert pipeline_ops('{"op": "merge"}') == []
+
+
+# =========================
+# Running
+# =========================
+def test_pipeline_runs_steps_in_order():
+    uploads = [("first.pdf", _pdf(3, "a")), ("second.pdf", _pdf(2, "b"))]
+    steps = _parse([{"op": "remove", "pages": "2"}, {"op": "merge", "pages": "2"},
+                    {"op": "rotate", "pages": "last"}, {"op": "watermark", "text": "DRAFT"}], uploads)
+    progress = []
+    with fitz.open("pdf", uploads[0][1]) as doc:
+        save = apply_pipeline(doc, steps, progress=lambda done, total: progress.append((done, total)))
+        assert [page.get_text().split()[0] for page in doc] == ["a1", "a3", "b2"]
+        assert doc[-1].rotation == 90
+        # the watermark stamp is one image, shared by every page
+        assert len({page.get_images()[0][0] for page in doc}) == 1
+        assert doc.get_toc(simple=True) == [[1, "first", 1], [1, "second", 3]]
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    # a merge dedupes shared objects on save
+    assert save["garbage"] == 2
+
+
+def test_page_errors_name_the_step():
+    steps = _parse(["compress", {"op": "remove", "pages": "9"}])
+    with fitz.open("pdf", _pdf(2)) as doc:
+        with pytest.raises(PipelineError, match=r"step 2 \(remove\): page 9"):
+            apply_pipeline(doc, steps)
+
+
+def test_protect_encrypts_the_result():
+    steps = _parse([{"op": "extract", "pages": "1"}, {"op": "protect", "password": "s3cret"}])
+    out = run_pipeline(_pdf(2), steps)
+    with fitz.open("pdf", out.read()) as doc:
+        assert doc.needs_pass
+        assert doc.authenticate("s3cret")
+        assert doc.page_count == 1
@@ -0,0 +1,124 @@
+# tests/test_result_cache.py
+import io
+import os
+
+import pytest
+
+from result_cache import ResultCache, cache_key
+
+
+def _put(cache, key, data, name="out.pdf"):
+    out = cache.put(key, io.BytesIO(data), name)
+    assert out.read() == data
+
+
+def _key(n):
+    return f"{n:02x}" * 32
+
+
+# =========================
+# cache_key
+# =========================
+def test_key_depends_on_content_type_and_options():
+    base = cache_key("pdf_to_word", [("a.pdf", b"%PDF-1")], {"pages": "1"})
+    assert base == cache_key("pdf_to_word", [("a.pdf", b"%PDF-1")], {"pages": "1"})
+    assert base != cache_key("pdf_to_word", [("a.pdf", b"%PDF-2")], {"pages": "1"})
+    assert base != cache_key("compress_pdf", [("a.pdf", b"%PDF-1")], {"pages": "1"})
+    assert base != cache_key("pdf_to_word", [("a.pdf", b"%PDF-1")], {"pages": "2"})
+
+
+def test_key_ignores_file_name_and_option_order_but_not_extension():
+    key = cache_key("convert", [("report.png", b"data")], {"a": 1, "b": 2})
+    assert key == cache_key("convert", [("other.PNG", b"data")], {"b": 2, "a": 1})
+    assert key != cache_key("convert", [("report.jpg", b"data")], {"a": 1, "b": 2})
+
+
+def test_key_same_for_path_and_bytes(tmp_path):
+    path = tmp_path / "in.pdf"
+    path.write_bytes(b"%PDF-1.7 body")
+    assert cache_key("x", [("in.pdf", str(path))], {}) == cache_key("x", [("in.pdf", b"%PDF-1.7 body")], {})
+
+
+def test_key_separates_file_boundaries():
+    assert cache_key("merge", [("a.pdf", b"ab"), ("b.pdf", b"c")], {}) != \
+        cache_key("merge", [("a.pdf", b"a"), ("b.pdf", b"bc")], {})
+
+
+# =========================
+# ResultCache
+# =========================
+def test_miss_then_hit(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get(_key(1)) is None
+    _put(cache, _key(1), b"result")
+    fh, name = cache.get(_key(1))
+    with fh:
+        assert fh.read() == b"result"
+    assert name == "out.pdf"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"], stats["entries"]) == (1, 1, 1, 1)
+
+
+def test_streamed_result_is_stored_only_when_complete(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert b"".join(cache.put(_key(1), iter([b"ab", b"cd"]), "out.zip")) == b"abcd"
+    fh, _ = cache.get(_key(1))
+    with fh:
+        assert fh.read() == b"abcd"
+
+    partial = cache.put(_key(2), iter([b"ab", b"cd"]), "out.zip")
+    next(partial)
+    partial.close()  # client went away
+    assert cache.get(_key(2)) is None
+    assert not [f for _, _, files in os.walk(str(tmp_path)) for f in files if f.endswith(".tmp")]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=250)
+    _put(cache, _key(1), b"a" * 100)
+    _put(cache, _key(2), b"b" * 100)
+    cache.get(_key(1))[0].close()  # 1 is now more recent than 2
+    _put(cache, _key(3), b"c" * 100)
+    assert cache.get(_key(2)) is None
+    for n in (1, 3):
+        cache.get(_key(n))[0].close()
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["bytes"] == 200
+
+
+def test_result_larger_than_cache_is_not_stored(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10)
+    _put(cache, _key(1), b"x" * 11)
+    assert cache.get(_key(1)) is None
+    assert cache.stats()["stores"] == 0
+
+
+def test_index_is_rebuilt_from_disk(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    _put(cache, _key(1), b"a" * 10)
+    _put(cache, _key(2), b"b" * 20)
+    again = ResultCache(str(tmp_path))
+    stats = again.stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 30)
+
+
+def test_merge_counters_picks_up_other_process_stores(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=150)
+    _put(cache, _key(1), b"a" * 100)
+    other = ResultCache(str(tmp_path), max_bytes=150)
+    before = other.counters()
+    _put(other, _key(2), b"b" * 100)  # over the limit together; the other process evicts key 1
+    after = other.counters()
+
+    cache.merge_counters({k: after[k] - before[k] for k in after})
+    stats = cache.stats()
+    assert (stats["stores"], stats["evictions"], stats["entries"], stats["bytes"]) == (2, 1, 1, 100)
+
+
+@pytest.mark.parametrize("bad_meta", [b"", b"not json"])
+def test_broken_entry_is_a_miss(tmp_path, bad_meta):
+    cache = ResultCache(str(tmp_path))
+    _put(cache, _key(1), b"data")
+    with open(cache._paths(_key(1))[1], "wb") as f:
+        f.write(bad_meta)
+    assert cache.get(_key(1)) is None
@@ -0,0 +1,56 @@
+# tests/test_zipstream.py
+import io
+import zipfile
+
+from zipstream import iter_zip, write_zip
+
+
+def test_iter_zip_round_trips():
+    entries = [("a.txt", b"hello " * 1000), ("b/c.bin", bytes(range(256))), ("empty.txt", b"")]
+    data = b"".join(iter_zip(entries))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert [(name, zf.read(name)) for name in zf.namelist()] == entries
+
+
+def test_iter_zip_yields_each_entry_as_it_is_written():
+    seen = []
+
+    def entries():
+        for i in range(3):
+            seen.append(i)
+            yield f"{i}.txt", b"x" * 100
+
+    chunks = iter_zip(entries())
+    next(chunks)
+    # the first entry is out before the second one is asked for
+    assert seen == [0]
+    rest = list(chunks)
+    assert seen == [0, 1, 2] and rest
+
+
+def test_compressed_formats_are_stored():
+    data = b"".join(iter_zip([("photo.JPG", b"a" * 1000), ("notes.txt", b"a" * 1000)]))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.getinfo("photo.JPG").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("notes.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_custom_stored_suffixes():
+    data = b"".join(iter_zip([("notes.txt", b"a" * 1000)], stored_suffixes=(".txt",)))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.getinfo("notes.txt").compress_type == zipfile.ZIP_STORED
+
+
+def test_empty_zip():
+    data = b"".join(iter_zip([]))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == []
+
+
+def test_write_zip_matches_iter_zip():
+    entries = [("a.txt", b"abc"), ("b.png", b"\x89PNG")]
+    out = io.BytesIO()
+    write_zip(entries, out)
+    with zipfile.ZipFile(out) as zf:
+        assert zf.read("a.txt") == b"abc" and zf.read("b.png") == b"\x89PNG"
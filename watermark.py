@@ -0,0 +1,89 @@
+# watermark.py
+import io
+import threading
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageFont
+
+
+# Pillow's FreeType objects are not safe to draw with from several threads
+_render_lock = threading.Lock()
+
+
+@lru_cache(maxsize=32)
+def load_font(size: int):
+    """Arial at `size` (fallback: Pillow's default bitmap font), loaded once per size."""
+    try:
+        return ImageFont.truetype("arial.ttf", size=size)
+    except Exception:
+        return ImageFont.load_default()
+
+
+@lru_cache(maxsize=128)
+def render_watermark_stamp(text: str, font_size: int = 48, opacity: float = 0.3,
+                           rotation: float = 45) -> Tuple[bytes, int, int]:
+    """
+    Draw `text` in grey on a transparent image, rotate it and PNG-encode it.
+    Returns (png_bytes, width, height). Cached across requests by all four
+    parameters, so repeated jobs with the same watermark skip the drawing.
+    """
+    with _render_lock:
+        font = load_font(font_size)
+
+        # Measure text
+        tmp_draw = ImageDraw.Draw(Image.new("RGBA", (10, 10), (0, 0, 0, 0)))
+        l, t, r, b = tmp_draw.textbbox((0, 0), text, font=font)
+        text_w, text_h = r - l, b - t
+
+        # Draw text onto a transparent image with small padding
+        pad = 20
+        txt_img = Image.new("RGBA", (text_w + 2 * pad, text_h + 2 * pad), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(txt_img)
+        alpha = max(0, min(255, int(opacity * 255)))
+        draw.text((pad, pad), text, font=font, fill=(128, 128, 128, alpha))
+
+        # Rotate to any angle
+        rotated = txt_img.rotate(rotation, expand=True, resample=Image.BICUBIC)
+
+    # Encode rotated image as PNG (preserves transparency)
+    buf = io.BytesIO()
+    rotated.save(buf, format="PNG")
+    return buf.getvalue(), rotated.width, rotated.height
+
+
+def _stamp_rect(page_rect, stamp_w: int, stamp_h: int) -> fitz.Rect:
+    """Scale the stamp to ~60% of the page width (keep aspect ratio) and center it."""
+    page_w, page_h = page_rect.width, page_rect.height
+    target_w = page_w * 0.6
+    target_h = stamp_h * (target_w / stamp_w)
+    x0 = page_rect.x0 + (page_w - target_w) / 2
+    y0 = page_rect.y0 + (page_h - target_h) / 2
+    return fitz.Rect(x0, y0, x0 + target_w, y0 + target_h)
+
+
+def stamp_text_watermark(doc, text: str, font_size=48, opacity=0.3, rotation=45,
+                         progress: Optional[Callable[[int, int], None]] = None) -> None:
+    """
+    Put a centered, rotated text watermark on every page of `doc`.
+
+    The stamp is rendered once and embedded once: the first page inserts the
+    PNG, every other page references the same image xref. Output size and run
+    time therefore barely depend on the number of pages.
+    """
+    png, stamp_w, stamp_h = render_watermark_stamp(text, font_size, opacity, rotation)
+    xref = 0
+    rects = {}  # page size -> placement rect
+    total = doc.page_count
+    for page in doc:
+        rect = page.rect
+        key = (round(rect.width, 2), round(rect.height, 2), rect.x0, rect.y0)
+        if key not in rects:
+            rects[key] = _stamp_rect(rect, stamp_w, stamp_h)
+        if xref:
+            page.insert_image(rects[key], xref=xref, keep_proportion=True, overlay=True)
+        else:
+            xref = page.insert_image(rects[key], stream=png, keep_proportion=True, overlay=True)
+        if progress:
+            progress(page.number + 1, total)
@@ -0,0 +1,67 @@
+# zipstream.py
+import io
+import zipfile
+from typing import Iterable, Iterator, Tuple
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only, non-seekable target for ZipFile.
+    Collects whatever the zip writer produced since the last drain().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Already-compressed formats gain nothing from deflate; store them as-is
+STORED_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".zip", ".docx", ".gz")
+
+
+def _compress_type_for(name: str, stored_suffixes: Tuple[str, ...] = STORED_SUFFIXES) -> int:
+    return zipfile.ZIP_STORED if name.lower().endswith(stored_suffixes) else zipfile.ZIP_DEFLATED
+
+
+def iter_zip(entries: Iterable[Tuple[str, bytes]],
+             stored_suffixes: Tuple[str, ...] = STORED_SUFFIXES) -> Iterator[bytes]:
+    """
+    Build a ZIP from (name, data) pairs and yield it chunk by chunk.
+    Each entry is flushed as soon as it is written, so only one entry
+    is held in memory at a time. Entries ending in `stored_suffixes` are
+    stored, the rest deflated.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode="w") as zf:
+        for name, data in entries:
+            zf.writestr(name, data, compress_type=_compress_type_for(name, stored_suffixes))
+            chunk = sink.drain()
+            if chunk:
+                yield chunk
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+def write_zip(entries: Iterable[Tuple[str, bytes]], fileobj) -> None:
+    """Same as iter_zip(), but writes into an open binary file object."""
+    for chunk in iter_zip(entries):
+        fileobj.write(chunk)